@@ -58,11 +58,17 @@ Examples
 
 from __future__ import division
 
+import os
 import sys
 import ctypes as ct
 import numpy
 from master_Header_wrapper import *
+import pvcam_planner
+import pvcam_pipeline
 import time
+import collections
+import threading
+import types
 __version__ = '2013.01.18'
 __docformat__ = 'restructuredtext en'
 
@@ -819,14 +825,27 @@ def API():
 #****************************************************************************/
     
     
-    if sys.platform == 'win32':
+    # PVCAM_DRIVER=simulated replaces the dll by the simulated camera of pvcam_sim,
+    # PVCAM_DRIVER=replay by the recording PVCAM_REPLAY played by pvcam_replay
+    _driver = os.environ.get('PVCAM_DRIVER', '')
+    if _driver not in ('', 'simulated', 'replay'):
+        raise ValueError("PVCAM_DRIVER=%r: expected 'simulated', 'replay' or unset" % _driver)
+    if _driver == 'simulated':
+        import pvcam_sim as _pvcam_sim
+        _api = _pvcam_sim.SimulatedPvcam()
+    elif _driver == 'replay':
+        import pvcam_replay as _pvcam_replay
+        _api = _pvcam_replay.ReplayPvcam()
+    elif sys.platform == 'win32':
         _api = ct.windll.LoadLibrary('Pvcam32.dll')
     else:
-        raise NotImplementedError("Only Windows is supported")
+        raise NotImplementedError("Only Windows is supported (or set PVCAM_DRIVER=simulated or replay)")
 
     for _name, _value in locals().items():
 #        print('Hello ' + _name)
         if _name.startswith('pl_'):
+            if _driver in ('simulated', 'replay'):  # python functions, no ctypes prototype
+                continue
             _func = getattr(_api, _name)
             setattr(_func, 'restype', _value[0])
             setattr(_func, 'argtypes', _value[1:])
@@ -837,6 +856,724 @@ def API():
 
 API = API()
 
+# Serialises the driver calls made from several threads (CoolingMonitor samples
+# while another thread acquires): every pl_* call is made with its
+# pl_error_code() under it, so a sample neither runs in the middle of a
+# sequence set up or buffer call nor replaces the error code of a failed call.
+driverLock = threading.RLock()
+
+# Number of PrincetonError raised in this process, by error code
+errorCounts = collections.Counter()
+
+
+class _CallCountingAPI(object):
+    """Forwards everything to the ctypes interface and counts the pl_* calls by name.
+
+    Installed as the module level API while an AcquisitionProfiler counts
+    driver calls, so the Princeton methods do not need to know about it.
+    """
+
+    def __init__(self, api):
+        self._api = api
+        self.counts = collections.Counter()
+
+    def __getattr__(self, name):
+        value = getattr(self._api, name)
+        if name.startswith('pl_'):
+            counts = self.counts
+            function = value
+
+            def counted(*args):
+                counts[name] += 1
+                return function(*args)
+            value = counted
+        setattr(self, name, value)  # next lookups do not go through __getattr__
+        return value
+
+
+_callCounting = None
+_callCountingUsers = 0
+
+
+def _startCallCounting():
+    """Installs the call counting proxy around API (shared by all the profilers)."""
+    global API, _callCounting, _callCountingUsers
+    if _callCounting is None:
+        _callCounting = _CallCountingAPI(API)
+        API = _callCounting
+    _callCountingUsers += 1
+    return _callCounting
+
+
+def _unlinkAPI(proxy):
+    """Removes a proxy (with an _api attribute) from the chain of wrappers around API.
+
+    The proxy may sit anywhere in the chain: the wrapper above it then forwards
+    to the API below it and forgets the pl_* functions it had bound to it.
+    """
+    global API
+    if API is proxy:
+        API = proxy._api
+        return
+    outer = API
+    while getattr(outer, '_api', None) is not None:
+        if outer._api is proxy:
+            outer._api = proxy._api
+            for name in [name for name in vars(outer) if name.startswith('pl_')]:
+                delattr(outer, name)
+            return
+        outer = outer._api
+
+
+def _stopCallCounting():
+    global _callCounting, _callCountingUsers
+    _callCountingUsers -= 1
+    if _callCountingUsers <= 0 and _callCounting is not None:
+        _unlinkAPI(_callCounting)
+        _callCounting = None
+        _callCountingUsers = 0
+
+
+class AcquisitionRecord(object):
+    """Timing of one acquisition.
+
+    marks : list of (phase, time.perf_counter()) in the order the phases ended
+    start : time.perf_counter() at the beginning of the acquisition
+    calls : collections.Counter of the pl_* calls done during the acquisition
+    polls : number of status checks done while waiting for the camera
+    """
+    __slots__ = ('start', 'marks', 'calls', 'polls', '_countsAtStart')
+
+    def __init__(self, countsAtStart=None):
+        self.marks = []
+        self.calls = collections.Counter()
+        self.polls = 0
+        self._countsAtStart = countsAtStart
+        self.start = time.perf_counter()
+
+    def mark(self, phase):
+        """Ends the phase named phase now."""
+        self.marks.append((phase, time.perf_counter()))
+
+    def poll(self):
+        self.polls += 1
+
+    @property
+    def durations(self):
+        """OrderedDict phase: duration (second) since the end of the previous phase."""
+        durations = collections.OrderedDict()
+        previous = self.start
+        for phase, t in self.marks:
+            durations[phase] = durations.get(phase, 0.) + t - previous
+            previous = t
+        return durations
+
+    @property
+    def total(self):
+        """Duration (second) of the whole acquisition."""
+        if not self.marks:
+            return 0.
+        return self.marks[-1][1] - self.start
+
+    def asdict(self):
+        return {'start': self.start,
+                'total': self.total,
+                'durations': dict(self.durations),
+                'calls': dict(self.calls),
+                'polls': self.polls}
+
+
+class _NoRecord(object):
+    """Stands for an AcquisitionRecord when profiling is off."""
+    __slots__ = ()
+
+    def mark(self, phase):
+        pass
+
+    def poll(self):
+        pass
+
+
+_NO_RECORD = _NoRecord()
+
+
+class AcquisitionProfiler(object):
+    """Keeps the AcquisitionRecord of the last acquisitions of a camera.
+
+    Parameters
+    ----------
+    history : number of acquisitions kept for the statistics
+    countCalls : count the pl_* calls of each acquisition
+    """
+
+    def __init__(self, history=1000, countCalls=True):
+        self.records = collections.deque(maxlen=history)
+        self._counter = _startCallCounting() if countCalls else None
+
+    def begin(self):
+        if self._counter is None:
+            return AcquisitionRecord()
+        return AcquisitionRecord(collections.Counter(self._counter.counts))
+
+    def end(self, record):
+        if self._counter is not None:
+            record.calls = self._counter.counts - record._countsAtStart
+        self.records.append(record)
+
+    def close(self):
+        """Stops counting the driver calls."""
+        if self._counter is not None:
+            _stopCallCounting()
+            self._counter = None
+
+    @property
+    def last(self):
+        """AcquisitionRecord of the last acquisition, None if there is none."""
+        return self.records[-1] if self.records else None
+
+    @property
+    def phases(self):
+        """Names of the phases, in order of appearance."""
+        phases = []
+        for record in self.records:
+            for phase, t in record.marks:
+                if phase not in phases:
+                    phases.append(phase)
+        return phases
+
+    def durations(self, phase):
+        """numpy array with the duration (second) of phase in the recorded acquisitions."""
+        return numpy.array([r.durations[phase] for r in self.records if phase in r.durations])
+
+    def histogram(self, phase, bins=20):
+        """numpy.histogram of the durations (second) of phase."""
+        return numpy.histogram(self.durations(phase), bins=bins)
+
+    def summary(self):
+        """dict phase: dict with count, mean, median, p95 and max durations (second)."""
+        summary = collections.OrderedDict()
+        for phase in self.phases + ['total']:
+            if phase == 'total':
+                d = numpy.array([r.total for r in self.records])
+            else:
+                d = self.durations(phase)
+            if len(d):
+                summary[phase] = {'count': len(d),
+                                  'mean': float(d.mean()),
+                                  'median': float(numpy.median(d)),
+                                  'p95': float(numpy.percentile(d, 95)),
+                                  'max': float(d.max())}
+        return summary
+
+    def callCounts(self):
+        """collections.Counter of the pl_* calls of all the recorded acquisitions."""
+        total = collections.Counter()
+        for record in self.records:
+            total.update(record.calls)
+        return total
+
+
+TriggeredFrame = collections.namedtuple('TriggeredFrame', 'index trigger timestamp images')
+TriggeredFrame.__doc__ = """One exposure of a TriggeredRun.
+
+index : number of the frame in the run (0 to count - 1)
+trigger : index of the trigger that started it (differs from index after
+    missed triggers, see TriggeredRun)
+timestamp : time.time() of the status check that saw the frame read out
+images : list (one per ROI) of numpy arrays (rows, columns) of uint16,
+    views of the pixel stream of the run
+"""
+
+
+ExposureTiming = collections.namedtuple('ExposureTiming', 'dates durations source hostDurations')
+ExposureTiming.__doc__ = """Timing of all the exposures of a buffer (see Princeton.bufferGetExposureTiming).
+
+dates : numpy array of datetime64[ms], date of each exposure (local time)
+durations : numpy array of float64, exposure time of each exposure in second
+source : 'driver' if the durations come from pl_buf_get_exp_time,
+    'configured' if they are the exposure time set for the sequence
+hostDurations : numpy array of float64, second per exposure estimated from the
+    host times of the status transitions of the sequence (they include the
+    readout and the polling), NaN if unknown
+"""
+
+# pl_exp_setup_seq takes the number of exposures as an uns16
+SEQUENCE_MAX_FRAMES = 65535
+
+# default memory (bytes) of the two pixel streams of streamSequence
+SEQUENCE_MEMORY_LIMIT = 256 * 2**20
+
+# time.time() at time.perf_counter() == 0, to date the status transitions 
+# with the resolution of perf_counter
+_HOST_EPOCH = time.time() - time.perf_counter()
+
+
+class TriggeredRun(object):
+    """Run of count externally triggered exposures, set up once.
+
+    Made (and armed) by Princeton.armTriggeredRun(). Iterating over it yields
+    a TriggeredFrame for each exposure as soon as it is read out; the
+    sequence is finished after the last one.
+
+    Parameters
+    ----------
+    camera : Princeton
+    count : number of exposures (1 to 65535)
+    mode : ExposureMode.strobed (every exposure waits for a trigger),
+        ExposureMode.triggerFirst or ExposureMode.bulb
+    triggerPeriod : second between two triggers, if known. The triggers
+        that came while the camera was busy are then found from the
+        timestamps (they must be spaced by more than pollInterval).
+    timeout : second without a new frame after which the run is aborted
+        (None to wait forever)
+    pollInterval : second between two status checks
+
+    Attributes
+    ----------
+    received : number of frames delivered
+    missed : indices of the triggers without a frame (needs triggerPeriod)
+    timedOut : True if the run was aborted by the timeout
+    """
+
+    TRIGGER_MODES = (ExposureMode.strobed, ExposureMode.triggerFirst, ExposureMode.bulb)
+
+    def __init__(self, camera, count, mode=ExposureMode.strobed, triggerPeriod=None, timeout=None, pollInterval=0.0005):
+        if mode not in self.TRIGGER_MODES:
+            raise ValueError("{mode} is not a triggered exposure mode".format(mode=mode))
+        if not 0 < count <= 65535:
+            raise ValueError("count should be between 1 and 65535, not {count}".format(count=count))
+        self.camera = camera
+        self.count = count
+        self.mode = mode
+        self.triggerPeriod = triggerPeriod
+        self.timeout = timeout
+        self.pollInterval = pollInterval
+        self.received = 0
+        self.missed = []
+        self.timedOut = False
+        self._lastTrigger = -1
+        self._triggerZero = None  # estimated time of the trigger 0
+        self._shapes = [((p2 - p1 + 1) // pbin, (s2 - s1 + 1) // sbin) for (s1, s2, sbin, p1, p2, pbin) in camera.ROI]
+        self._frameSize = sum([rows * columns for rows, columns in self._shapes])
+        # setup for the whole run
+        exposureMode, numberPicturesToTake = camera.exposureMode, camera.numberPicturesToTake
+        camera.exposureMode, camera.numberPicturesToTake = mode, count
+        try:
+            sizeStream = camera.setupExposureSequential()
+        finally:
+            camera.exposureMode, camera.numberPicturesToTake = exposureMode, numberPicturesToTake
+        if not camera._currentBuffer.value == 0:  # only the pixel stream is used
+            camera.bufferFree(camera._currentBuffer)
+            camera._currentBuffer = int16(0)
+        self._stream = camera.startExposureSequential(sizeStream)
+        self._pixels = numpy.frombuffer(self._stream, dtype=numpy.uint16, count=count * self._frameSize)
+        self._active = True
+        self.armed = time.time()
+        camera.telemetry.acquisitions += 1
+
+    def _frame(self, index, trigger, timestamp):
+        images = []
+        offset = index * self._frameSize
+        for rows, columns in self._shapes:
+            images.append(self._pixels[offset:offset + rows * columns].reshape(rows, columns))
+            offset += rows * columns
+        return TriggeredFrame(index, trigger, timestamp, images)
+
+    def _lastTriggerOf(self, number, timestamp):
+        """Trigger index of the last of number frames seen at timestamp."""
+        last = self._lastTrigger + number
+        if self.triggerPeriod is None:
+            return last
+        if self._triggerZero is None:
+            self._triggerZero = timestamp - last * self.triggerPeriod
+            return last
+        return max(last, int(round((timestamp - self._triggerZero) / self.triggerPeriod)))
+
+    def __iter__(self):
+        lastFrame = time.time()
+        try:
+            while self._active and self.received < self.count:
+                with driverLock:  # the error code of a failed readout is read before any other call
+                    (statusString, statusNumber, byteCount) = self.camera.exposureCheckStatus()
+                    timestamp = time.time()
+                    if statusNumber == ReadoutStatus.readoutFailed.value:
+                        self.camera.telemetry.readoutFailures += 1
+                        raise PrincetonError(API.pl_error_code())
+                done = min(byteCount // (2 * self._frameSize), self.count)
+                if done > self.received:
+                    number = done - self.received
+                    last = self._lastTriggerOf(number, timestamp)
+                    self.missed.extend(range(self._lastTrigger + 1, last - number + 1))
+                    self.camera.telemetry.addFrames(number, timestamp)
+                    self.camera.telemetry.droppedFrames += last - number - self._lastTrigger
+                    for i in range(number):
+                        yield self._frame(self.received + i, last - number + 1 + i, timestamp)
+                    self.received = done
+                    self._lastTrigger = last
+                    lastFrame = timestamp
+                elif self.timeout is not None and timestamp - lastFrame > self.timeout:
+                    self.timedOut = True
+                    break
+                else:
+                    time.sleep(self.pollInterval)
+        finally:
+            self.close()
+
+    def close(self):
+        """Finishes the sequence (aborts it if it is not complete)."""
+        if not self._active:
+            return
+        self._active = False
+        if self.received < self.count:
+            self.camera._abortExposure(self._stream)
+        else:
+            self.camera.finishExposureSequential(self._stream)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CoolingMonitor(object):
+    """Samples the temperature of a camera in a background thread.
+
+    CONTROLLER_ALIVE is also read at each sample, if the camera has it.
+
+    The samples are kept in a ring, the last one is available without any
+    driver call (temperature), and waitUntilStable() blocks until the
+    temperature has stayed at the setpoint. The samples are read under
+    driverLock, like every driver call, so the monitor can run during the
+    acquisitions.
+
+    Parameters
+    ----------
+    camera : Princeton
+    interval : second between two samples
+    history : number of samples kept
+
+    Examples
+    --------
+    >>> monitor = camera.startCoolingMonitor(interval=1.)
+    >>> camera.setpoint_temperature = -70
+    >>> monitor.waitUntilStable(tolerance=0.5, holdTime=60.)
+    """
+
+    def __init__(self, camera, interval=1., history=3600):
+        self.camera = camera
+        self.interval = interval
+        self._samples = collections.deque(maxlen=history)  # (time.time(), temperature, setpoint), celcius
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self.errors = 0  # number of failed samples
+        self.lastError = None
+        self.controllerAlive = None  # CONTROLLER_ALIVE at the last sample (None if not available)
+        self._hasControllerAlive = None
+
+    def start(self):
+        """Starts the sampling thread. Returns the monitor."""
+        if not self.running:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='CoolingMonitor')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the sampling thread."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        with self._condition:
+            self._condition.notify_all()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except PrincetonError as error:
+                self.errors += 1
+                self.lastError = error
+            self._stop.wait(self.interval)
+
+    def sample(self):
+        """Reads the temperature and the setpoint now. Returns (time, temperature, setpoint)."""
+        with driverLock:
+            temperature = self.camera.getParameterCurrentValue('TEMP') / 100.
+            setpoint = self.camera.getParameterCurrentValue('TEMP_SETPOINT') / 100.
+            if self._hasControllerAlive is None:
+                self._hasControllerAlive = self.camera.getParameterValue('CONTROLLER_ALIVE', AttributeType.available)
+            if self._hasControllerAlive:
+                self.controllerAlive = bool(self.camera.getParameterCurrentValue('CONTROLLER_ALIVE'))
+        sample = (time.time(), temperature, setpoint)
+        with self._condition:
+            self._samples.append(sample)
+            self._condition.notify_all()
+        return sample
+
+    @property
+    def last(self):
+        """Last (time, temperature, setpoint), None before the first sample."""
+        return self._samples[-1] if self._samples else None
+
+    @property
+    def temperature(self):
+        """Last temperature read (celcius), None before the first sample."""
+        last = self.last
+        return None if last is None else last[1]
+
+    @property
+    def age(self):
+        """Second since the last sample (infinite before the first one)."""
+        last = self.last
+        return float('inf') if last is None else time.time() - last[0]
+
+    def history(self):
+        """numpy array (samples, 3) of time.time(), temperature and setpoint."""
+        return numpy.array(list(self._samples)).reshape(-1, 3)
+
+    def isStable(self, tolerance=0.5, holdTime=30.):
+        """True if the temperature was within tolerance (celcius) of the 
+        setpoint during the last holdTime seconds."""
+        start = time.time() - holdTime
+        with self._condition:  # the samples are appended by the monitor thread
+            for t, temperature, setpoint in reversed(self._samples):
+                if abs(temperature - setpoint) > tolerance:
+                    return False
+                if t <= start:
+                    return True
+        return False  # not sampled for holdTime yet
+
+    def waitUntilStable(self, tolerance=0.5, holdTime=30., timeout=None):
+        """Waits until isStable(tolerance, holdTime).
+        
+        Returns True when stable, False after timeout seconds.
+        """
+        if not self.running:
+            raise RuntimeError("the cooling monitor is not running")
+        end = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while not self.isStable(tolerance, holdTime):
+                if not self.running:
+                    raise RuntimeError("the cooling monitor has been stopped")
+                wait = self.interval
+                if end is not None:
+                    if time.time() >= end:
+                        return False
+                    wait = min(wait, end - time.time())
+                self._condition.wait(max(wait, 0.))
+        return True
+
+
+class CameraTelemetry(object):
+    """Counters and gauges of the health of a camera.
+
+    They are updated by the acquisition functions as they go, so reading them
+    (see pvcam_telemetry) never calls the driver.
+
+    Attributes
+    ----------
+    frames : number of frames acquired
+    acquisitions : number of sequences (takePicture, kinetics, triggered runs...)
+    droppedFrames : frames lost (missed triggers of the triggered runs)
+    readoutFailures : number of ReadoutStatus.readoutFailed seen
+    lastFrameTime : time.time() of the last frame, None before the first one
+    window : second, period over which frameRate() is computed
+    """
+
+    def __init__(self, window=10.):
+        self.started = time.time()
+        self.window = window
+        self.frames = 0
+        self.acquisitions = 0
+        self.droppedFrames = 0
+        self.readoutFailures = 0
+        self.lastFrameTime = None
+        self._frameTimes = collections.deque()  # (time.time(), number of frames)
+        self._lock = threading.Lock()  # frameRate() is read by the scrape thread of pvcam_telemetry
+
+    def addFrames(self, number, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            self.frames += number
+            self.lastFrameTime = timestamp
+            self._frameTimes.append((timestamp, number))
+            while self._frameTimes and self._frameTimes[0][0] < timestamp - self.window:
+                self._frameTimes.popleft()
+
+    def frameRate(self):
+        """Frames per second during the last window seconds."""
+        now = time.time()
+        with self._lock:
+            frames = sum([number for t, number in self._frameTimes if t >= now - self.window])
+        return frames / min(self.window, max(now - self.started, 1e-9))
+
+
+class ParamDescriptor(object):
+    """Description of a PVCAM parameter, decoded from its ID.
+
+    A parameter ID is (TYPE << 24) | (CLASS << 16) | index, so the type
+    of the value, and if the parameter is enumerated, are known without
+    asking the driver (ATTR_TYPE).
+
+    Attributes
+    ----------
+    id : int
+        ID of the parameter (API.PARAM_...)
+    name : str
+        name of the parameter without the 'PARAM_' prefix
+    ctype : ctypes type of the value
+    paramClass : int
+        class of the parameter (API.CLASS...)
+    typeCode : int
+        type of the parameter (API.TYPE_...)
+    isEnum : bool
+        True for the enumerated parameters (value and description)
+    scratch : ctypes value (or string buffer) reused by every pl_get_param
+        and pl_set_param of the parameter in the calling thread, its value is
+        copied right after the call
+    """
+
+    __slots__ = ('id', 'name', 'ctype', 'paramClass', 'typeCode', 'isEnum', '_local')
+
+    # type of the value for each TYPE_ code (enumerated values are read as uns32)
+    CTYPES = {API.TYPE_CHAR_PTR: char_ptr,
+              API.TYPE_INT8: int8,
+              API.TYPE_UNS8: uns8,
+              API.TYPE_INT16: int16,
+              API.TYPE_UNS16: uns16,
+              API.TYPE_INT32: int32,
+              API.TYPE_UNS32: uns32,
+              API.TYPE_UNS64: ct.c_uint64,
+              API.TYPE_FLT64: flt64,
+              API.TYPE_ENUM: uns32,
+              API.TYPE_BOOLEAN: rs_bool,
+              API.TYPE_VOID_PTR: void_ptr,
+              API.TYPE_VOID_PTR_PTR: void_ptr}
+
+    STRING_LENGTH = 255  # size of the buffer of the char_ptr parameters
+
+    def __init__(self, name, paramId):
+        typeCode = (paramId >> 24) & 0xFF
+        ctype = self.CTYPES.get(typeCode, uns32)
+        for attribute, value in (('id', paramId), ('name', name), ('ctype', ctype),
+                                 ('paramClass', (paramId >> 16) & 0xFF), ('typeCode', typeCode),
+                                 ('isEnum', typeCode == API.TYPE_ENUM), ('_local', threading.local())):
+            object.__setattr__(self, attribute, value)
+
+    @property
+    def scratch(self):
+        try:
+            return self._local.scratch
+        except AttributeError:
+            if self.ctype is char_ptr:
+                scratch = ct.create_string_buffer(self.STRING_LENGTH)
+            else:
+                scratch = self.ctype()
+            self._local.scratch = scratch
+            return scratch
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ParamDescriptor is read-only")
+
+    def __repr__(self):
+        return "ParamDescriptor({0!r}, {1})".format(self.name, self.id)
+
+
+def _paramTable(api):
+    """Descriptors of the API.PARAM_... parameters, by name and by ID."""
+    table = {}
+    for name, value in sorted(vars(api).items()):
+        if name.startswith('PARAM_'):
+            descriptor = ParamDescriptor(name[6:], value)
+            table[descriptor.name] = descriptor
+            table[descriptor.id] = descriptor
+    return types.MappingProxyType(table)
+
+
+class PvcamSession(object):
+    """Process-wide PVCAM library session.
+
+    pl_pvcam_init, pl_exp_init_seq and pl_buf_init are called by the first
+    acquire() and the library is uninitialised by the last release(), so
+    several cameras (and PrincetonEnumCamera/PrincetonForceClose) share
+    one initialisation.
+
+    Examples
+    --------
+    >>> with pvcamSession:
+    ...     number = pvcamSession.totalCameras()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self.initDuration = None  # second, duration of the last initialisation
+
+    @property
+    def count(self):
+        """Number of users (acquire() without release())."""
+        return self._count
+
+    def acquire(self):
+        """Initialises the library if needed and adds a user."""
+        with self._lock:
+            if self._count == 0:
+                start = time.perf_counter()
+                with driverLock:
+                    if API.pl_pvcam_init() == 0:
+                        errorcode = API.pl_error_code()
+                        if not errorcode == 2001:  # already initialised (by another program)
+                            raise PrincetonError(errorcode)
+                    if API.pl_exp_init_seq() == 0:
+                        raise PrincetonError(API.pl_error_code())
+                    if API.pl_buf_init() == 0:
+                        raise PrincetonError(API.pl_error_code())
+                self.initDuration = time.perf_counter() - start
+            self._count += 1
+
+    def release(self):
+        """Removes a user, the last one uninitialises the library."""
+        with self._lock:
+            if self._count == 0:
+                return
+            self._count -= 1
+            if self._count == 0:
+                with driverLock:
+                    if API.pl_exp_uninit_seq() == 0:
+                        raise PrincetonError(API.pl_error_code())
+                    if API.pl_buf_uninit() == 0:
+                        raise PrincetonError(API.pl_error_code())
+                    if API.pl_pvcam_uninit() == 0:
+                        raise PrincetonError(API.pl_error_code())
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def totalCameras(self):
+        """Number of cameras detected (the session must be acquired)."""
+        number = int16()
+        with driverLock:
+            if API.pl_cam_get_total(ct.byref(number)) == 0:
+                raise PrincetonError(API.pl_error_code())
+        return number.value
+
+
+pvcamSession = PvcamSession()
+
+
 class Princeton(object):
     """Princeton camera interface.
 
@@ -857,6 +1594,11 @@ class Princeton(object):
     
     numberPicturesToTake = 1
     
+    pollInterval = 0.2  # second, delay between two status checks while waiting for the camera
+    
+    # status after which waiting for a change is pointless (a short exposure can be over at the first check)
+    _endStatus = (ReadoutStatus.readoutComplete_frameAvailable.value, ReadoutStatus.readoutFailed.value)
+    
     PropertyLengthStrings = {'CCD_NAME_LEN':	17,
         'ERROR_MSG_LEN':	255,
         'MAX_ALPHA_SER_NUM_LEN':	32}
@@ -869,223 +1611,14 @@ class Princeton(object):
         5:'Acquisition in progress',
         6:'MAX_CAMERA_STATUS'}
         
-    ParamSet = {'ACCUM_CAPABLE':	184680986,
-        'ADC_OFFSET':	16908483,
-        'ANTI_BLOOMING':	151126309,
-        'BIT_DEPTH':	16908799,
-        'BOF_EOF_CLR':	184745991,
-        'BOF_EOF_COUNT':	117637126,
-        'BOF_EOF_ENABLE':	151191557,
-        'CAMERA_TYPE':	33685854,
-        'CAM_FW_FULL_VERSION':	218235414,
-        'CAM_FW_VERSION':	100794900,
-        'CCS_STATUS':	16908798,
-        'CHIP_NAME':	218235009,
-        'CIRC_BUFFER':	184746283,
-        'CLEAR_CYCLES':	100794465,
-        'CLEAR_MODE':	151126539,
-        'CLN_WHILE_EXPO':	184680800,
-        'COLOR_MODE':	151126520,
-        'CONTROLLER_ALIVE':	184680616,
-        'CONT_CLEARS':	184680988,
-        'COOLING_FAN_CTRL':	151126355,
-        'COOLING_MODE':	151126230,
-        'CUSTOM_CHIP':	184680535,
-        'CUSTOM_TIMING':	184680536,
-        'DD_INFO':	218103813,
-        'DD_INFO_LENGTH':	16777217,
-        'DD_RETRIES':	100663299,
-        'DD_TIMEOUT':	100663300,
-        'DD_VERSION':	100663298,
-        'DIAG':	117571764,
-        'DIAG_P1':	117571765,
-        'DIAG_P2':	117571766,
-        'DIAG_P3':	117571767,
-        'DIAG_P4':	117571768,
-        'DIAG_P5':	117571769,
-        'DITHERING':	184680807,
-        'EDGE_TRIGGER':	151126122,
-        'EXPOSURE_MODE':	151126551,
-        'EXP_MIN_TIME':	67305475,
-        'EXP_RES':	151191554,
-        'EXP_RES_INDEX':	100859908,
-        'EXP_TIME':	100859905,
-        'FRAME_CAPABLE':	184680957,
-        'FTSCAN':	100794427,
-        'FWELL_CAPACITY':	117572090,
-        'GAIN_INDEX':	16908800,
-        'GAIN_MULT_ENABLE':	184680989,
-        'GAIN_MULT_FACTOR':	100794905,
-        'HEAD_COOLING_CTRL':	151126354,
-        'HEAD_SER_NUM_ALPHA':	218235413,
-        'HW_AUTOSTOP':	16973990,
-        'HW_AUTOSTOP32':	33751206,
-        'INTENSIFIER_GAIN':	16908504,
-        'IO_ADDR':	100794895,
-        'IO_BITDEPTH':	100794899,
-        'IO_DIRECTION':	151126545,
-        'IO_STATE':	67240466,
-        'IO_TYPE':	151126544,
-        'KIN_WIN_SIZE':	100794494,
-        'LOGIC_OUTPUT':	151126082,
-        'LOGIC_OUTPUT_INVERT':	184680996,
-        'MIN_BLOCK':	16908348,
-        'MPP_CAPABLE':	151126240,
-        'NUM_MIN_BLOCK':	16908349,
-        'NUM_OF_STRIPS_PER_CLR':	16908386,
-        'PAR_SHIFT_INDEX':	117572131,
-        'PAR_SHIFT_TIME':	117572129,
-        'PAR_SIZE':	100794425,
-        'PBC':	151126367,
-        'PCI_FW_VERSION':	100794902,
-        'PIX_PAR_DIST':	100794868,
-        'PIX_PAR_SIZE':	100794431,
-        'PIX_SER_DIST':	100794869,
-        'PIX_SER_SIZE':	100794430,
-        'PIX_TIME':	100794884,
-        'PMODE':	151126540,
-        'POSTMASK':	100794422,
-        'POSTSCAN':	100794424,
-        'PREAMP_DELAY':	100794870,
-        'PREAMP_OFF_CONTROL':	117572091,
-        'PREEXP_CLEANS':	184680802,
-        'PREFLASH':	100794871,
-        'PREMASK':	100794421,
-        'PRESCAN':	100794423,
-        'READOUT_PORT':	151126263,
-        'READOUT_TIME':	67240115,
-        'SENSOR_TYPE':	33685774,
-        'SERIAL_NUM':	100794876,
-        'SER_SHIFT_TIME':	117572130,
-        'SER_SIZE':	100794426,
-        'SHTR_CLOSE_DELAY':	100794887,
-        'SHTR_CLOSE_DELAY_UNIT':	151126559,
-        'SHTR_GATE_MODE':	151126233,
-        'SHTR_OPEN_DELAY':	100794888,
-        'SHTR_OPEN_MODE':	151126537,
-        'SHTR_RES':	151126359,
-        'SHTR_STATUS':	151126538,
-        'SKIP_AT_ONCE_BLK':	33686040,
-        'SKIP_SREG_CLEAN':	184680778,
-        'SPDTAB_INDEX':	16908801,
-        'SUMMING_WELL':	184680953,
-        'TEMP':	16908813,
-        'TEMP_SETPOINT':	16908814,
-        'TG_OPTION_BD_TYPE':	151126369,
-        'TTL_DIR_CTRL':	33685859,
-        'TTL_LINES':	33685595,
-        'UNIFIED_GAIN':	33685862,
-        'UNIFIED_GAIN_ENABLED':	184680805
-    }
-        
-    ParamType = {API.PARAM_ACCUM_CAPABLE:	rs_bool,
-        API.PARAM_ADC_OFFSET:	int16,
-        API.PARAM_ANTI_BLOOMING:	uns32,
-        API.PARAM_BIT_DEPTH:	int16,
-        API.PARAM_BOF_EOF_CLR:	rs_bool,
-        API.PARAM_BOF_EOF_COUNT:	uns32,
-        API.PARAM_BOF_EOF_ENABLE:	uns32,
-        API.PARAM_CAMERA_TYPE:	int32,
-        API.PARAM_CAM_FW_FULL_VERSION:	char_ptr,
-        API.PARAM_CAM_FW_VERSION:	uns16,
-        API.PARAM_CCS_STATUS:	int16,
-        API.PARAM_CHIP_NAME:	char_ptr,
-        API.PARAM_CIRC_BUFFER:	rs_bool,
-        API.PARAM_CLEAR_CYCLES:	uns16,
-        API.PARAM_CLEAR_MODE:	uns32,
-        API.PARAM_CLN_WHILE_EXPO:	boolean,
-        API.PARAM_COLOR_MODE:	uns32,
-        API.PARAM_CONTROLLER_ALIVE:	rs_bool,
-        API.PARAM_CONT_CLEARS:	boolean,
-        API.PARAM_COOLING_FAN_CTRL:	uns32,
-        API.PARAM_COOLING_MODE:	uns32,
-        API.PARAM_CUSTOM_CHIP:	rs_bool,
-        API.PARAM_CUSTOM_TIMING:	rs_bool,
-        API.PARAM_DD_INFO:	char_ptr,
-        API.PARAM_DD_INFO_LENGTH:	int16,
-        API.PARAM_DD_RETRIES:	uns16,
-        API.PARAM_DD_TIMEOUT:	uns16,
-        API.PARAM_DD_VERSION:	uns16,
-        API.PARAM_DIAG:	uns32,
-        API.PARAM_DIAG_P1:	uns32,
-        API.PARAM_DIAG_P2:	uns32,
-        API.PARAM_DIAG_P3:	uns32,
-        API.PARAM_DIAG_P4:	uns32,
-        API.PARAM_DIAG_P5:	uns32,
-        API.PARAM_DITHERING:	uns32,
-        API.PARAM_EDGE_TRIGGER:	uns32,
-        API.PARAM_EXPOSURE_MODE:	uns32,
-        API.PARAM_EXP_MIN_TIME:	flt64,
-        API.PARAM_EXP_RES:	uns32,
-        API.PARAM_EXP_RES_INDEX:	uns16,
-        API.PARAM_EXP_TIME:	uns16,  # max 65535
-        API.PARAM_FRAME_CAPABLE:	rs_bool,
-        API.PARAM_FTSCAN:	uns16,
-        API.PARAM_FWELL_CAPACITY:	uns32,
-        API.PARAM_GAIN_INDEX:	int16,
-        API.PARAM_GAIN_MULT_ENABLE:	rs_bool,
-        API.PARAM_GAIN_MULT_FACTOR:	uns16,
-        API.PARAM_HEAD_COOLING_CTRL:	uns32,
-        API.PARAM_HEAD_SER_NUM_ALPHA:	char_ptr,
-        API.PARAM_HW_AUTOSTOP:	int16,
-        API.PARAM_HW_AUTOSTOP32:	int32,
-        API.PARAM_INTENSIFIER_GAIN:	int16,
-        API.PARAM_IO_ADDR:	uns16,
-        API.PARAM_IO_BITDEPTH:	uns16,
-        API.PARAM_IO_DIRECTION:	uns32,
-        API.PARAM_IO_STATE:	flt64,
-        API.PARAM_IO_TYPE:	uns32,
-        API.PARAM_KIN_WIN_SIZE:	uns16,
-        API.PARAM_LOGIC_OUTPUT:	uns32,
-        API.PARAM_LOGIC_OUTPUT_INVERT:	rs_bool,
-        API.PARAM_MIN_BLOCK:	int16,
-        API.PARAM_MPP_CAPABLE:	uns32,
-        API.PARAM_NUM_MIN_BLOCK:	int16,
-        API.PARAM_NUM_OF_STRIPS_PER_CLR:	int16,
-        API.PARAM_PAR_SHIFT_INDEX:	uns32,
-        API.PARAM_PAR_SHIFT_TIME:	int16,
-        API.PARAM_PAR_SIZE:	uns16,
-        API.PARAM_PBC:	uns32,
-        API.PARAM_PCI_FW_VERSION:	uns16,
-        API.PARAM_PIX_PAR_DIST:	uns16,
-        API.PARAM_PIX_PAR_SIZE:	uns16,
-        API.PARAM_PIX_SER_DIST:	uns16,
-        API.PARAM_PIX_SER_SIZE:	uns16,
-        API.PARAM_PIX_TIME:	uns16,
-        API.PARAM_PMODE:	uns32,
-        API.PARAM_POSTMASK:	uns16,
-        API.PARAM_POSTSCAN:	uns16,
-        API.PARAM_PREAMP_DELAY:	uns16,
-        API.PARAM_PREAMP_OFF_CONTROL:	uns32,
-        API.PARAM_PREEXP_CLEANS:	boolean,
-        API.PARAM_PREFLASH:	uns16,
-        API.PARAM_PREMASK:	uns16,
-        API.PARAM_PRESCAN:	uns16,
-        API.PARAM_READOUT_PORT:	uns32,
-        API.PARAM_READOUT_TIME:	flt64,
-        API.PARAM_SENSOR_TYPE:	int32,
-        API.PARAM_SERIAL_NUM:	uns16,
-        API.PARAM_SER_SHIFT_TIME:	int16,
-        API.PARAM_SER_SIZE:	uns16,
-        API.PARAM_SHTR_CLOSE_DELAY:	uns16,
-        API.PARAM_SHTR_CLOSE_DELAY_UNIT:	uns32,
-        API.PARAM_SHTR_GATE_MODE:	uns32,
-        API.PARAM_SHTR_OPEN_DELAY:	uns16,
-        API.PARAM_SHTR_OPEN_MODE:	uns32,
-        API.PARAM_SHTR_RES:	uns32,
-        API.PARAM_SHTR_STATUS:	uns32,
-        API.PARAM_SKIP_AT_ONCE_BLK:	int32,
-        API.PARAM_SKIP_SREG_CLEAN:	boolean,
-        API.PARAM_SPDTAB_INDEX:	int16,
-        API.PARAM_SUMMING_WELL:	rs_bool,
-        API.PARAM_TEMP:	int16,
-        API.PARAM_TEMP_SETPOINT:	int16,
-        API.PARAM_TG_OPTION_BD_TYPE:	uns32,
-        API.PARAM_TTL_DIR_CTRL:	int32,
-        API.PARAM_TTL_LINES:	int32,
-        API.PARAM_UNIFIED_GAIN:	int32,
-        API.PARAM_UNIFIED_GAIN_ENABLED:	boolean
-    }
+    # descriptors of the parameters by name and by ID (see ParamDescriptor)
+    ParamTable = _paramTable(API)
+    # descriptors of the IDs that are not defined in API, made at first use
+    _unknownParams = {}
+    
+    # name: ID and ID: ctypes type of the parameters
+    ParamSet = dict((key, d.id) for key, d in ParamTable.items() if isinstance(key, str))
+    ParamType = dict((d.id, d.ctype) for d in ParamTable.values())
     
     ParamCType = {
         13:'char_ptr',
@@ -1123,49 +1656,85 @@ class Princeton(object):
         number : int
             Camera number. Must be in range 0 through PrincetonNumCameras()-1.
 
+        Calling it again on an opened camera closes and reopens the camera,
+        with the same reference to the PVCAM session.
         """
-        # Initialise the camera
-        res = API.pl_pvcam_init()
-        if res == 0:
-            errorcode = API.pl_error_code()
-            if not errorcode == 2001:
-                raise PrincetonError(errorcode)
-        self.exposureInitSequential()
-        self.bufferInit()
+        reopening = getattr(self, '_sessionHeld', False)
+        if reopening:
+            self._releaseCamera()
+        # Values read by getParameterValue for the attributes that do not
+        # have the type of the parameter, and descriptions of the enumerated values
+        self._attributeValues = {AttributeType.count: uns32(),
+                                 AttributeType.typeValue: uns16(),
+                                 AttributeType.access: uns16(),
+                                 AttributeType.available: rs_bool()}
+        self._enumDescriptions = {}
+        # pl_buf_get_exp_date/time arguments of bufferGetExposureTiming
+        self._dateScratch = (int16(), uns8(), uns8(), uns8(), uns8(), uns8(), uns16(), uns32())
+        self._dateArguments = tuple(ct.byref(c) for c in self._dateScratch)
+        self._statusTimes = []  # (status, host time) of the last sequence
+        
+        self._access = {}  # access of the parameters, ID: ATTR_ACCESS
+        self._currentValues = {}  # last value read or written, ID: value (see getParameterCachedValue)
+        self.telemetry = CameraTelemetry()
+        self._validParameters = None  # found at first use (~100 driver calls)
+        self.timeToFirstFrame = None
+        self._openStart = time.perf_counter()
+        
+        # Initialise the library (shared by all the cameras)
+        if not reopening:
+            pvcamSession.acquire()
+            self._sessionHeld = True
+        self._currentBuffer = int16(0)
+        self._coolingMonitor = None
         self._camname = ""
         self._handle = int16(0)
         camname = ct.create_string_buffer(CAM_NAME_LEN)
         phandle = int16_ptr(int16(0))
-        if API.pl_cam_get_name(number, camname) == 0:
-            raise PrincetonError(API.pl_error_code())
-        self._camname = camname.value
-        if API.pl_cam_open(camname, phandle, API.OPEN_EXCLUSIVE) == 0:
-            raise PrincetonError(API.pl_error_code())
+        try:
+            with driverLock:
+                if API.pl_cam_get_name(number, camname) == 0:
+                    raise PrincetonError(API.pl_error_code())
+                if API.pl_cam_open(camname, phandle, API.OPEN_EXCLUSIVE) == 0:
+                    raise PrincetonError(API.pl_error_code())
+            self._camname = camname.value
+        except PrincetonError:
+            self._releaseSession()
+            raise
         self._handle = phandle.contents
         
-        # List of valid parameters for this perticular camera
-        self._valid_parameters = self._EnumParam()
-        
-#       Set the default exposure time
-        self.setExposureTime(1, ExposureUnits.microsecond)
-        self.setParameterValue('EXP_TIME', self.expTime)
+        try:
+#           Set the default exposure time
+            self.setExposureTime(1, ExposureUnits.microsecond)
 
-#       Set the camera ROI
-        Camerasizes, Camerasizep = self.getCameraSize()
-        bins = 1  # for ROIfull
-        binp = 1  # for ROIfull
-        self._ROIfull = (0, Camerasizes-1, bins, 0, Camerasizep-1, binp)  # full detector acquisition
-        self._ROIspectroscopy = (0, Camerasizes-1, bins, 0, Camerasizep-1, Camerasizep)  # spectroscopy mode ("vertical" binning)
-        self._ROI = []  # initialise empty ROI
-        self.addExposureROI(self._ROIfull)  # set ROI to full (2D)
+#           Set the camera ROI
+            self._cameraSize = None
+            Camerasizes, Camerasizep = self.getCameraSize()
+            bins = 1  # for ROIfull
+            binp = 1  # for ROIfull
+            self._ROIfull = (0, Camerasizes-1, bins, 0, Camerasizep-1, binp)  # full detector acquisition
+            self._ROIspectroscopy = (0, Camerasizes-1, bins, 0, Camerasizep-1, Camerasizep)  # spectroscopy mode ("vertical" binning)
+            self._ROI = []  # initialise empty ROI
+            self.addExposureROI(self._ROIfull)  # set ROI to full (2D)
+        except Exception:
+            with driverLock:
+                API.pl_cam_close(self._handle)
+            self._releaseSession()
+            raise
 
 #       Set the exposure mode
         self._exposureMode = ExposureMode.timed
         
-        self._currentBuffer = int16(0) 
         self._circularBufferMode = CircularBufferMode.overwrite
         self.abortMode = CameraControlState.clearCloseShutter
         self._continuousPixelStream = None
+        self._profiler = None
+        self._timing = None  # pvcam_planner.CameraTiming, see cameraTiming
+        # (frames, exposure, rois, speed, duration) of the last sequences, for the planner
+        self._sequences = collections.deque(maxlen=20)
+        # pvcam_calibration.CalibrationStore correcting the images of convertStream, None for raw images
+        self.calibrationStore = None
+        self.openDuration = time.perf_counter() - self._openStart  # second, camera ready
     
 #==============================================================================
 #     Class 0 functions
@@ -1176,11 +1745,13 @@ class Princeton(object):
         self.getCameraNameWithNumber(number)
         phandle = int16_ptr(int16(0))
         camname = ct.create_string_buffer(self._camname)
-        if API.pl_cam_open(camname, phandle, API.OPEN_EXCLUSIVE) == 0:
-            if self.getLastErrorForCamera() == 117:
-                print('Camera already opened')
-                return
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_cam_open(camname, phandle, API.OPEN_EXCLUSIVE) == 0:
+                errorcode = API.pl_error_code()
+                if errorcode == 117:
+                    print('Camera already opened')
+                    return
+                raise PrincetonError(errorcode)
         self._handle = phandle.contents
         return
         
@@ -1192,14 +1763,18 @@ class Princeton(object):
             Camera number. Must be in range 0 through PrincetonNumCameras()-1.
         """
         camname = ct.create_string_buffer(CAM_NAME_LEN)
-        if API.pl_cam_get_name(number, camname) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_cam_get_name(number, camname) == 0:
+                raise PrincetonError(API.pl_error_code())
         self._camname = camname.value
         return self._camname
         
     def getCameraSize(self):
         """Returns the detector's dimensions in pixels."""
-        return self.getParameterCurrentValue(API.PARAM_SER_SIZE), self.getParameterCurrentValue(API.PARAM_PAR_SIZE)   
+        if self._cameraSize is None:
+            self._cameraSize = (self.getParameterCurrentValue(API.PARAM_SER_SIZE),
+                                self.getParameterCurrentValue(API.PARAM_PAR_SIZE))
+        return self._cameraSize
         
     def getCameraName(self):
         """Returns the name of the camera given by the program."""
@@ -1207,44 +1782,61 @@ class Princeton(object):
         
     def close(self):
         """Closes all (connection to Princeton camera, pvcam, sequence mode, bufferfunctions)."""
+        try:
+            self._releaseCamera()
+        finally:
+            self._releaseSession()
+
+    def _releaseCamera(self):
+        """Frees the buffer and closes the camera if it is opened."""
         if not self._currentBuffer.value == 0:
             self.bufferFree(self._currentBuffer)
-        self.closeCamera()
-        self.exposureUninit()
-        self.bufferUninit()
-        self.uninitPVCAM()
+        if self.checkValidHandle():
+            self.closeCamera()
+
+    def _releaseSession(self):
+        """Gives back the reference to the PVCAM session taken by __init__ (once)."""
+        if self._sessionHeld:
+            self._sessionHeld = False
+            pvcamSession.release()
             
     def closeCamera(self):
         """Close connection to Princeton camera."""
-        if API.pl_cam_close(self._handle) == 0:
-            raise PrincetonError(API.pl_error_code())
+        self.stopCoolingMonitor()
+        with driverLock:
+            if API.pl_cam_close(self._handle) == 0:
+                raise PrincetonError(API.pl_error_code())
             
     
     def checkValidHandle(self):
         """Checks that the handle of the camera is a valid one."""
-        return API.pl_cam_check(self._handle) == 1
+        with driverLock:
+            return API.pl_cam_check(self._handle) == 1
     
     def checkCameraOK(self):
         """Checks that there is no problem with the camera that would prevent
         from taking a picture.
         """
-        if API.pl_cam_get_diags(self._handle) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_cam_get_diags(self._handle) == 0:
+                raise PrincetonError(API.pl_error_code())
         return True
         
         
     def getTotalNumberCamera(self):
         """Returns the number of camera detected or raises an error."""
         some_int = int16()
-        if API.pl_cam_get_total(ct.byref(some_int)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_cam_get_total(ct.byref(some_int)) == 0:
+                raise PrincetonError(API.pl_error_code())
         return some_int.value
     
     def getDDIversion(self):
         """Returns the version number of the current DDI (device driver interface)."""
         ddi = uns16()
-        if API.pl_ddi_get_ver(ct.byref(ddi)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_ddi_get_ver(ct.byref(ddi)) == 0:
+                raise PrincetonError(API.pl_error_code())
         return ddi.value
             
     
@@ -1252,23 +1844,26 @@ class Princeton(object):
         """Checks that there is no problem with the camera that would prevent
         from taking a picture.
         """
-        if API.pl_pvcam_init() == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_pvcam_init() == 0:
+                raise PrincetonError(API.pl_error_code())
             
     def uninitPVCAM(self):
         """Checks that there is no problem with the camera that would prevent
         from taking a picture.
         """
-        if API.pl_pvcam_uninit() == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_pvcam_uninit() == 0:
+                raise PrincetonError(API.pl_error_code())
             
     def versionPVCAM(self):
         """Checks that there is no problem with the camera that would prevent
         from taking a picture.
         """
         v = uns16()
-        if API.pl_pvcam_get_ver(ct.byref(v)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_pvcam_get_ver(ct.byref(v)) == 0:
+                raise PrincetonError(API.pl_error_code())
         return v.value 
         
 #==============================================================================
@@ -1301,40 +1896,52 @@ class Princeton(object):
 #     Class 2 functions
 #==============================================================================
             
+    def _descriptor(self, parameter):
+        """Return the ParamDescriptor of parameter.
+        
+        Parameters
+        ----------
+        parameter : string, long or ParamDescriptor that defines the parameter
+            Name/ID of the parameter. All possible names are in the 
+            dictionary Princeton.ParamSet.
+        """
+        try:
+            return self.ParamTable[parameter]
+        except (KeyError, TypeError):
+            pass
+        if isinstance(parameter, ParamDescriptor):
+            return parameter
+        if isinstance(parameter, str):
+            raise PrincetonError(2018)
+        paramId = int(parameter)  # ID not defined in API
+        descriptor = self._unknownParams.get(paramId)
+        if descriptor is None:
+            descriptor = self._unknownParams.setdefault(paramId, ParamDescriptor(str(paramId), paramId))
+        return descriptor
+            
     def _getEnumeratedParameter(self, parameter, index, length):
-        """Return the current value of the parameter defined by parameter.
+        """Return the description and the value of the entry index of the 
+        enumerated parameter defined by parameter.
         
         Parameters
         ----------
-        parameter : string or long that defines the parameter
+        parameter : string, long or ParamDescriptor that defines the parameter
             Name of the parameter to read. All possible names are in the 
             dictionary Princeton.ParamSet.
-        mode : one of the enumerated type AttributeType :
-            currentValue = 0
-            count = 1
-            typeValue = 2
-            minValue = 3
-            maxValue = 4
-            defaultValue = 5
-            increment = 6
-            access = 7
-            available = 8
-            or the corresponding int
+        index : int, index of the entry (0 to count - 1)
+        length : int, length of the description (see _enumDescriptionLength)
 
         Returns
         ----------
-        The value of the parameter in the right type
+        (description, value)
         """
-        paramCode = parameter
-        if type(parameter) == str:
-            if parameter not in self.ParamSet:
-                raise PrincetonError(2018)
-            paramCode = self.ParamSet.get(parameter)
+        paramCode = self._descriptor(parameter).id
         description = ct.create_string_buffer(length)
         indexC = uns32(index)
         valueEnum = int32()
-        if API.pl_get_enum_param(self._handle, paramCode, indexC, ct.byref(valueEnum), description, length) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_get_enum_param(self._handle, paramCode, indexC, ct.byref(valueEnum), description, length) == 0:
+                raise PrincetonError(API.pl_error_code())
         return (description.value, valueEnum.value)
         
     def _enumDescriptionLength(self, parameter, index):
@@ -1342,7 +1949,7 @@ class Princeton(object):
         
         Parameters
         ----------
-        parameter : string or long that defines the parameter
+        parameter : string, long or ParamDescriptor that defines the parameter
             Name of the parameter to read. All possible names are in the 
             dictionary Princeton.ParamSet.
         index : the int corresponding to the value at which we want to look for the descriptive string
@@ -1351,26 +1958,26 @@ class Princeton(object):
         ----------
         The length of the char buffer to allocate
         """
-        paramCode = parameter
-        if type(parameter) == str:
-            if parameter not in self.ParamSet:
-                raise PrincetonError(2018)
-            paramCode = self.ParamSet.get(parameter)
+        paramCode = self._descriptor(parameter).id
         indexC = uns32(index)
         lengthC = uns32()
-        if API.pl_enum_str_length(self._handle, paramCode, indexC, ct.byref(lengthC)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_enum_str_length(self._handle, paramCode, indexC, ct.byref(lengthC)) == 0:
+                raise PrincetonError(API.pl_error_code())
         return lengthC.value
         
             
     def getEnumeratedParameterAsString(self, paramCode, value):
         """Return the string that corresponds to the value of the parameter 
         defined by paramCode. This works only if paramCode is of type enumerated.
+        
+        The descriptions of all the values of the parameter are read from 
+        the camera the first time and kept.
 
         
         Parameters
         ----------
-        paramCode : long that defines the parameter
+        paramCode : string, long or ParamDescriptor that defines the parameter
             ID of the parameter to read. All possible names/ID are in the 
             dictionary Princeton.ParamSet.
         value : python int which is returned by the bare function to get the parameter 
@@ -1381,22 +1988,23 @@ class Princeton(object):
         description : string that describes the value of the parameter
 
         """
-        length = self._enumDescriptionLength(paramCode, value)
-        description = ct.create_string_buffer(length)
-        numberPossibleParam = self.getParameterValue(paramCode, AttributeType.count)
-        i = 0
-        while i < numberPossibleParam:
-            (description, valueEnum) = self._getEnumeratedParameter(paramCode, i, length)
-            if valueEnum == value:
-                return description
-            i = i + 1
+        descriptor = self._descriptor(paramCode)
+        descriptions = self._enumDescriptions.get(descriptor.id)
+        if descriptions is None or value not in descriptions:
+            descriptions = {}
+            for i in range(self.getParameterValue(descriptor, AttributeType.count)):
+                length = self._enumDescriptionLength(descriptor, i)
+                (description, valueEnum) = self._getEnumeratedParameter(descriptor, i, length)
+                descriptions[valueEnum] = description
+            self._enumDescriptions[descriptor.id] = descriptions
+        return descriptions.get(value)
             
     def getParameterValue(self, parameter, mode):
         """Return the current value of the parameter defined by parameter.
         
         Parameters
         ----------
-        parameter : string or long that defines the parameter
+        parameter : string, long or ParamDescriptor that defines the parameter
             Name of the parameter to read. All possible names are in the 
             dictionary Princeton.ParamSet.
         mode : one of the enumerated type AttributeType :
@@ -1415,58 +2023,35 @@ class Princeton(object):
 
         Returns
         ----------
-        The value of the parameter in the right type
+        The value of the parameter in the right type, (description, value) 
+        for the enumerated parameters
         """
-#        Checks the type of the parameters and changes it if necessary
-        paramCode = parameter
-        modevalue = mode
-        if type(mode) == AttributeType :
-            modevalue = mode.value
-        modevalue = int16(modevalue)
-        if type(parameter) == type('bla'):
-            if parameter not in self.ParamSet:
-                raise PrincetonError(2018)
-            paramCode = self.ParamSet.get(parameter)
-#        Defines the type of the return value (depends on the mode of the attribute
-#            of the parameter on wants to access)
-        returnValue = self.ParamType.get(paramCode) # if we want the min/max/increment/default/current value
-        if returnValue == char_ptr:
-            returnValue = ct.create_string_buffer(255) # unsubtle buffer
-        else:
-            returnValue = returnValue()
-        
-        if mode == AttributeType.typeValue: # if we want the type
-            returnValue = uns32()
-        elif mode == AttributeType.access: # if we want the access type
-            returnValue = uns32()
-        elif mode == AttributeType.count: # if we want the number of elements in an enumerated type
-            returnValue = uns32()
-        elif mode == AttributeType.available: # if we want to know if the parameter is available
-            returnValue = boolean()
-            
-        if API.pl_get_param(self._handle, paramCode, modevalue, ct.byref(returnValue)) == 0:
-            raise PrincetonError(API.pl_error_code())
-        
-        if mode == AttributeType.typeValue: # if we want the type
-            returnValue = returnValue.value
-            return self.ParamCType.get(returnValue)
-        elif mode == AttributeType.available: # if we want to know if the parameter is available
-            return returnValue.value
-        elif mode == AttributeType.count: # if we want the number of elements in an enumerated type
-            return returnValue.value
-        elif mode == AttributeType.access: # if we want the access type
-            returnValue = returnValue.value
-            return self.PropertyForATTR_ACCESS.get(returnValue)
-         # if we want the min/max/increment/default/current value
-        elif mode == AttributeType.currentValue or mode == AttributeType.defaultValue or mode == AttributeType.minValue or mode == AttributeType.maxValue or mode == AttributeType.increment:
-#            Check if is an enum to get the proper string
-            attributeType = uns32()
-            if API.pl_get_param(self._handle, paramCode, API.ATTR_TYPE, ct.byref(attributeType)) == 0:
+        with driverLock:
+            descriptor = self._descriptor(parameter)
+            if mode.__class__ is not AttributeType:
+                mode = AttributeType(mode)
+#            The type of the value depends on the attribute: count/type/access/available
+#                have their own type, the others have the type of the parameter
+            returnValue = self._attributeValues.get(mode, descriptor.scratch)
+            if API.pl_get_param(self._handle, descriptor.id, mode.value, ct.byref(returnValue)) == 0:
                 raise PrincetonError(API.pl_error_code())
-            if attributeType.value == 9:
-                return (self.getEnumeratedParameterAsString(paramCode, returnValue.value), returnValue.value)
+            value = returnValue.value
+        
+            if mode == AttributeType.typeValue: # if we want the type
+                return self.ParamCType.get(value)
+            elif mode == AttributeType.available: # if we want to know if the parameter is available
+                return bool(value)
+            elif mode == AttributeType.count: # if we want the number of elements in an enumerated type
+                return value
+            elif mode == AttributeType.access: # if we want the access type
+                return self.PropertyForATTR_ACCESS.get(value)
+            # min/max/increment/default/current value, with the description for an enum
+            if mode == AttributeType.currentValue:
+                self._currentValues[descriptor.id] = value
+            if descriptor.isEnum:
+                return (self.getEnumeratedParameterAsString(descriptor, value), value)
             else:
-                return returnValue.value
+                return value
             
     def getParameterCurrentValue(self, parameter):
         """Return the current value of the parameter defined by parameter.
@@ -1504,7 +2089,7 @@ class Princeton(object):
 
         Parameters
         ----------
-        parameter : string or long that defines the parameter
+        parameter : string, long or ParamDescriptor that defines the parameter
             Name/ID of the parameter to be changed. All possible names are in the 
             dictionary Princeton.ParamSet.
             
@@ -1514,26 +2099,48 @@ class Princeton(object):
         boolean True if the parameter has been changed
 
         """
-        paramCode = parameter
-        if type(parameter) == str:
-            if not parameter in self.ParamSet:
-                raise PrincetonError(2018)
-            paramCode = self.ParamSet.get(parameter)
-            paramString = parameter
-        else:
-            paramString = str(parameter)
-        returnValue = uns16()
-        if API.pl_get_param(self._handle, paramCode, API.ATTR_ACCESS, ct.byref(returnValue)) == 0:
-            raise PrincetonError(API.pl_error_code())
-        accessType = returnValue.value
-        if accessType == 0 or accessType == 1 or accessType == 3:
-            print('The parameter ' + paramString + ' is not writeable')
-            return False
-        setValueC = self.ParamType.get(paramCode)
-        setValueC = setValueC(setValue)
-        if API.pl_set_param(self._handle, paramCode, ct.byref(setValueC)) == 0:
-            raise PrincetonError(API.pl_error_code())
-        return True    
+        with driverLock:
+            descriptor = self._descriptor(parameter)
+            accessType = self._access.get(descriptor.id)
+            if accessType is None:  # the access of a parameter does not change, asked once
+                returnValue = self._attributeValues[AttributeType.access]
+                if API.pl_get_param(self._handle, descriptor.id, API.ATTR_ACCESS, ct.byref(returnValue)) == 0:
+                    raise PrincetonError(API.pl_error_code())
+                accessType = returnValue.value
+                self._access[descriptor.id] = accessType
+            if accessType == 0 or accessType == 1 or accessType == 3:
+                print('The parameter ' + descriptor.name + ' is not writeable')
+                return False
+            setValueC = descriptor.scratch
+            setValueC.value = setValue
+            if API.pl_set_param(self._handle, descriptor.id, ct.byref(setValueC)) == 0:
+                raise PrincetonError(API.pl_error_code())
+            if descriptor.id == API.PARAM_SPDTAB_INDEX:  # the speed table changes other parameters (gain, pixel time...)
+                self._currentValues.clear()
+            self._currentValues[descriptor.id] = setValueC.value
+            return True    
+            
+    def getParameterCachedValue(self, parameter):
+        """Return the last value read or written of the parameter defined by 
+        parameter, without asking the camera if it is known.
+        
+        Only for the parameters changed by the program (not TEMP...). 
+        Changing SPDTAB_INDEX forgets all the values.
+
+        Parameters
+        ----------
+        parameter : string, long or ParamDescriptor that defines the parameter
+            Name/ID of the parameter. All possible names are in the 
+            dictionary Princeton.ParamSet.
+
+        Returns
+        ----------
+        The value of the parameter (the value only for the enumerated parameters)
+        """
+        descriptor = self._descriptor(parameter)
+        if descriptor.id not in self._currentValues:
+            self.getParameterValue(descriptor, AttributeType.currentValue)
+        return self._currentValues[descriptor.id]
 
             
 #==============================================================================
@@ -1542,8 +2149,9 @@ class Princeton(object):
         
     def exposureInitSequential(self):
         """Initialize camera for data taking in sequential mode."""
-        if API.pl_exp_init_seq() == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_init_seq() == 0:
+                raise PrincetonError(API.pl_error_code())
         
     def _getCircularBufferMode(self):
         """NOT TESTED
@@ -1586,12 +2194,16 @@ class Princeton(object):
         ROI : regions to record
         expTime : exposure duration (in EXP_RES units)
         """
+        if not 0 < self.numberPicturesToTake <= SEQUENCE_MAX_FRAMES:
+            raise ValueError("numberPicturesToTake should be between 1 and {0}, not {1} (see streamSequence)".format(
+                SEQUENCE_MAX_FRAMES, self.numberPicturesToTake))
         nPictures = uns16(self.numberPicturesToTake)
         sizeBuffer = uns32()
         mode = int16(self._exposureMode.value)
         (numberROIsC, arrayROIs) = self._processROIforAPI()
-        if API.pl_exp_setup_seq(self._handle, nPictures, numberROIsC, arrayROIs, mode, uns32(self.expTime), ct.byref(sizeBuffer)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_setup_seq(self._handle, nPictures, numberROIsC, arrayROIs, mode, uns32(self.expTime), ct.byref(sizeBuffer)) == 0:
+                raise PrincetonError(API.pl_error_code())
         return sizeBuffer.value
         
     def setupExposureContinuous(self):
@@ -1612,8 +2224,9 @@ class Princeton(object):
         mode = int16(self._exposureMode.value)
         circBuffMode = int16(self._circularBufferMode.value)
         (numberROIsC, arrayROIs) = self._processROIforAPI()
-        if API.pl_exp_setup_cont(self._handle, numberROIsC, arrayROIs, mode, uns32(self.expTime), ct.byref(sizeStream), circBuffMode) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_setup_cont(self._handle, numberROIsC, arrayROIs, mode, uns32(self.expTime), ct.byref(sizeStream), circBuffMode) == 0:
+                raise PrincetonError(API.pl_error_code())
         return sizeStream.value
         
     def _getCurrentBuffer(self):
@@ -1632,23 +2245,29 @@ class Princeton(object):
         
     currentBuffer = property(_getCurrentBuffer, _setCurrentBuffer)
         
-    def startExposureSequential(self, sizeStream):
+    def startExposureSequential(self, sizeStream, pixelStream=None):
         """Starts the acquisition of a sequence of pictures after the call of setupExposureSequential().
         
         Parameters
         ----------
         sizeStream : size of the buffer to be allocated (in bytes) given the 
             camera, the number of pictures, the regions of interest
+        pixelStream : c_types array to reuse (at least sizeStream bytes), 
+            a new one is allocated if None
             
         Returns
         ----------
-        pixelStream : c_types array of int16
+        pixelStream : c_types array of uns16
         """
 #        For our 16-bit camera :
-        pixelStreamtype = int32 * int(sizeStream / 2)
-        pixelStream = pixelStreamtype()
-        if API.pl_exp_start_seq(self._handle, pixelStream) == 0:
-            raise PrincetonError(API.pl_error_code())
+        if pixelStream is None:
+            pixelStreamtype = uns16 * int(sizeStream / 2)
+            pixelStream = pixelStreamtype()
+        elif ct.sizeof(pixelStream) < sizeStream:
+            raise ValueError("the pixel stream has {0} bytes, {1} are needed".format(ct.sizeof(pixelStream), sizeStream))
+        with driverLock:
+            if API.pl_exp_start_seq(self._handle, pixelStream) == 0:
+                raise PrincetonError(API.pl_error_code())
         return pixelStream
         
     def _startExposureContinuous(self, sizeStream, sizeBuffer):
@@ -1669,8 +2288,9 @@ class Princeton(object):
         pixelStreamtype = uns16 * int(sizeBuffer / 2)
         pixelStream = pixelStreamtype()
         sizeBufferC = uns32(sizeBuffer)
-        if API.pl_exp_start_cont(self._handle, pixelStream, sizeBufferC) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_start_cont(self._handle, pixelStream, sizeBufferC) == 0:
+                raise PrincetonError(API.pl_error_code())
         return pixelStream
         
     def finishExposureSequential(self, pixelStream):
@@ -1686,8 +2306,9 @@ class Princeton(object):
         handleBuffer : int16 handle for a buffer
         """
         handleBuffer = self._currentBuffer
-        if API.pl_exp_finish_seq(self._handle, pixelStream, handleBuffer) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_finish_seq(self._handle, pixelStream, handleBuffer) == 0:
+                raise PrincetonError(API.pl_error_code())
         return pixelStream
         
     def _stopExposureContinuous(self, pixelStream):
@@ -1697,8 +2318,9 @@ class Princeton(object):
         ----------
         pixelStream : c_types array of int16 where the pixels will be recorded
             """
-        if API.pl_exp_stop_cont(self._handle, self.abortMode.value) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_stop_cont(self._handle, self.abortMode.value) == 0:
+                raise PrincetonError(API.pl_error_code())
         
     def _abortExposure(self, pixelStream):
         """NOT TESTED
@@ -1709,8 +2331,9 @@ class Princeton(object):
         ----------
         pixelStream : c_types array of int16 where the pixels will be recorded
         """
-        if API.pl_exp_abort(self._handle, self.abortMode.value) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_abort(self._handle, self.abortMode.value) == 0:
+                raise PrincetonError(API.pl_error_code())
         
     def _takePictureStream(self, sizeStream):
         """Does one acquisition of a sequence of pictures after the call of setupExposureSequential().
@@ -1747,14 +2370,15 @@ class Princeton(object):
         5: Acquisition in progress
         6: MAX_CAMERA_STATUS
         """
-        statusC = int16()
-        byteCount = uns32()
-        if API.pl_exp_check_status(self._handle, ct.byref(statusC), ct.byref(byteCount)) == 0:
-            return
-            raise PrincetonError(API.pl_error_code())
-        status = statusC.value
-        byteCounted = byteCount.value
-        return self.PropertyReadoutStatus.get(status), status, byteCounted
+        with driverLock:
+            statusC = int16()
+            byteCount = uns32()
+            if API.pl_exp_check_status(self._handle, ct.byref(statusC), ct.byref(byteCount)) == 0:
+                return
+                raise PrincetonError(API.pl_error_code())
+            status = statusC.value
+            byteCounted = byteCount.value
+            return self.PropertyReadoutStatus.get(status), status, byteCounted
         
     def exposureCheckContinuousStatus(self):
         """NOT TESTED
@@ -1773,8 +2397,9 @@ class Princeton(object):
         statusC = int16()
         bufferCount = uns32()
         byteCount = uns32()
-        if API.pl_exp_check_cont_status(self._handle, ct.byref(statusC), ct.byref(byteCount), ct.byref(bufferCount)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_check_cont_status(self._handle, ct.byref(statusC), ct.byref(byteCount), ct.byref(bufferCount)) == 0:
+                raise PrincetonError(API.pl_error_code())
         status = statusC.value
         byteCounted = byteCount.value
         bufferCounted = bufferCount.value
@@ -1793,8 +2418,9 @@ class Princeton(object):
         """
         bufferPtr = void_ptr()
         sizeBuffer = uns32()
-        if API.pl_exp_get_driver_buffer(self._handle, ct.byref(bufferPtr), ct.byref(sizeBuffer)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_get_driver_buffer(self._handle, ct.byref(bufferPtr), ct.byref(sizeBuffer)) == 0:
+                raise PrincetonError(API.pl_error_code())
         if not bufferPtr:
             bufferPtr = None
             print('No buffer')
@@ -1809,8 +2435,9 @@ class Princeton(object):
         """
         bufferPtr = void_ptr()
         bufferPtrPtr = ct.pointer(bufferPtr)
-        if API.pl_exp_get_latest_frame(self._handle, bufferPtrPtr) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_get_latest_frame(self._handle, bufferPtrPtr) == 0:
+                raise PrincetonError(API.pl_error_code())
         if not bufferPtrPtr.contents:
             frame = None
             print('No latest frame in the circular buffer')
@@ -1828,8 +2455,9 @@ class Princeton(object):
         frame : void_ptr_ptr pointing to the oldest frame if it exists, None otherwise
         """
         bufferPtr = void_ptr()
-        if API.pl_exp_get_oldest_frame(self._handle, ct.byref(bufferPtr)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_get_oldest_frame(self._handle, ct.byref(bufferPtr)) == 0:
+                raise PrincetonError(API.pl_error_code())
 #        if not bufferPtr:
 #            frame = None
 #            print('No oldest unretrieved frame')
@@ -1840,16 +2468,18 @@ class Princeton(object):
         
     def exposureUninit(self):
         """Uninitializes the data collection function."""
-        if API.pl_exp_uninit_seq() == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_uninit_seq() == 0:
+                raise PrincetonError(API.pl_error_code())
             
     def unlockOldestFrame(self):
         """NOT TESTED
         
         Makes the oldest frame in the buffer overwriteable.
         """
-        if API.pl_exp_unlock_oldest_frame(self._handle) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_unlock_oldest_frame(self._handle) == 0:
+                raise PrincetonError(API.pl_error_code())
     
     def unravelData(self, frame, exposureBuffer = 0):
         """NOT TESTED
@@ -1873,8 +2503,9 @@ class Princeton(object):
         arraylist = arraylist()
         for i in range(numberROIS):
             arraylist[i] = (uns16 * pixelPerROI[i])()
-        if API.pl_exp_unravel(self._handle, exposureC, frame, numberROIsC, arrayROIs, arraylist) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_exp_unravel(self._handle, exposureC, frame, numberROIsC, arrayROIs, arraylist) == 0:
+                raise PrincetonError(API.pl_error_code())
         images = []
         for i in range(numberROIS):
             table = arraylist[i]
@@ -1887,8 +2518,9 @@ class Princeton(object):
         
         Clears the current setup for control of the available I/O lines within a camera script
         """
-        if API.pl_io_clear_script_control(self._handle) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_io_clear_script_control(self._handle) == 0:
+                raise PrincetonError(API.pl_error_code())
             
     def ioScriptControl(self, locationInSequence, addressIO, stateIOtoWrite):
         """NOT TESTED
@@ -1906,8 +2538,9 @@ class Princeton(object):
         location = uns32(locationInSequence.value)
         addressIOC = uns16(addressIO)
         state = flt64(stateIOtoWrite)
-        if API.pl_io_clear_script_control(self._handle, addressIOC, state, location) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_io_clear_script_control(self._handle, addressIOC, state, location) == 0:
+                raise PrincetonError(API.pl_error_code())
             
 #==============================================================================
 #     Class 4 functions
@@ -1929,8 +2562,9 @@ class Princeton(object):
         handleBufferC = int16()
         bufferPrecisionC = int16(bufferPrecision.value)
         
-        if API.pl_buf_alloc(ct.byref(handleBufferC), numberExposure, bufferPrecisionC, numberROIsC, arrayROIs) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_alloc(ct.byref(handleBufferC), numberExposure, bufferPrecisionC, numberROIsC, arrayROIs) == 0:
+                raise PrincetonError(API.pl_error_code())
         self._currentBuffer = handleBufferC
         return handleBufferC
             
@@ -1938,8 +2572,9 @@ class Princeton(object):
         """Frees the memory and the handle used by self._currentBuffer buffer."""
         if type(handleBuffer) == type(None):
             handleBuffer = self._currentBuffer
-        if API.pl_buf_free(handleBuffer) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_free(handleBuffer) == 0:
+                raise PrincetonError(API.pl_error_code())
             
     def bufferGetPrecision(self):
         """Gets the bit  used by self._currentBuffer buffer.
@@ -1949,8 +2584,9 @@ class Princeton(object):
         bufferPrecision : element of enumerated type BufferPrec 
         """
         bitDepthC = int16()
-        if API.pl_buf_get_bits(self._currentBuffer, ct.byref(bitDepthC)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_get_bits(self._currentBuffer, ct.byref(bitDepthC)) == 0:
+                raise PrincetonError(API.pl_error_code())
         return BufferPrec(bitDepthC.value)
             
     def bufferGetExposureDateRaw(self, exposureNumber):
@@ -1972,8 +2608,9 @@ class Princeton(object):
         secC = uns8()
         millisecC = uns16()
         exposureNumberC = int16(exposureNumber)
-        if API.pl_buf_get_exp_date(self._currentBuffer, exposureNumberC, ct.byref(yearC), ct.byref(monthC), ct.byref(dayC), ct.byref(hourC), ct.byref(minC), ct.byref(secC), ct.byref(millisecC)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_get_exp_date(self._currentBuffer, exposureNumberC, ct.byref(yearC), ct.byref(monthC), ct.byref(dayC), ct.byref(hourC), ct.byref(minC), ct.byref(secC), ct.byref(millisecC)) == 0:
+                raise PrincetonError(API.pl_error_code())
         year = yearC.value
         month = monthC.value
         day = dayC.value
@@ -1998,11 +2635,80 @@ class Princeton(object):
         """
         exposureTimeC = uns32()
         exposureNumberC = int16(exposureNumber)
-        if API.pl_buf_get_exp_time(self._currentBuffer, exposureNumberC, ct.byref(exposureTimeC)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_get_exp_time(self._currentBuffer, exposureNumberC, ct.byref(exposureTimeC)) == 0:
+                raise PrincetonError(API.pl_error_code())
         exposureTime = exposureTimeC.value
         return exposureTime
             
+    def bufferGetExposureTiming(self, numberExposure=None):
+        """Gets the dates and durations of all the exposures of the 
+        self._currentBuffer buffer in one pass.
+        
+        The driver is asked with the same ctypes arguments for every 
+        exposure. When it does not give the exposure durations (our cameras 
+        always return zero, see bufferGetExposureDuration), the configured 
+        exposure time is reported. The host times of the status transitions 
+        of the last sequence give an estimate of the time per exposure 
+        (hostDurations): the first transition ends the first exposure and the 
+        exposures are spread evenly until pl_exp_finish_seq. The same host
+        times, in local time like the camera's, replace the dates the driver 
+        does not give (year 0).
+            
+        Parameters
+        ----------
+        numberExposure : number of exposures (asked to the driver if None)
+            
+        Returns
+        -------
+        timing : ExposureTiming (dates, durations in second, source, hostDurations)
+        """
+        if numberExposure is None:
+            numberExposure = self.bufferGetNumberExposure()
+        raw = numpy.zeros((numberExposure, 8), dtype=numpy.int64)
+        scratch = self._dateScratch
+        year, month, day, hour, minute, sec, millisec, duration = self._dateArguments
+        bufferC = self._currentBuffer
+        with driverLock:
+            for i in range(numberExposure):
+                if API.pl_buf_get_exp_date(bufferC, i, year, month, day, hour, minute, sec, millisec) == 0:
+                    raise PrincetonError(API.pl_error_code())
+                if API.pl_buf_get_exp_time(bufferC, i, duration) == 0:
+                    raise PrincetonError(API.pl_error_code())
+                raw[i] = [c.value for c in scratch]
+        hostStart, hostEnd, hostFinish = self._hostExposureTimes()
+        if hostStart is None:
+            hostDurations = numpy.full(numberExposure, numpy.nan)
+        elif numberExposure == 1:
+            hostDurations = numpy.array([hostEnd - hostStart])
+        else:
+            hostDurations = numpy.full(numberExposure, (hostFinish - hostStart) / numberExposure)
+        if raw[:, 7].any():
+            durations = raw[:, 7] * 1e-3
+            source = 'driver'
+        else:
+            durations = numpy.full(numberExposure, self._exposureSeconds())
+            source = 'configured'
+        if raw[:, 0].all():
+            dates = (raw[:, 0] - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (raw[:, 1] - 1)
+            dates = dates.astype('datetime64[D]') + (raw[:, 2] - 1)
+            milliseconds = ((raw[:, 3] * 60 + raw[:, 4]) * 60 + raw[:, 5]) * 1000 + raw[:, 6]
+            dates = dates.astype('datetime64[ms]') + milliseconds.astype('timedelta64[ms]')
+        elif hostStart is not None:
+            starts = hostStart + numpy.arange(numberExposure) * (hostFinish - hostStart) / numberExposure
+            starts = starts + time.localtime(hostStart).tm_gmtoff  # the driver dates are local
+            dates = (starts * 1e3).astype(numpy.int64).astype('datetime64[ms]')
+        else:
+            dates = numpy.full(numberExposure, numpy.datetime64('NaT', 'ms'))
+        return ExposureTiming(dates, durations, source, hostDurations)
+        
+    def _hostExposureTimes(self):
+        """Host times (start, first status change, finish) of the last 
+        sequence, Nones if unknown."""
+        if len(self._statusTimes) != 3:  # sequence not finished
+            return None, None, None
+        return tuple(t for status, t in self._statusTimes)
+        
     def bufferGetNumberExposure(self):
         """Gets the total number of exposure in the self._currentBuffer buffer.
             
@@ -2011,8 +2717,9 @@ class Princeton(object):
         exposureNumbers 
         """
         exposureNumbersC = int16()
-        if API.pl_buf_get_exp_total(self._currentBuffer, ct.byref(exposureNumbersC)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_get_exp_total(self._currentBuffer, ct.byref(exposureNumbersC)) == 0:
+                raise PrincetonError(API.pl_error_code())
         exposureNumbers = exposureNumbersC.value
         return exposureNumbers
             
@@ -2029,8 +2736,9 @@ class Princeton(object):
         """
         ibin = int16()
         jbin = int16()
-        if API.pl_buf_get_img_bin(handleImageC, ct.byref(ibin), ct.byref(jbin)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_get_img_bin(handleImageC, ct.byref(ibin), ct.byref(jbin)) == 0:
+                raise PrincetonError(API.pl_error_code())
         return ibin.value, jbin.value
             
     def bufferGetImageHandle(self, exposureNumber, ROInumber):
@@ -2048,8 +2756,9 @@ class Princeton(object):
         handleImageC = int16()
         exposureNumberC = int16(exposureNumber)
         ROInumber = int16(ROInumber)
-        if API.pl_buf_get_img_handle(self._currentBuffer, exposureNumberC, ROInumber, ct.byref(handleImageC)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_get_img_handle(self._currentBuffer, exposureNumberC, ROInumber, ct.byref(handleImageC)) == 0:
+                raise PrincetonError(API.pl_error_code())
         return handleImageC
             
     def bufferGetImagePositionOffset(self, handleImageC):
@@ -2068,8 +2777,9 @@ class Princeton(object):
         """
         s1 = int16()
         p1 = int16()
-        if API.pl_buf_get_img_bin(handleImageC, ct.byref(s1), ct.byref(p1)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_get_img_bin(handleImageC, ct.byref(s1), ct.byref(p1)) == 0:
+                raise PrincetonError(API.pl_error_code())
         return s1.value, p1.value
             
     def bufferGetImagePointer(self, handleImageC):
@@ -2084,8 +2794,9 @@ class Princeton(object):
         imagePointer : int16 pointer to the image
         """
         imagePointer = void_ptr()
-        if API.pl_buf_get_img_ptr(handleImageC, ct.byref(imagePointer)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_get_img_ptr(handleImageC, ct.byref(imagePointer)) == 0:
+                raise PrincetonError(API.pl_error_code())
         return ct.cast(imagePointer, uns16_ptr) # Our camera is 16-bits, need to cast the pointer to the right type
             
     def bufferGetImageSize(self, handleImageC):
@@ -2102,8 +2813,9 @@ class Princeton(object):
         """
         idim = int16()
         jdim = int16()
-        if API.pl_buf_get_img_size(handleImageC, ct.byref(idim), ct.byref(jdim)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_get_img_size(handleImageC, ct.byref(idim), ct.byref(jdim)) == 0:
+                raise PrincetonError(API.pl_error_code())
         return idim.value, jdim.value
             
     def bufferGetImageNumberPerExposure(self):
@@ -2114,8 +2826,9 @@ class Princeton(object):
         imageNumber : number of image (ROI) per exposure
         """
         imageNumber = int16()
-        if API.pl_buf_get_img_total(self._currentBuffer, ct.byref(imageNumber)) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_get_img_total(self._currentBuffer, ct.byref(imageNumber)) == 0:
+                raise PrincetonError(API.pl_error_code())
         return imageNumber.value
             
             
@@ -2131,8 +2844,9 @@ class Princeton(object):
         sizeBuffer : size of the buffer in bytes
         """
         sizeBuffer = uns32_ptr(uns32(0))
-        if API.pl_buf_get_size(self._currentBuffer, sizeBuffer) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_get_size(self._currentBuffer, sizeBuffer) == 0:
+                raise PrincetonError(API.pl_error_code())
         return sizeBuffer.contents.value
             
     def bufferSetExposureDate(self, exposureNumber, year, month, day, hour, minuts, sec, millisec):
@@ -2153,18 +2867,21 @@ class Princeton(object):
         secC = uns8(sec)
         millisecC = uns16(millisec)
         exposureNumberC = int16(exposureNumber)
-        if API.pl_buf_get_exp_date(self._currentBuffer, exposureNumberC, yearC, monthC, dayC, hourC, minC, secC, millisecC) == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_get_exp_date(self._currentBuffer, exposureNumberC, yearC, monthC, dayC, hourC, minC, secC, millisecC) == 0:
+                raise PrincetonError(API.pl_error_code())
             
     def bufferInit(self):
         """Initializes the buffer functions, useful for exposures with multiple regions or complex sequences."""
-        if API.pl_buf_init() == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_init() == 0:
+                raise PrincetonError(API.pl_error_code())
             
     def bufferUninit(self):
         """Uninitializes the buffer functions, useful for exposures with multiple regions or complex sequences"""
-        if API.pl_buf_uninit() == 0:
-            raise PrincetonError(API.pl_error_code())
+        with driverLock:
+            if API.pl_buf_uninit() == 0:
+                raise PrincetonError(API.pl_error_code())
             
 #==============================================================================
 #     Properties for our application
@@ -2172,7 +2889,10 @@ class Princeton(object):
 
 #   Actual Temperature
     def _get_temperature(self):
-        """ Get the current temperature """
+        """ Get the current temperature (last sample of the cooling monitor if it is running) """
+        monitor = self._coolingMonitor
+        if monitor is not None and monitor.running and monitor.last is not None:
+            return monitor.temperature
         return self.getParameterCurrentValue('TEMP') / 100.
 
     temperature = property(_get_temperature)
@@ -2186,7 +2906,7 @@ class Princeton(object):
         """ Set the setpoint temperature """
         if  val < -110 or val > 20:  # some camera operate at -100 C
             raise Exception("setpoint temperature should be between -110 and 20, not {val}".format(val=val))
-        return self.setParameterValue('TEMP_SETPOINT', val * 100)
+        return self.setParameterValue('TEMP_SETPOINT', int(round(val * 100)))
         
     setpoint_temperature = property(_get_setpoint_temperature, _set_setpoint_temperature)      
 
@@ -2256,6 +2976,11 @@ class Princeton(object):
         return str(self.expTime) + units
         
     exposureTime = property(_getExposureTime)      
+    
+    def _exposureSeconds(self):
+        """Exposure time in second, from the last known EXP_RES_INDEX."""
+        resolution = self.getParameterCachedValue(API.PARAM_EXP_RES_INDEX)
+        return self.expTime * (1e-6 if resolution == ExposureUnits.microsecond.value else 1e-3)
         
 #   ROI
     def addExposureROI(self, ROI):
@@ -2425,7 +3150,7 @@ class Princeton(object):
     
 #   Kinetics
     def _isKineticsEnabled(self):
-        return self.getParameterCurrentValue(API.PARAM_PMODE)[0] == 'Kinetics'
+        return self.getParameterCurrentValue(API.PARAM_PMODE)[1] == API.PMODE_KINETICS
         
     kineticsEnabled = property(_isKineticsEnabled)
     
@@ -2464,24 +3189,96 @@ class Princeton(object):
         
     def takePicture(self, optionDisplayMessage = True):
         """Takes picture(s) according to the parameters defined in the object."""
+        profile = _NO_RECORD if self._profiler is None else self._profiler.begin()
+        pixelStream = self._runSequence(optionDisplayMessage, profile)
+        result = self.convertStream(pixelStream)
+        profile.mark('convert')
+        self.telemetry.addFrames(self.numberPicturesToTake)
+        if self.timeToFirstFrame is None:
+            self._firstFrame()
+        if self._profiler is not None:
+            self._profiler.end(profile)
+        return result
+        
+    def _runSequence(self, optionDisplayMessage=False, profile=_NO_RECORD, allocate=True):
+        """Setups, starts and finishes a sequence of numberPicturesToTake pictures.
+        
+        Parameters
+        ----------
+        optionDisplayMessage : print the status of the camera
+        profile : AcquisitionRecord marking the phases
+        allocate : allocate a buffer (needed by convertStream), otherwise 
+            only the pixel stream is filled
+            
+        Returns
+        ----------
+        pixelStream : c_types array filled with the pixels (uint16)
+        """
+        sequenceStart = time.perf_counter()
         sizeStream = self.setupExposureSequential()
-        self.bufferAllocate(BufferPrec.uns16precision)
+        profile.mark('setup')
+        if allocate:
+            self.bufferAllocate(BufferPrec.uns16precision)
+            profile.mark('allocate')
+        elif not self._currentBuffer.value == 0:  # would not match the sequence
+            self.bufferFree(self._currentBuffer)
+            self._currentBuffer = int16(0)
         pixelStream = self.startExposureSequential(sizeStream)
+        profile.mark('start')
+        self._statusTimes = [('start', _HOST_EPOCH + time.perf_counter())]
         (statusString, statusNumber, byteCount) = self.exposureCheckStatus()
+        profile.poll()
         statusNumberOld = statusNumber
         if optionDisplayMessage:
             print(statusString)
-        while statusNumber == statusNumberOld:
-            time.sleep(0.2)
+        while statusNumber == statusNumberOld and statusNumber not in self._endStatus:
+            time.sleep(self.pollInterval)
 #            print('statusNumber = ' + str(statusNumberOld)
             (statusString, statusNumber, byteCount) = self.exposureCheckStatus()
+            profile.poll()
+        self._statusTimes.append((ReadoutStatus(statusNumber).name, _HOST_EPOCH + time.perf_counter()))
+        # time between the start and the detection of the status change,
+        # ReadoutStatus(statusNumberOld).name is usually exposureInProgress
+        profile.mark(ReadoutStatus(statusNumberOld).name)
         if optionDisplayMessage:
             print(statusString)
+        if statusNumber == ReadoutStatus.readoutFailed.value:
+            self.telemetry.readoutFailures += 1
+        self.telemetry.acquisitions += 1
         time.sleep(0.01)
         pixelStream = self.finishExposureSequential(pixelStream)
+        profile.mark('finish')
+        self._statusTimes.append(('finish', _HOST_EPOCH + time.perf_counter()))
         time.sleep(0.01)
-        return self.convertStream(pixelStream)
+        self._sequences.append((self.numberPicturesToTake, self._exposureSeconds(), tuple(self.ROI), 
+                                self.getParameterCachedValue(API.PARAM_SPDTAB_INDEX), time.perf_counter() - sequenceStart))
+        return pixelStream
         
+    def armTriggeredRun(self, count, mode=ExposureMode.strobed, triggerPeriod=None, timeout=None):
+        """Sets up and starts a run of count triggered exposures.
+        
+        The camera is armed once for the whole run, the frames are delivered 
+        by iterating over the returned TriggeredRun as they are read out.
+        
+        Parameters
+        ----------
+        count : number of exposures (1 to 65535)
+        mode : ExposureMode.strobed, ExposureMode.triggerFirst or ExposureMode.bulb
+        triggerPeriod : second between two triggers (to find the missed triggers)
+        timeout : second without a new frame after which the run is aborted
+        
+        Returns
+        ----------
+        run : TriggeredRun
+        
+        Examples
+        --------
+        >>> run = camera.armTriggeredRun(1000, triggerPeriod=1/200.)
+        >>> for frame in run:
+        ...     spectra[frame.index] = frame.images[0][0]
+        >>> run.missed
+        """
+        return TriggeredRun(self, count, mode, triggerPeriod, timeout)
         
     def takeTriggedPicture(self):
         """Takes pictures in strobed mode (external trigger & internal timer 
@@ -2503,21 +3300,29 @@ class Princeton(object):
         Returns
         ----------
         images : list of list of numpy arrays corresponding to the different exposures and ROI ; 
-            images[exposureNumber][ROInumber]
+            images[exposureNumber][ROInumber], corrected (float32) when 
+            calibrationStore has maps for the ROI
         infos : list of list of strings
         """
 #        if self.numberPicturesToTake == 1 and len(self.ROI) == 1:
 #            print('This is a simple picture with one exposure - No need for complex buffer manipulation')
         numberExposure = self.bufferGetNumberExposure()
         numberROI = self.bufferGetImageNumberPerExposure()
+        # dates and durations of all the exposures, asked once
+        timing = self.bufferGetExposureTiming(numberExposure)
+        precision = self.bufferGetPrecision().name
+        # calibration maps of each ROI for the current setup, looked up once per buffer
+        calibrations = [None] * numberROI
+        if self.calibrationStore is not None:
+            calibrations = self.calibrationStore.forCamera(self)[:numberROI]
         
         images = []
         infos = []
         for i1 in range(numberExposure):
-            imageHandle = self.bufferGetImageHandle(i1, 0)
-            date = self.bufferGetExposureDateRaw(i1)
-            expTime = self.bufferGetExposureDuration(i1)
-            precision = self.bufferGetPrecision().name
+            date = timing.dates[i1].item()
+            date = (date.year, date.month, date.day, date.hour, date.minute, date.second, date.microsecond // 1000) if date is not None else (0,) * 7
+            expTime = timing.durations[i1] * 1e3
+            hostExpTime = timing.hostDurations[i1] * 1e3
             regions = []
             infoRegions = []
             for i2 in range(numberROI):
@@ -2526,7 +3331,13 @@ class Princeton(object):
 #                Get the image
                 imagePointer = self.bufferGetImagePointer(imageHandle)
                 image = imagePointer[0:(sizei * sizej)]
-                regions.append(numpy.reshape(numpy.array(image), (sizei, sizej)))
+                image = numpy.reshape(numpy.array(image), (sizei, sizej))
+                maps = calibrations[i2]
+                if maps is not None and image.size == maps.size:
+                    image = maps.correct(image)
+                else:
+                    maps = None
+                regions.append(image)
 #                Get the informations
                 (bini, binj) = self.bufferGetImageBinningFactors(imageHandle)
                 (offsets, offsetp) = self.bufferGetImagePositionOffset(imageHandle)
@@ -2546,10 +3357,13 @@ class Princeton(object):
                 infoRegion = infoRegion + 'offsets\t' + str(offsets) + '\n'
                 infoRegion = infoRegion + 'offsetp\t' + str(offsetp) + '\n'
                 infoRegion = infoRegion + 'exposureTime (ms)\t' + str(expTime) + '\n'
+                infoRegion = infoRegion + 'hostExposureTime (ms)\t' + str(hostExpTime) + '\n'
                 infoRegion = infoRegion + 'precision (ms)\t' + str(precision) + '\n'
                 infoRegion = infoRegion + 'shutterMode\t' + str(self.shutterOpenMode) + '\n'
                 infoRegion = infoRegion + 'ADCspeedIndex\t' + str(self.speed) + '\n'
                 infoRegion = infoRegion + 'ADCgainIndex\t' + str(self.gain) + '\n'
+                if maps is not None:
+                    infoRegion = infoRegion + 'calibration\t' + ','.join(maps.kinds) + '\n'
                 infoRegions.append(infoRegion)
             images.append(regions)
             infos.append(infoRegions)
@@ -2568,7 +3382,7 @@ class Princeton(object):
 #        type and within bounds, otherwise sets it to the minimal value
         minParallelShiftTime = self.getParameterValue(API.PARAM_PAR_SHIFT_TIME, AttributeType.minValue)
         maxParallelShiftTime = self.getParameterValue(API.PARAM_PAR_SHIFT_TIME, AttributeType.maxValue)
-        if not (type(parallelShiftTime) == int or type(parallelShiftTime) == long):
+        if not isinstance(parallelShiftTime, (int, numpy.integer)):
             parallelShiftTime = minParallelShiftTime
             print('parallelShiftTime set to the minimum possible value.')
         elif parallelShiftTime < minParallelShiftTime or parallelShiftTime > maxParallelShiftTime:
@@ -2603,6 +3417,291 @@ class Princeton(object):
             self.setParameterValue(API.PARAM_PAR_SHIFT_TIME, defaultParallelShiftTime)
             self.setParameterValue(API.PARAM_PMODE, 0)
             
+    def _kineticsGeometry(self):
+        """Returns (frames, rows, width): number of kinetic sub-frames in the 
+        readout of the ROI, rows of one sub-frame and columns (after binning).
+        """
+        if len(self.ROI) != 1:
+            raise ValueError("kinetics acquisition needs one ROI, not {n}".format(n=len(self.ROI)))
+        s1, s2, sbin, p1, p2, pbin = self.ROI[0]
+        window = self.kineticsWindowSize
+        if window % pbin:
+            raise ValueError("the parallel binning ({pbin}) must divide the kinetics window ({window})".format(pbin=pbin, window=window))
+        rows = window // pbin
+        frames = ((p2 - p1 + 1) // pbin) // rows
+        return frames, rows, (s2 - s1 + 1) // sbin
+        
+    def kineticsTimeOffsets(self):
+        """Start time (second) of each kinetic sub-frame relative to the first.
+        
+        After each exposure the window is shifted by kineticsWindowSize rows,
+        so the sub-frames are separated by the exposure time plus 
+        kineticsWindowSize * PAR_SHIFT_TIME.
+        
+        Returns
+        ----------
+        offsets : numpy array (frames)
+        """
+        frames = self._kineticsGeometry()[0]
+        units = 1e-3 if self.getParameterCurrentValue(API.PARAM_EXP_RES_INDEX) == ExposureUnits.millisecond.value else 1e-6
+        shift = self.kineticsWindowSize * self.getParameterCurrentValue(API.PARAM_PAR_SHIFT_TIME) * 1e-9
+        return numpy.arange(frames) * (self.expTime * units + shift)
+        
+    def _kineticsCubes(self, series):
+        """Takes series kinetics readouts in one sequence. Returns a numpy 
+        view (series, frames, rows, width) of the pixel stream."""
+        if not self.kineticsEnabled:
+            raise ValueError("kinetics mode is not enabled (see enableKineticsMode)")
+        frames, rows, width = self._kineticsGeometry()
+        numberPicturesToTake = self.numberPicturesToTake
+        self.numberPicturesToTake = series
+        try:
+            pixelStream = self._runSequence(allocate=False)
+        finally:
+            self.numberPicturesToTake = numberPicturesToTake
+        self.telemetry.addFrames(series)
+        if self.timeToFirstFrame is None:
+            self._firstFrame()
+        height = self.ROI[0][4] - self.ROI[0][3] + 1
+        height = height // self.ROI[0][5]
+        pixels = numpy.frombuffer(pixelStream, dtype=numpy.uint16, count=series * height * width)
+        # rows left after the last complete sub-frame are dropped (still a view)
+        return pixels.reshape(series, height, width)[:, :frames * rows].reshape(series, frames, rows, width)
+        
+    def takeKinetics(self):
+        """Takes one kinetics readout (see enableKineticsMode).
+        
+        The readout of the ROI (one ROI, usually the full chip) is split in 
+        its kinetic sub-frames of kineticsWindowSize rows, the first 
+        sub-frame (first rows read out) being the earliest.
+        
+        Returns
+        ----------
+        cube : numpy array (frames, rows, width) of uint16, a view of the 
+            pixel stream (no copy)
+        offsets : numpy array (frames), start time (second) of each sub-frame 
+            relative to the first one (see kineticsTimeOffsets)
+        """
+        return self._kineticsCubes(1)[0], self.kineticsTimeOffsets()
+        
+    def streamKinetics(self, series, chunk=1):
+        """Generator of series kinetics readouts, taken back-to-back by 
+        sequences of chunk readouts.
+        
+        Parameters
+        ----------
+        series : total number of kinetics readouts
+        chunk : number of readouts in one sequence of the camera (no dead 
+            time between them, they are delivered at the end of the sequence)
+            
+        Yields
+        ----------
+        (index, cube, offsets) : index of the readout, and cube and offsets 
+            as returned by takeKinetics
+        """
+        offsets = self.kineticsTimeOffsets()
+        index = 0
+        while index < series:
+            cubes = self._kineticsCubes(min(chunk, series - index))
+            for cube in cubes:
+                yield index, cube, offsets
+                index = index + 1
+                
+#==============================================================================
+#     Chunked sequences
+#==============================================================================
+
+    def _frameShapes(self):
+        """(rows, columns) of the image of each ROI."""
+        return [((p2 - p1 + 1) // pbin, (s2 - s1 + 1) // sbin) for (s1, s2, sbin, p1, p2, pbin) in self.ROI]
+        
+    def sequenceChunkSize(self, frames, maxMemory=SEQUENCE_MEMORY_LIMIT):
+        """Number of frames of the sub-sequences of streamSequence.
+        
+        Parameters
+        ----------
+        frames : number of frames of the whole acquisition
+        maxMemory : bytes available for the two pixel streams
+            
+        Returns
+        ----------
+        chunk : number of frames (at most SEQUENCE_MAX_FRAMES)
+        """
+        frameBytes = 2 * sum([rows * columns for rows, columns in self._frameShapes()])
+        chunk = min(frames, SEQUENCE_MAX_FRAMES, maxMemory // (2 * frameBytes))
+        if chunk < 1:
+            raise ValueError("two frames of {0} bytes do not fit in maxMemory = {1} bytes".format(frameBytes, maxMemory))
+        return chunk
+        
+    def _expectedFrameTime(self):
+        """Predicted second per frame of the current setup (see planAcquisition), 
+        None if the camera does not give its timing parameters. The simulated 
+        and replay drivers scale it by their timeScale."""
+        try:
+            return self.planAcquisition(frames=1).frameTime * getattr(API, 'timeScale', 1.)
+        except PrincetonError:
+            return None
+        
+    def _waitSequenceEnd(self, end=None, frameTime=None):
+        """Polls the status until the end of the readout of the sequence.
+        
+        Parameters
+        ----------
+        end : time.perf_counter() of the predicted end of the sequence, the 
+            status is not checked during the first 80% of the predicted 
+            remaining time (the prediction can be too long)
+        frameTime : predicted second per frame, the status is checked every 
+            tenth of it (every pollInterval if None)
+        """
+        interval = self.pollInterval if frameTime is None else min(self.pollInterval, max(frameTime / 10, 0.0002))
+        if end is not None:
+            time.sleep(max(end - time.perf_counter(), 0) * 0.8)
+        while True:
+            with driverLock:  # the error code of a failed readout is read before any other call
+                (statusString, statusNumber, byteCount) = self.exposureCheckStatus()
+                if statusNumber == ReadoutStatus.readoutComplete_frameAvailable.value:
+                    return
+                if statusNumber == ReadoutStatus.readoutFailed.value:
+                    self.telemetry.readoutFailures += 1
+                    raise PrincetonError(API.pl_error_code())
+            time.sleep(interval)
+        
+    def streamSequence(self, frames, maxMemory=SEQUENCE_MEMORY_LIMIT, chunk=None):
+        """Generator of an acquisition of frames exposures of any length, 
+        split in sub-sequences (chunks) that fit in maxMemory.
+        
+        Two pixel streams are allocated once and used in turn: the next 
+        chunk is acquired in one while the previous chunk, in the other, is 
+        delivered. The only dead time between two chunks is the time to 
+        finish one sequence and start the next. The images delivered are 
+        views of the pixel streams, valid until the generator is resumed 
+        (copy them to keep them).
+        
+        Parameters
+        ----------
+        frames : total number of exposures
+        maxMemory : bytes available for the two pixel streams
+        chunk : number of frames of the sub-sequences (see sequenceChunkSize 
+            if None)
+            
+        Yields
+        ----------
+        (index, images) : index of the first frame of the chunk, and list 
+            (one per ROI) of numpy arrays (frames of the chunk, rows, columns) 
+            of uint16
+            
+        Examples
+        --------
+        >>> total = numpy.zeros((400, 1340))
+        >>> for index, images in camera.streamSequence(100000):
+        ...     total += images[0].sum(axis=0)
+        """
+        if chunk is None:
+            chunk = self.sequenceChunkSize(frames, maxMemory)
+        elif not 0 < chunk <= SEQUENCE_MAX_FRAMES:
+            raise ValueError("chunk should be between 1 and {0}, not {1}".format(SEQUENCE_MAX_FRAMES, chunk))
+        shapes = self._frameShapes()
+        frameSize = sum([rows * columns for rows, columns in shapes])
+        if not self._currentBuffer.value == 0:  # only the pixel streams are used
+            self.bufferFree(self._currentBuffer)
+            self._currentBuffer = int16(0)
+        streams = [(uns16 * (chunk * frameSize))(), (uns16 * (chunk * frameSize))()]
+        numberPicturesToTake = self.numberPicturesToTake
+        frameTime = self._expectedFrameTime()
+        setupFrames = None
+        running = None  # (stream, index of the first frame, number of frames) of the chunk being acquired
+        index = 0
+        try:
+            while running is not None or index < frames:
+                done = running
+                if done is not None:
+                    self._waitSequenceEnd(end, frameTime)
+                    self.finishExposureSequential(done[0])
+                    running = None
+                    self.telemetry.acquisitions += 1
+                    self.telemetry.addFrames(done[2])
+                    if self.timeToFirstFrame is None:
+                        self._firstFrame()
+                if index < frames:  # start the next chunk in the other stream
+                    number = min(chunk, frames - index)
+                    if number != setupFrames:
+                        self.numberPicturesToTake = number
+                        try:
+                            sizeStream = self.setupExposureSequential()
+                        finally:
+                            self.numberPicturesToTake = numberPicturesToTake
+                        setupFrames = number
+                    stream = streams[0] if done is None or done[0] is streams[1] else streams[1]
+                    self.startExposureSequential(sizeStream, stream)
+                    end = None if frameTime is None else time.perf_counter() + number * frameTime
+                    running = (stream, index, number)
+                    index = index + number
+                if done is not None:
+                    pixels = numpy.frombuffer(done[0], dtype=numpy.uint16, count=done[2] * frameSize).reshape(done[2], frameSize)
+                    images = []
+                    offset = 0
+                    for rows, columns in shapes:
+                        images.append(pixels[:, offset:offset + rows * columns].reshape(done[2], rows, columns))
+                        offset += rows * columns
+                    yield done[1], images
+        finally:
+            if running is not None:
+                self._abortExposure(running[0])
+                
+    def acquireSequence(self, frames, consumer, maxMemory=SEQUENCE_MEMORY_LIMIT, chunk=None):
+        """Acquires frames exposures by chunks (see streamSequence), calling 
+        consumer(index, images) for each chunk while the next one is acquired.
+        
+        Returns
+        ----------
+        frames : number of frames delivered
+        """
+        delivered = 0
+        for index, images in self.streamSequence(frames, maxMemory, chunk):
+            consumer(index, images)
+            delivered += len(images[0])
+        return delivered
+        
+    def acquireStatistics(self, frames, maxMemory=SEQUENCE_MEMORY_LIMIT, chunk=None):
+        """Acquires frames exposures by chunks (see streamSequence) keeping 
+        only the running statistics of each pixel.
+        
+        Returns
+        ----------
+        statistics : list (one per ROI) of pvcam_statistics.PixelStatistics 
+            (count, mean, variance, min and max of each pixel)
+        """
+        import pvcam_statistics  # loads pvcam_processing and multiprocessing
+        statistics = [pvcam_statistics.PixelStatistics(shape) for shape in self._frameShapes()]
+        for index, images in self.streamSequence(frames, maxMemory, chunk):
+            for accumulator, image in zip(statistics, images):
+                accumulator.update(image)
+        return statistics
+        
+    def acquirePipelined(self, frames, stages=(), queueSize=2, chunk=1, maxMemory=SEQUENCE_MEMORY_LIMIT):
+        """Starts an acquisition of frames exposures whose chunks are 
+        processed by stages in other threads while the camera acquires the 
+        next ones (see pvcam_pipeline).
+        
+        Parameters
+        ----------
+        frames : number of exposures
+        stages : list of functions f(index, data) or of (name, function), 
+            data being for the first stage the list (one per ROI) of numpy 
+            arrays (frames of the chunk, rows, columns) and for the others 
+            what the previous stage returned
+        queueSize : number of chunks waiting between two stages
+        chunk : number of frames of a sub-sequence of the camera
+        maxMemory : bytes for the two pixel streams of the camera
+            
+        Returns
+        ----------
+        run : pvcam_pipeline.PipelinedAcquisition, iterate over it to get 
+            the (index, data) of the last stage; run.stats() gives the 
+            utilisation of each stage
+        """
+        return pvcam_pipeline.PipelinedAcquisition(self, frames, stages, queueSize, chunk, maxMemory).start()
+            
     def startContinuous(self):
         sizeStream = self.setupExposureContinuous()
         sizeBuffer = 5 * sizeStream
@@ -2614,6 +3713,9 @@ class Princeton(object):
         
     def retrieveContinuousFrame(self):
         frame = self._exposureGetLatestFrame()
+        self.telemetry.addFrames(1)
+        if self.timeToFirstFrame is None:
+            self._firstFrame()
         if len(self.ROI) == 1:
             roi = self.ROI[0]
             sizei = int((roi[1] - roi[0] + 1) / roi[2])
@@ -2621,10 +3723,227 @@ class Princeton(object):
             image = frame[0:(sizei * sizej)]
             return numpy.reshape(numpy.array(image), (sizei, sizej))
         
+#==============================================================================
+#     Cooling monitor
+#==============================================================================
+
+    def startCoolingMonitor(self, interval=1., history=3600):
+        """Starts sampling the temperature in the background (see CoolingMonitor).
+        
+        While it runs, the temperature property returns the last sample 
+        without asking the driver.
+        
+        Parameters
+        ----------
+        interval : second between two samples
+        history : number of samples kept
+        
+        Returns
+        ----------
+        monitor : CoolingMonitor
+        """
+        if self._coolingMonitor is None:
+            self._coolingMonitor = CoolingMonitor(self, interval, history)
+        self._coolingMonitor.interval = interval
+        return self._coolingMonitor.start()
+        
+    def stopCoolingMonitor(self):
+        """Stops the cooling monitor (its history is kept)."""
+        if self._coolingMonitor is not None:
+            self._coolingMonitor.stop()
+            
+    def _getCoolingMonitor(self):
+        """CoolingMonitor of the camera, None if it was never started."""
+        return self._coolingMonitor
+        
+    coolingMonitor = property(_getCoolingMonitor)
+    
+#==============================================================================
+#     Acquisition planner
+#==============================================================================
+
+    def cameraTiming(self, refresh=False, speeds=()):
+        """Timing parameters of the camera used by the planner (see pvcam_planner).
+        
+        They are read from the camera at the first call and kept. PIX_TIME 
+        depends on the speed index: it is read for the current one without 
+        changing the setup, and kept for each speed met. The other speeds 
+        (speeds) are only read on demand, by switching SPDTAB_INDEX, which is 
+        then restored with GAIN_INDEX. The readout model is scaled to 
+        READOUT_TIME of the last sequence and the host overhead comes from 
+        the last sequences, both are updated at each call.
+        
+        Parameters
+        ----------
+        refresh : read the parameters from the camera again
+        speeds : speed indexes whose PIX_TIME is needed besides the current 
+            one, None for all of them
+            
+        Returns
+        -------
+        timing : pvcam_planner.CameraTiming
+        """
+        if self._timing is None or refresh:
+            serSize, parSize = self.getCameraSize()
+            
+            def optional(parameter, default):
+                try:
+                    return self.getParameterCurrentValue(parameter)
+                except PrincetonError:
+                    return default
+            
+            self._timing = pvcam_planner.CameraTiming(serSize, parSize,
+                                                      parShift=self.getParameterCurrentValue(API.PARAM_PAR_SHIFT_TIME) * 1e-9,
+                                                      serShift=optional(API.PARAM_SER_SHIFT_TIME, 0) * 1e-9,
+                                                      pixelTimes={},
+                                                      expMin=optional(API.PARAM_EXP_MIN_TIME, 0.) * 1e-3)
+        timing = self._timing
+        pixelTimes = timing.pixelTimes
+        with driverLock:
+            speed = self.getParameterCachedValue(API.PARAM_SPDTAB_INDEX)
+            if speed not in pixelTimes:
+                pixelTimes[speed] = self.getParameterCachedValue(API.PARAM_PIX_TIME) * 1e-9
+            if speeds is None:
+                speeds = range(self.getParameterValue(API.PARAM_SPDTAB_INDEX, AttributeType.maxValue) + 1)
+            missing = [s for s in speeds if s not in pixelTimes]
+            if missing:
+                gain = self.getParameterCachedValue(API.PARAM_GAIN_INDEX)
+                try:
+                    for s in missing:
+                        self.setParameterValue(API.PARAM_SPDTAB_INDEX, s)
+                        pixelTimes[s] = self.getParameterCurrentValue(API.PARAM_PIX_TIME) * 1e-9
+                finally:
+                    self.setParameterValue(API.PARAM_SPDTAB_INDEX, speed)
+                    self.setParameterValue(API.PARAM_GAIN_INDEX, gain)
+        if self._sequences:
+            frames, exposure, rois, speed, duration = self._sequences[-1]
+            model = pvcam_planner.modelReadoutTime(timing, rois, speed) if speed in timing.pixelTimes else 0.
+            try:
+                readout = self.getParameterCurrentValue(API.PARAM_READOUT_TIME) * 1e-3
+            except PrincetonError:
+                readout = 0.
+            if model > 0 and readout > 0:
+                timing.readoutScale = readout / model
+            timing.overhead, timing.frameOverhead = pvcam_planner.hostOverhead(timing, self._sequences)
+        return timing
+        
+    def planAcquisition(self, exposure=None, rois=None, frames=None, speed=None, signal=None, dark=0., 
+                        readNoise=pvcam_planner.DEFAULT_READ_NOISE):
+        """Predicts a sequence without running it (see pvcam_planner.predict).
+        
+        The values not given are the ones of the camera.
+        
+        Parameters
+        ----------
+        exposure : second
+        rois : list of (s1, s2, sbin, p1, p2, pbin)
+        frames : number of exposures
+        speed : speed index (SPDTAB_INDEX)
+        signal : electrons per second per pixel of the chip (for the snr)
+        dark : electrons per second per pixel of the chip
+        readNoise : electrons rms, or dict speed index: electrons rms
+            
+        Returns
+        -------
+        plan : pvcam_planner.AcquisitionPlan (frameRate, throughput in MB/s, memory in bytes, ...)
+        """
+        timing = self.cameraTiming(speeds=() if speed is None else (speed,))
+        if exposure is None:
+            exposure = self._exposureSeconds()
+        if rois is None:
+            rois = self.ROI
+        if frames is None:
+            frames = self.numberPicturesToTake
+        if speed is None:
+            speed = self.getParameterCachedValue(API.PARAM_SPDTAB_INDEX)
+        return pvcam_planner.predict(timing, rois, exposure, frames, speed, signal, dark, readNoise)
+        
+    def findFastestConfiguration(self, targetRate=None, targetSnr=None, signal=None, dark=0., 
+                                 readNoise=pvcam_planner.DEFAULT_READ_NOISE, region=None, frames=None, 
+                                 exposure=None, speeds=None, sbins=None, pbins=None):
+        """Fastest binning and speed index meeting a frame rate or a signal 
+        to noise ratio (see pvcam_planner.search).
+        
+        Parameters
+        ----------
+        targetRate : minimum frames per second
+        targetSnr : minimum signal to noise ratio of a binned pixel (needs signal)
+        signal, dark, readNoise : see planAcquisition
+        region : (s1, s2, p1, p2) part of the chip (the first ROI by default)
+        frames : number of exposures (numberPicturesToTake by default)
+        exposure : second, fixed exposure (the shortest one by default)
+        speeds, sbins, pbins : candidates (all the speeds and the divisors of the region by default), 
+            reading PIX_TIME of speeds not used yet switches SPDTAB_INDEX
+            
+        Returns
+        -------
+        plan : pvcam_planner.AcquisitionPlan, None if no configuration meets the targets
+        """
+        if region is None:
+            s1, s2, sbin, p1, p2, pbin = self.ROI[0]
+            region = (s1, s2, p1, p2)
+        if frames is None:
+            frames = self.numberPicturesToTake
+        plans = pvcam_planner.search(self.cameraTiming(speeds=speeds), region, frames, targetRate, targetSnr, signal, dark,
+                                     readNoise, exposure, speeds, sbins, pbins)
+        return plans[0] if plans else None
+        
+#==============================================================================
+#     Profiling
+#==============================================================================
+
+    def enableProfiling(self, history=1000, countCalls=True):
+        """Records the duration of each phase of every takePicture().
+        
+        Phases are: setup (pl_exp_setup_seq), allocate (pl_buf_alloc),
+        start (stream allocation and pl_exp_start_seq), the status polled
+        until it changes (usually exposureInProgress, its precision is
+        pollInterval), finish (pl_exp_finish_seq) and convert (convertStream).
+        When profiling is off, takePicture() does not measure anything.
+        
+        Parameters
+        ----------
+        history : number of acquisitions kept for the statistics
+        countCalls : also count the pl_* calls of each acquisition by name
+        
+        Returns
+        -------
+        profiler : AcquisitionProfiler
+        """
+        self.disableProfiling()
+        self._profiler = AcquisitionProfiler(history, countCalls)
+        return self._profiler
+        
+    def disableProfiling(self):
+        """Stops recording the acquisitions. Returns the AcquisitionProfiler (or None) with the records."""
+        profiler = self._profiler
+        self._profiler = None
+        if profiler is not None:
+            profiler.close()
+        return profiler
+        
+    def _getProfiler(self):
+        return self._profiler
+        
+    profiler = property(_getProfiler)
+
 #==============================================================================
 #     Utility functions
 #============================================================================== 
 
+    def _firstFrame(self):
+        """Records timeToFirstFrame (second between the beginning of the
+        opening of the camera and the first frame received)."""
+        self.timeToFirstFrame = time.perf_counter() - self._openStart
+        
+    def _getValidParameters(self):
+        if self._validParameters is None:
+            self._validParameters = self._EnumParam()
+        return self._validParameters
+        
+    validParameters = property(_getValidParameters, doc="Sorted names of the parameters of the camera (asked at first use).")
+    _valid_parameters = validParameters
+        
     def _EnumParam(self, verbose=False):
         """
         Valid parameters of the camera.
@@ -2662,6 +3981,7 @@ class PrincetonError(Exception):
             self.value = arg.GetLastErrorForCamera()
         else:
             self.value = int(arg)
+        errorCounts[self.value] += 1
 
     def __str__(self):
         """Return error message."""
@@ -3310,24 +4630,14 @@ class PrincetonError(Exception):
         The pg_decode_info structure is not initialized."""}
         
 def PrincetonEnumCamera():
-    some_int = int16()
-    res = API.pl_pvcam_init()
-    if res == 0:
-        errorcode = API.pl_error_code()
-        if not errorcode == 2001:
-            raise PrincetonError(errorcode)
-    if API.pl_cam_get_total(ct.byref(some_int)) == 0:
-        raise PrincetonError(API.pl_error_code())
-    return some_int.value
+    """Returns the number of cameras detected."""
+    with pvcamSession:
+        return pvcamSession.totalCameras()
         
 def PrincetonForceClose(number):
-    res = API.pl_pvcam_init()
-    if res == 0:
-        errorcode = API.pl_error_code()
-        if not errorcode == 2001:
-            raise PrincetonError(errorcode)
-    handle = int16(number)
-    if API.pl_cam_close(handle) == 0:
-        raise PrincetonError(API.pl_error_code())
-        
-        
+    """Closes the camera with handle number (left open by a crashed program)."""
+    with pvcamSession:
+        handle = int16(number)
+        with driverLock:
+            if API.pl_cam_close(handle) == 0:
+                raise PrincetonError(API.pl_error_code())
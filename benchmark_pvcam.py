@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the acquisition and conversion hot paths.
+
+Runs against the simulated driver (pvcam_sim), so it works on Linux without
+camera. Results are written as JSON so they can be compared between versions.
+
+Benchmarks
+----------
+takePicture : wall time per frame minus the simulated exposure and readout
+    (host overhead), for several exposure times
+convertStream : throughput for a spectrum (vertical binning) and a full 2D frame
+parameters : latency of getParameterCurrentValue/setParameterValue
+multiROI : takePicture time versus the number of ROIs
+spikes : cost of the stages Accumulate('robustSum') (cosmic_peaks_sequential)
+    and SpikeRemoval (cosmic_peaks_spatial) of the processing pipeline
+    versus repetitions and size
+imports : time to import the camera-control modules in a new interpreter, and
+    the heavy modules (plotting, fitting...) that they load
+open : time to open (and close) the camera, with the number of driver calls,
+    and time to the first frame
+
+Usage
+-----
+    python benchmark_pvcam.py -o results.json
+    python benchmark_pvcam.py --quick
+    python benchmark_pvcam.py -o new.json --compare old.json
+"""
+
+from __future__ import division, print_function
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import platform
+import subprocess
+
+os.environ.setdefault('PVCAM_DRIVER', 'simulated')
+
+import numpy
+import Princeton_wrapper
+from Princeton_wrapper import Princeton, ExposureUnits
+
+
+def _simulator():
+    """SimulatedPvcam behind Princeton_wrapper.API (and its proxies)."""
+    api = Princeton_wrapper.API
+    while not hasattr(api, 'camera') and hasattr(api, '_api'):
+        api = api._api
+    if not hasattr(api, 'camera'):
+        raise RuntimeError('the benchmarks need the simulated driver (PVCAM_DRIVER=simulated)')
+    return api
+
+
+def _timeit(function, repeat):
+    """Statistics (second) of repeat calls of function."""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    times = numpy.array(times)
+    return {'repeat': repeat,
+            'min': float(times.min()),
+            'median': float(numpy.median(times)),
+            'mean': float(times.mean())}
+
+
+def _quiet(function):
+    """Calls function with the standard output discarded (the wrapper prints a lot)."""
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            return function()
+        finally:
+            sys.stdout = stdout
+
+
+def _openCamera():
+    return _quiet(Princeton)
+
+
+def _setExposure(camera, exposure):
+    """Sets the exposure time (second) with the finest resolution."""
+    if exposure < 0.065535:
+        _quiet(lambda: camera.setExposureTime(int(exposure * 1e6), ExposureUnits.microsecond))
+    else:
+        _quiet(lambda: camera.setExposureTime(int(exposure * 1e3), ExposureUnits.millisecond))
+
+
+def benchmarkTakePicture(camera, exposures, repeat):
+    """Host overhead per frame of takePicture versus exposure time (spectroscopy ROI)."""
+    simulator = _simulator()
+    simulator.camera.timeScale = 1.
+    ROIs = camera.ROI
+    camera._ROI = []
+    camera.addExposureROI(camera._ROIspectroscopy)
+    results = {}
+    for exposure in exposures:
+        _setExposure(camera, exposure)
+        readout = simulator.camera.readoutTime(camera.ROI)
+        stats = _timeit(lambda: _quiet(lambda: camera.takePicture(False)), repeat)
+        stats['exposure'] = exposure
+        stats['readout'] = readout
+        stats['overhead'] = stats['median'] - exposure - readout
+        results['%g' % exposure] = stats
+    camera._ROI = []
+    for ROI in ROIs:
+        camera.addExposureROI(ROI)
+    return results
+
+
+def benchmarkConvertStream(camera, repeat):
+    """Throughput of convertStream for a spectrum and a full frame."""
+    simulator = _simulator()
+    simulator.camera.timeScale = 0.
+    results = {}
+    ROIs = camera.ROI
+    for name, ROI in [('1D', camera._ROIspectroscopy), ('2D', camera._ROIfull)]:
+        camera._ROI = []
+        camera.addExposureROI(ROI)
+        images, infos = _quiet(lambda: camera.takePicture(False))
+        pixels = images[0][0].size
+        stats = _timeit(lambda: _quiet(lambda: camera.convertStream(None)), repeat)
+        stats['pixels'] = pixels
+        stats['MBps'] = pixels * 2 / stats['median'] / 1e6
+        results[name] = stats
+    camera._ROI = []
+    for ROI in ROIs:
+        camera.addExposureROI(ROI)
+    return results
+
+
+def benchmarkParameters(camera, repeat):
+    """Latency of parameter reading and writing."""
+    results = {}
+    for name in ['GAIN_INDEX', 'EXP_TIME', 'TEMP', 'CHIP_NAME', 'SHTR_OPEN_MODE']:
+        results['get ' + name] = _timeit(lambda: camera.getParameterCurrentValue(name), repeat)
+    gains = itertools.cycle([1, 2])
+    results['set GAIN_INDEX'] = _timeit(lambda: camera.setParameterValue('GAIN_INDEX', next(gains)), repeat)
+    results['get gain (property)'] = _timeit(lambda: camera.gain, repeat)
+    return results
+
+
+def benchmarkMultiROI(camera, numbers, repeat):
+    """takePicture time versus the number of ROIs (horizontal stripes of the chip)."""
+    simulator = _simulator()
+    simulator.camera.timeScale = 0.
+    serSize, parSize = camera.getCameraSize()
+    ROIs = camera.ROI
+    results = {}
+    for number in numbers:
+        camera._ROI = []
+        height = parSize // number
+        for i in range(number):
+            camera.addExposureROI((0, serSize - 1, 1, i * height, (i + 1) * height - 1, 1))
+        results[str(number)] = _timeit(lambda: _quiet(lambda: camera.takePicture(False)), repeat)
+    camera._ROI = []
+    for ROI in ROIs:
+        camera.addExposureROI(ROI)
+    return results
+
+
+def benchmarkSpikes(repetitions, sizes, repeat):
+    """Cost of the cosmic ray corrections of Easy_pvcam.measure, the stages
+    run by a ProcessingPipeline (conversion to float32 included)."""
+    import pvcam_processing
+    random = numpy.random.RandomState(0)
+    results = {}
+    sequential = pvcam_processing.ProcessingPipeline([pvcam_processing.Accumulate('robustSum')])
+    for n in repetitions:
+        frames = (1000 + 10 * random.standard_normal((n, 1, 100))).astype(numpy.uint16)
+        frames[n // 2, 0, 50] = 10000
+        results['robustSum %ix100' % n] = _timeit(lambda: sequential.run(frames), repeat)
+    spatial = pvcam_processing.ProcessingPipeline([pvcam_processing.SpikeRemoval(0.5)])
+    for size in sizes:
+        spectrum = (1000 + 10 * random.standard_normal((1, 1, size))).astype(numpy.uint16)
+        spectrum[0, 0, size // 3] = 10000
+        results['SpikeRemoval %i' % size] = _timeit(lambda: spatial.run(spectrum), repeat)
+    return results
+
+
+# modules that must not be loaded by importing the camera control
+_HEAVY_MODULES = ('matplotlib', 'lmfit', 'scipy', 'yaml', 'multiprocessing')
+
+
+def benchmarkImports(modules, repeat):
+    """Import time of each module in a new interpreter, and the heavy modules loaded."""
+    code = ("import sys, time; start = time.perf_counter(); import {module}; "
+            "print(time.perf_counter() - start); print(' '.join(sys.modules))")
+    results = {}
+    for module in modules:
+        times = []
+        for i in range(repeat):
+            output = subprocess.check_output([sys.executable, '-c', code.format(module=module)],
+                                             cwd=os.path.dirname(os.path.abspath(__file__)))
+            lines = output.decode().splitlines()
+            times.append(float(lines[-2]))
+        loaded = lines[-1].split()
+        results[module] = {'repeat': repeat,
+                           'min': min(times),
+                           'median': float(numpy.median(times)),
+                           'heavy': sorted(set(m.split('.')[0] for m in loaded) & set(_HEAVY_MODULES))}
+    return results
+
+
+def benchmarkOpen(repeat, callLatency):
+    """Time to open and close the camera, with callLatency (second) per driver call,
+    and time to the first frame (without exposure and readout time)."""
+    import pvcam_trace
+    simulator = _simulator()
+    simulator.callLatency = callLatency
+    timeScale = simulator.camera.timeScale
+    simulator.camera.timeScale = 0.
+    opening = []
+    firstFrame = []
+    closing = []
+    calls = 0
+    for i in range(repeat):
+        tracer = pvcam_trace.installTracer(ring=100000)
+        start = time.perf_counter()
+        camera = _openCamera()
+        opening.append(time.perf_counter() - start)
+        pvcam_trace.uninstallTracer()
+        calls = len(tracer.records)
+        _quiet(lambda: camera.takePicture(False))
+        firstFrame.append(camera.timeToFirstFrame)
+        start = time.perf_counter()
+        camera.close()
+        closing.append(time.perf_counter() - start)
+    simulator.callLatency = 0.
+    simulator.camera.timeScale = timeScale
+    return {'callLatency': callLatency,
+            'driverCalls': calls,
+            'open': float(numpy.median(opening)),
+            'firstFrame': float(numpy.median(firstFrame)),
+            'close': float(numpy.median(closing))}
+
+
+def _gitDescription():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except Exception:
+        return None
+
+
+def runBenchmarks(quick=False):
+    """Runs all the benchmarks. Returns a dict that can be saved as JSON."""
+    repeat = 3 if quick else 10
+    results = {}
+    results['imports'] = benchmarkImports(['master_Header_wrapper', 'Princeton_wrapper', 'easy_pvcam'], repeat)
+    results['open'] = benchmarkOpen(repeat=2 if quick else 5, callLatency=0.0005)
+    camera = _openCamera()
+    try:
+        results['takePicture'] = benchmarkTakePicture(camera, [0.001, 0.01, 0.1] if quick else [0.001, 0.01, 0.1, 1.],
+                                                      repeat=2 if quick else 5)
+        results['convertStream'] = benchmarkConvertStream(camera, repeat)
+        results['parameters'] = benchmarkParameters(camera, 20 * repeat)
+        results['multiROI'] = benchmarkMultiROI(camera, [1, 2, 4, 8], repeat)
+    finally:
+        camera.close()
+    results['spikes'] = benchmarkSpikes([5, 10] if quick else [5, 10, 20, 50],
+                                        [1340] if quick else [1340, 4096, 16384], repeat)
+    return {'version': Princeton_wrapper.__version__,
+            'git': _gitDescription(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'platform': platform.platform(),
+            'results': results}
+
+
+def _flatten(results, prefix=''):
+    """{'a': {'b': 1}} -> {'a/b': 1} for the numbers of results."""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + '/'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(old, new, keys=('median', 'overhead', 'MBps', 'open', 'firstFrame', 'driverCalls')):
+    """Lines comparing two results of runBenchmarks (new / old ratio)."""
+    old = _flatten(old['results'])
+    new = _flatten(new['results'])
+    lines = []
+    for key in sorted(new):
+        if key.split('/')[-1] in keys and key in old and old[key]:
+            lines.append('{0:<60}{1:>14.6g}{2:>14.6g}{3:>9.2f}'.format(key, old[key], new[key], new[key] / old[key]))
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('-o', '--output', help='JSON file for the results')
+    parser.add_argument('--quick', action='store_true', help='fewer repetitions and sizes')
+    parser.add_argument('--compare', help='JSON file of previous results')
+    arguments = parser.parse_args()
+    results = runBenchmarks(arguments.quick)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            previous = json.load(f)
+        print('{0:<60}{1:>14}{2:>14}{3:>9}'.format('', 'old', 'new', 'ratio'))
+        print('\n'.join(compare(previous, results)))
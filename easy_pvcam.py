@@ -15,16 +15,25 @@ Uses Princeton class from https://github.com/ColinBrosseau/pvcam_PrincetonInstru
 """
 from Princeton_wrapper import Princeton, PrincetonError
 from master_Header_wrapper import *
-import matplotlib.pyplot as plt
 import numpy as np
-import yaml
-import spikes
+import pvcam_calibration
+import pvcam_config
+import pvcam_processing
+import pvcam_ptc
+import pvcam_wavelength
 
 
 class Easy_pvcam(Princeton):
     def __init__(self, number=0):
         super(Easy_pvcam, self).__init__(number = number)
-        
+        try:
+            self._setUp(number)
+        except Exception:
+            # a failed construction does not keep the camera and the PVCAM session
+            super(Easy_pvcam, self).close()
+            raise
+
+    def _setUp(self, number):
         # Reinitialise
         # Without that, the second time one calls self.takePicture() it'll crash
         self.takePicture()
@@ -34,11 +43,20 @@ class Easy_pvcam(Princeton):
             self.closeCamera()
         super(Easy_pvcam, self).__init__(number = number)        
         
-        chip_name = self.getParameterCurrentValue('CHIP_NAME').decode('UTF-8').replace(' ','')
+        chip_name = self.getParameterCurrentValue('CHIP_NAME')
 
-        # import cameras configuration        
-        with open("easy_pvcam.yaml", 'r') as ymlfile:
-            camera_cfg = yaml.load(ymlfile)
+        # cameras configuration (validated, read once)
+        self.configProfile = pvcam_config.loadConfig().profile(chip_name)
+        self.preset = None
+        # hot, noisy and dead pixels of the chip (see pvcam_calibration.detectDefects), None if unknown
+        self.defectMap = pvcam_calibration.CalibrationStore().loadDefects(chip_name)
+        # conversion gains (see pvcam_ptc), used when units is 'electrons'
+        self.gainTable = pvcam_ptc.GainTable.forChip(chip_name)
+        self.units = 'counts'
+        # wavelength calibration of the spectrometer (see pvcam_wavelength), None if unknown
+        self.wavelengthCalibration = pvcam_wavelength.loadCalibration(pvcam_wavelength.calibrationPath(chip_name))
+        self.centerWavelength = None  # nm, to be set with the spectrometer
+        self._wavelengthAxes = None
 
         # DEFAULTS
         # Default temperature setpoint for safety if not present in configuration file  
@@ -49,45 +67,37 @@ class Easy_pvcam(Princeton):
         # Default Signal corrections        
         self.__cosmic_peaks_spatial = None  # None, [0-100] Correct pixel above some threshold from neighbor mean value
         self.__cosmic_peaks_sequential = None
+        # Processing of the measurements, None for the default one (see processingPipeline)
+        self.processing = None
+        self._defaultProcessing = (None, None)
         #By default, camera is in full frame mode, set it to spectroscopy mode
         #set camera to 1D (vertical binning) acquisition
         self.setSpectroscopy()
         
-        # Set camera parameters
-        # Temperature (celcius)
-        try:
-            self.setpoint_temperature = camera_cfg[chip_name]['setpoint_temperature']
-        except KeyError:
-            pass
-        # ADC speed index
-        try:
-            self.speed = camera_cfg[chip_name]['speed']
-        except KeyError:
-            pass
-        # ADC gain
-        try:
-            self.gain = camera_cfg[chip_name]['gain']  
-        except KeyError:
-            pass
-        # Exposure time in second
-        try:
-            self.exposureTime = camera_cfg[chip_name]['exposureTime']  
-        except KeyError:
-            pass
-
         # Mecanical Shutter
         self._shutter_present = False
-        try:
-            if 'shutter' in camera_cfg[chip_name]:
-                self._initShutter()  # initialise Logic Output to drive the shutter
-                # Delay (second) for setting of a mecanical shutter
-                self.delayShutter = camera_cfg[chip_name]['shutter']['delay']
-                # Shutter configuration
-                self._ShutterMode = {'closed':ShutterOpenMode[camera_cfg[chip_name]['shutter']['closed']], 'opened':ShutterOpenMode[camera_cfg[chip_name]['shutter']['opened']]}
-                self.shutter = 'closed'  # Needed to put the shutter in a valid state
-                self._shutter_present = True
-        except KeyError:
-            pass
+        self._shutterConfig = None
+
+        # Set camera parameters (temperature, ADC speed and gain, exposure time, shutter)
+        if self.configProfile is not None:
+            self.applyPreset(pvcam_config.DEFAULT_PRESET)
+        
+    def applyPreset(self, name):
+        """Switches to the preset name of the configuration of the chip 
+        (only the parameters that change are written).
+        
+        Returns the report of pvcam_config.applyPreset (changes and timing).
+        """
+        if self.configProfile is None:
+            raise KeyError('no configuration for this chip')
+        report = pvcam_config.applyPreset(self, self.configProfile, name)
+        self.preset = name
+        return report
+        
+    @property
+    def presets(self):
+        """Names of the presets of the chip."""
+        return list(self.configProfile.presets) if self.configProfile is not None else []
         
     def setImage(self):
         self._ROI = []
@@ -98,9 +108,87 @@ class Easy_pvcam(Princeton):
         self.addExposureROI(self._ROIspectroscopy)
 
 #   Typical measurement
-    def measure(self, exposure=False, removeBackgound=False):
+    def processingPipeline(self):
+        """Processing of the frames of measure(): self.processing if it is 
+        set, otherwise the pipeline given by the signal corrections 
+        (defectMap, conversion to electrons if units is 'electrons', 
+        cosmic_peaks_sequential, then cosmic_peaks_spatial).
+        
+        Returns
+        -------
+        pipeline : pvcam_processing.ProcessingPipeline
+        """
+        if self.processing is not None:
+            return self.processing
+        roi = tuple(self.ROI[0])
+        electrons = self._electronsStage()
+        key = (self.defectMap, roi, electrons, self.__cosmic_peaks_sequential, self.__cosmic_peaks_spatial)
+        if self._defaultProcessing[0] != key:
+            stages = []
+            if self.defectMap is not None:
+                stages.append(pvcam_calibration.DefectCorrection(self.defectMap, roi))
+            if electrons is not None:
+                stages.append(pvcam_ptc.ToElectrons(*electrons))
+            if self.__cosmic_peaks_sequential:
+                stages.append(pvcam_processing.Accumulate('robustSum'))
+            if self.cosmic_peaks_spatial:
+                stages.append(pvcam_processing.SpikeRemoval(self.cosmic_peaks_spatial))
+            previous = self._defaultProcessing[1]
+            self._defaultProcessing = (key, pvcam_processing.ProcessingPipeline(stages, workers=4))
+            if previous is not None:
+                previous.close()  # stops its worker threads
+        return self._defaultProcessing[1]
+        
+    def _electronsStage(self):
+        """(conversion gain, offset) of the current speed and gain indexes 
+        if units is 'electrons', else None."""
+        if self.units == 'counts':
+            return None
+        if self.units != 'electrons':
+            raise ValueError("units should be 'counts' or 'electrons', not {0!r}".format(self.units))
+        speed = self.getParameterCachedValue('SPDTAB_INDEX')
+        gain = self.getParameterCachedValue('GAIN_INDEX')
+        entry = self.gainTable.entry(speed, gain)
+        if entry is None:
+            raise ValueError('no conversion gain for speed {0} and gain {1} (see pvcam_ptc)'.format(speed, gain))
+        offset = entry.offset or 0.
+        if self.calibrationStore is not None:
+            maps = self.calibrationStore.forCamera(self)[0]
+            if maps is not None and maps.dark is not None:
+                offset = 0.  # already subtracted by convertStream
+        return entry.conversionGain, offset
+        
+    def _takeFrames(self):
+        """Takes numberPicturesToTake pictures. Returns the frames of the 
+        first ROI as a numpy array (frames, rows, columns) and the metadata 
+        of the first one."""
+        images, metadata = self.takePicture()
+        rows, columns = self._frameShapes()[0]
+        frames = np.array([exposure[0] for exposure in images]).reshape(len(images), rows, columns)
+        return frames, metadata[0][0]
+        
+    def measure(self, exposure=False, removeBackgound=False, pipeline=None):
+        """Takes numberPicturesToTake pictures and processes them.
+        
+        Parameters
+        ----------
+        exposure : total exposure time in second (shared by the pictures), 
+            the current one if False
+        removeBackgound : also take the pictures with the shutter closed, 
+            process them the same way and subtract them
+        pipeline : pvcam_processing.ProcessingPipeline for this measurement 
+            (see processingPipeline by default)
+            
+        Returns
+        -------
+        spectrum : float32 numpy array, result of the pipeline with the 
+            dimensions of length 1 removed
+        metadata : metadata of the first picture
+        """
         if exposure:
             self.exposureTime = exposure / self.numberPicturesToTake
+        if pipeline is None:
+            pipeline = self.processingPipeline()
 
         if removeBackgound and not self._shutter_present:
             import warnings
@@ -109,32 +197,41 @@ class Easy_pvcam(Princeton):
         if removeBackgound and self._shutter_present:
             # Measure background
             self.shutter = 'closed'
-            background, metadata = self.takePicture()
-            background = np.squeeze(background)
+            background, metadata = self._takeFrames()
+            background = pipeline.run(background, copy=True)
             # Measure signal + background
             self.shutter = 'opened'
-            spectrum, metadata = self.takePicture()
-            spectrum = np.squeeze(spectrum)
-            metadata = metadata[0][0]             
-            # Perform cosmic peak sequential correction
-            if self.__cosmic_peaks_sequential:
-                spectrum = spikes.cleanSpikes(spectrum)
-                background = spikes.cleanSpikes(background) 
+            frames, metadata = self._takeFrames()
+            spectrum = pipeline.run(frames, copy=True)
             # Calculate signal without background
-            spectrum = spectrum - background
+            spectrum -= background
         else: 
             # Measure signal + background
-            spectrum, metadata = self.takePicture()
-            spectrum = np.squeeze(spectrum)
-            metadata = metadata[0][0]             
-            # Perform cosmic peak sequential correction
-            if self.__cosmic_peaks_sequential:
-                spectrum = spikes.cleanSpikes(spectrum)
+            frames, metadata = self._takeFrames()
+            spectrum = pipeline.run(frames, copy=True)
         
-        # Correction cosmic_peaks_spatial
-        self._correct_cosmic_peaks_spatial(spectrum[0])
+        return np.squeeze(spectrum), metadata
         
-        return spectrum, metadata
+    def _axes(self):
+        """WavelengthAxes of wavelengthCalibration."""
+        if self.wavelengthCalibration is None:
+            raise ValueError('no wavelength calibration (see pvcam_wavelength)')
+        if self._wavelengthAxes is None or self._wavelengthAxes.calibration is not self.wavelengthCalibration:
+            self._wavelengthAxes = pvcam_wavelength.WavelengthAxes.forCamera(self, self.wavelengthCalibration)
+        return self._wavelengthAxes
+        
+    def wavelengths(self, center=None):
+        """Wavelength (nm) of each pixel of the spectra of measure() at the 
+        center wavelength center (centerWavelength if None), computed once 
+        per ROI and center wavelength (read-only array). It can be the axis 
+        of pvcam_stitching.stepAndGlue."""
+        return self._axes().axis(self.ROI[0], self.centerWavelength if center is None else center)
+        
+    def wavelengthResampler(self, grid, center=None):
+        """pvcam_processing.Resample stage putting the spectra of measure() 
+        on grid (uniform wavelengths in nm, see pvcam_wavelength.uniformGrid), 
+        to add to a processing pipeline."""
+        return self._axes().resampler(self.ROI[0], grid, self.centerWavelength if center is None else center)
               
     # Exposure time (second)
     @property
@@ -155,23 +252,38 @@ class Easy_pvcam(Princeton):
         exposureTime : exposure time in seconds 
                         unsigned int (0 - 65535)
         """
-        if exposure < 0.065535:  #short exposure, microsecond resolution
-            exposureUnits = ExposureUnits.microsecond
-            self.expTime = int(exposure * 1e6)
-        else:  #long exposure, millisecond resolution
-            exposureUnits = ExposureUnits.millisecond
-            self.expTime = int(exposure * 1e3)
+        # microsecond resolution for short exposures, else millisecond
+        exposureUnits, self.expTime = pvcam_config.exposureParameters(exposure)
                         
-        self.setParameterValue('EXP_RES_INDEX', exposureUnits.value)
+        self.setParameterValue('EXP_RES_INDEX', exposureUnits)
         self.setParameterValue('EXP_TIME', self.expTime)
        
     def close(self):
-           self.closeCamera()
+        pipeline = self._defaultProcessing[1]
+        self._defaultProcessing = (None, None)
+        if pipeline is not None:
+            pipeline.close()
+        super(Easy_pvcam, self).close()
            
     # Shutter
     def _initShutter(self):
         self.logicOutput = LogicOutput.shutter
         
+    def _configureShutter(self, shutter):
+        """Configures the mecanical shutter from the 'shutter' field of the 
+        configuration. Returns True if the configuration changed."""
+        if shutter == self._shutterConfig:
+            return False
+        self._initShutter()  # initialise Logic Output to drive the shutter
+        # Delay (second) for setting of a mecanical shutter
+        self.delayShutter = shutter['delay']
+        # Shutter configuration
+        self._ShutterMode = {'closed':ShutterOpenMode[shutter['closed']], 'opened':ShutterOpenMode[shutter['opened']]}
+        self.shutter = 'closed'  # Needed to put the shutter in a valid state
+        self._shutter_present = True
+        self._shutterConfig = shutter
+        return True
+        
     @property
     def shutter(self):
         reverseShutterMode = {v.name:k for k, v in self._ShutterMode.items()}
@@ -234,6 +346,7 @@ class Easy_pvcam(Princeton):
             self.__cosmic_peaks_sequential = False    
 
 if __name__ == '__main__':
+     import matplotlib.pyplot as plt
      camera = Easy_pvcam()
      print("ROI:")
      print(camera.ROI)
@@ -0,0 +1,571 @@
+# -*- coding: utf-8 -*-
+"""
+Flat-field, dark and bad pixel calibration of the frames.
+
+The maps depend on the setup of the camera: they are kept per
+CalibrationKey (chip, ROI with its binning, gain index, speed index). A
+CalibrationStore keeps them on disk, one directory per key, as .npy files
+memory-mapped when they are loaded: the maps of a large chip do not need to
+be read to start the acquisition, and several processes share the same
+pages.
+
+The correction of a frame is fused in
+
+    corrected = frame * gain - offset
+
+with gain = mean(flat) / flat (0 on the bad pixels) and offset = dark * gain,
+both precomputed, followed by the replacement of the bad pixels by the
+interpolation of their closest good neighbours in the same row (the
+indices and weights are precomputed too). The maps are stored already
+prepared, so loading them does not compute anything.
+
+When Princeton.calibrationStore is set, convertStream corrects the images
+of the ROIs that have maps for the current setup (float32 instead of
+uint16). CalibrationMaps is also a pvcam_processing.Stage.
+
+The hot, noisy and dead pixels of a chip do not change from day to day:
+detectDefects finds them once from a dark stack and gives a DefectMap in
+chip coordinates, kept by the store per chip. Its table for a ROI (bad
+binned pixels, neighbours and weights) is computed once, after which
+DefectCorrection only gathers and scatters these few pixels in each frame.
+
+Examples
+--------
+>>> import pvcam_calibration as pc
+>>> store = pc.CalibrationStore()
+>>> dark = pc.acquireMean(camera, 50)  # shutter closed
+>>> flat = pc.acquireMean(camera, 50)  # uniform illumination
+>>> for maps in pc.buildMaps(camera, dark, flat, smooth=15):
+...     store.save(maps)
+>>> camera.calibrationStore = store
+>>> images, infos = camera.takePicture()  # corrected
+>>> store.saveDefects(pc.detectDefects(camera, 100))  # shutter closed, once
+"""
+
+from __future__ import division
+
+import collections
+import json
+import os
+
+import numpy
+
+import pvcam_processing
+from master_Header_wrapper import ShutterOpenMode
+
+CALIBRATION_DIRECTORY = 'calibration'
+
+# maps as measured, and as applied
+MAP_NAMES = ('dark', 'flat', 'badPixels')
+PREPARED_NAMES = ('gain', 'offset', 'defects')
+
+# bad pixel: index of the pixel, indices of its neighbours and weight of the right one
+DEFECT_DTYPE = numpy.dtype([('index', '<i4'), ('left', '<i4'), ('right', '<i4'), ('weight', '<f4')])
+
+CalibrationKey = collections.namedtuple('CalibrationKey', 'chip roi gain speed')
+CalibrationKey.__doc__ = """Setup of the camera a calibration is valid for.
+
+chip : CHIP_NAME without spaces
+roi : (s1, s2, sbin, p1, p2, pbin)
+gain : GAIN_INDEX
+speed : SPDTAB_INDEX
+"""
+
+
+def keyName(key):
+    """Name of the directory of the maps of key."""
+    s1, s2, sbin, p1, p2, pbin = key.roi
+    return '{0}_s{1}-{2}x{3}_p{4}-{5}x{6}_gain{7}_speed{8}'.format(key.chip, s1, s2, sbin, p1, p2, pbin,
+                                                                   key.gain, key.speed)
+
+
+def _chipName(camera):
+    """CHIP_NAME of camera without spaces."""
+    chip = camera.getParameterCachedValue('CHIP_NAME')
+    if isinstance(chip, bytes):
+        chip = chip.decode('UTF-8')
+    return chip.replace(' ', '')
+
+
+def cameraKeys(camera):
+    """CalibrationKey of each ROI of the current setup of camera."""
+    chip = _chipName(camera)
+    gain = int(camera.getParameterCachedValue('GAIN_INDEX'))
+    speed = int(camera.getParameterCachedValue('SPDTAB_INDEX'))
+    return [CalibrationKey(chip, tuple(int(v) for v in roi), gain, speed) for roi in camera.ROI]
+
+
+def _shape(roi):
+    s1, s2, sbin, p1, p2, pbin = roi
+    return ((p2 - p1 + 1) // pbin, (s2 - s1 + 1) // sbin)
+
+
+def _runningMedian(data, width):
+    """Median of width pixels around each pixel of the rows of data."""
+    half = width // 2
+    padded = numpy.pad(data, ((0, 0), (half, width - 1 - half)), mode='edge')
+    windows = numpy.lib.stride_tricks.sliding_window_view(padded, width, axis=1)
+    return numpy.median(windows, axis=-1)
+
+
+def _robustSpread(values):
+    """Median and standard deviation estimated from the median absolute deviation."""
+    median = numpy.median(values)
+    return median, 1.4826 * numpy.median(numpy.abs(values - median))
+
+
+def findBadPixels(dark=None, flat=None, hotSigma=6., deadFraction=0.5, brightFraction=1.5, width=15):
+    """Bad pixels of a chip (boolean array, True for the bad ones).
+
+    Parameters
+    ----------
+    dark : mean dark frame (rows, columns), its hot pixels are above the
+        median by more than hotSigma robust standard deviations
+    flat : flat frame (rows, columns) without dark, its dead pixels respond
+        less than deadFraction of the median of their width neighbours in
+        the row, its bright pixels more than brightFraction
+    """
+    if dark is None and flat is None:
+        raise ValueError('the bad pixels are found from a dark or a flat')
+    shape = (dark if dark is not None else flat).shape
+    bad = numpy.zeros(shape, dtype=bool)
+    if dark is not None:
+        median, sigma = _robustSpread(numpy.asarray(dark, dtype=numpy.float64))
+        bad |= dark > median + hotSigma * max(sigma, 1e-6)
+    if flat is not None:
+        flat = numpy.asarray(flat, dtype=numpy.float64)
+        local = _runningMedian(flat, min(width, flat.shape[1]))
+        bad |= flat < deadFraction * local
+        bad |= flat > brightFraction * local
+    return bad
+
+
+def _defects(badPixels):
+    """DEFECT_DTYPE array of the bad pixels (flat indices, row by row)."""
+    rows, columns = badPixels.shape
+    good = ~badPixels
+    column = numpy.arange(columns)
+    # closest good pixel at the left (-1: none) and at the right (columns: none)
+    left = numpy.maximum.accumulate(numpy.where(good, column, -1), axis=1)
+    right = numpy.minimum.accumulate(numpy.where(good, column, columns)[:, ::-1], axis=1)[:, ::-1]
+    row, col = numpy.nonzero(badPixels)
+    l, r = left[row, col], right[row, col]
+    defects = numpy.zeros(len(row), dtype=DEFECT_DTYPE)
+    weight = numpy.where((l >= 0) & (r < columns), (col - l) / numpy.maximum(r - l, 1), 0.)
+    weight[(l < 0) & (r < columns)] = 1.
+    l = numpy.where(l < 0, numpy.where(r < columns, r, col), l)
+    r = numpy.where(r >= columns, l, r)
+    defects['index'] = row * columns + col
+    defects['left'] = row * columns + l
+    defects['right'] = row * columns + r
+    defects['weight'] = weight
+    return defects
+
+
+def _interpolateDefects(frames, defects):
+    """Replaces the bad pixels of frames (frames, pixels) in place (see _defects)."""
+    if len(defects):
+        left = frames[:, defects['left']]
+        right = frames[:, defects['right']]
+        right -= left
+        right *= defects['weight']
+        right += left
+        frames[:, defects['index']] = right
+
+
+class CalibrationMaps(pvcam_processing.Stage):
+    """Dark, flat and bad pixel maps of one ROI, and their fused correction.
+
+    Parameters
+    ----------
+    key : CalibrationKey
+    dark : dark frame (rows, columns) in counts, for the exposure it will
+        be subtracted from, or None
+    flat : flat frame (rows, columns) without dark, or None
+    badPixels : boolean array (rows, columns), or None
+    info : dict saved with the maps (exposure, frames, date...)
+    """
+
+    def __init__(self, key, dark=None, flat=None, badPixels=None, info=None, prepared=None):
+        self.key = key
+        self.dark = dark
+        self.flat = flat
+        self.badPixels = badPixels
+        self.info = dict(info or {})
+        self.shape = _shape(key.roi)
+        for name in MAP_NAMES:
+            value = getattr(self, name)
+            if value is not None and value.shape != self.shape:
+                raise ValueError('the {0} map is {1}, the ROI {2} gives {3}'.format(name, value.shape, key.roi,
+                                                                                 self.shape))
+        if prepared is None:
+            prepared = self._prepare()
+        self.gain, self.offset, self.defects = prepared
+        self.size = self.shape[0] * self.shape[1]
+
+    def _prepare(self):
+        """gain, offset and defects of the maps."""
+        gain = numpy.ones(self.shape, dtype=numpy.float64)
+        good = numpy.ones(self.shape, dtype=bool) if self.badPixels is None else ~self.badPixels
+        if self.flat is not None:
+            good &= self.flat > 0
+            gain[good] = self.flat[good].mean() / self.flat[good]
+        gain[~good] = 0.
+        offset = None if self.dark is None else (self.dark * gain).astype(numpy.float32)
+        return gain.astype(numpy.float32), offset, _defects(~good)
+
+    @property
+    def kinds(self):
+        """Names of the maps present."""
+        return [name for name in MAP_NAMES if getattr(self, name) is not None]
+
+    def correct(self, frames, out=None):
+        """Corrected frames (float32).
+
+        Parameters
+        ----------
+        frames : array of one or more frames of the ROI, of any shape with
+            a multiple of rows * columns pixels in readout order
+        out : float32 array of the shape of frames (can be frames), or None
+        """
+        frames = numpy.asarray(frames)
+        if frames.size % self.size:
+            raise ValueError('{0} pixels are not frames of {1}'.format(frames.size, self.shape))
+        if out is None:
+            out = numpy.empty(frames.shape, dtype=numpy.float32)
+        flatFrames = frames.reshape(-1, self.size)
+        flatOut = out.reshape(-1, self.size)
+        numpy.multiply(flatFrames, self.gain.reshape(-1), out=flatOut, casting='unsafe')
+        if self.offset is not None:
+            flatOut -= self.offset.reshape(-1)
+        _interpolateDefects(flatOut, self.defects)
+        return out
+
+    def apply(self, data, out):
+        self.correct(data, out)
+
+    @property
+    def name(self):
+        return 'Calibration'
+
+    def __repr__(self):
+        return 'CalibrationMaps({0}, {1}, {2} bad pixels)'.format(keyName(self.key), '+'.join(self.kinds),
+                                                                  len(self.defects))
+
+
+# defect of a pixel of the chip: position, kind and deviation in robust standard deviations
+DEFECT_KINDS = ('hot', 'noisy', 'dead')
+CHIP_DEFECT_DTYPE = numpy.dtype([('row', '<i4'), ('column', '<i4'), ('kind', 'u1'), ('level', '<f4')])
+
+
+class DefectMap(object):
+    """Defective pixels of a chip, in chip coordinates, valid for every ROI
+    and setup (see detectDefects).
+
+    Attributes
+    ----------
+    chip : CHIP_NAME without spaces
+    shape : (rows, columns) of the chip
+    pixels : CHIP_DEFECT_DTYPE array (row, column, kind index in
+        DEFECT_KINDS, level)
+    threshold : level above which a pixel is defective
+    info : dict saved with the map
+    """
+
+    def __init__(self, chip, shape, pixels, threshold=6., info=None):
+        self.chip = chip
+        self.shape = tuple(shape)
+        self.pixels = numpy.asarray(pixels, dtype=CHIP_DEFECT_DTYPE)
+        self.threshold = threshold
+        self.info = dict(info or {})
+        self._tables = {}  # roi: DEFECT_DTYPE array
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def count(self, kind):
+        """Number of defects of kind ('hot', 'noisy' or 'dead')."""
+        return int(numpy.count_nonzero(self.pixels['kind'] == DEFECT_KINDS.index(kind)))
+
+    def mask(self, roi):
+        """Bad pixels (boolean array) of the image of roi (s1, s2, sbin, p1, p2, pbin).
+
+        A binned pixel is bad when the levels of its defects, the noise of
+        its bins adding in quadrature, exceed the threshold.
+        """
+        s1, s2, sbin, p1, p2, pbin = roi
+        shape = _shape(roi)
+        row = (self.pixels['row'] - p1) // pbin
+        column = (self.pixels['column'] - s1) // sbin
+        inside = ((self.pixels['row'] >= p1) & (self.pixels['column'] >= s1) &
+                  (row < shape[0]) & (column < shape[1]))
+        levels = numpy.zeros(shape)
+        numpy.add.at(levels, (row[inside], column[inside]), self.pixels['level'][inside])
+        return levels > self.threshold * numpy.sqrt(sbin * pbin)
+
+    def table(self, roi):
+        """Bad pixels of the image of roi and their neighbours (DEFECT_DTYPE
+        array, computed once per roi)."""
+        roi = tuple(int(v) for v in roi)
+        table = self._tables.get(roi)
+        if table is None:
+            table = self._tables[roi] = _defects(self.mask(roi))
+        return table
+
+    def __repr__(self):
+        return 'DefectMap({0}, {1})'.format(self.chip, ', '.join('{0} {1}'.format(self.count(kind), kind)
+                                                                  for kind in DEFECT_KINDS))
+
+
+class DefectCorrection(pvcam_processing.Stage):
+    """Replaces the defective pixels of a DefectMap in the images of roi
+    by the interpolation of their good neighbours in the row."""
+
+    def __init__(self, defectMap, roi):
+        self.defectMap = defectMap
+        self.roi = tuple(roi)
+        self.defects = defectMap.table(self.roi)
+        shape = _shape(self.roi)
+        self.size = shape[0] * shape[1]
+
+    def correct(self, frames):
+        """Corrects frames (float array of any shape with a multiple of the
+        pixels of the ROI, readout order) in place. Returns frames."""
+        _interpolateDefects(frames.reshape(-1, self.size), self.defects)
+        return frames
+
+    def apply(self, data, out):
+        self.correct(data)
+
+    def __repr__(self):
+        return 'DefectCorrection({0}, {1} pixels)'.format(self.defectMap.chip, len(self.defects))
+
+
+def detectDefects(camera, frames=50, hotSigma=6., noisySigma=6., maxMemory=None):
+    """DefectMap of the chip of camera from a dark stack (shutter closed).
+
+    The whole chip is read without binning, frames times, the shutter
+    kept closed; the per pixel mean and standard deviation over the frames
+    are accumulated chunk by chunk (Princeton.acquireStatistics). A pixel
+    is hot (dead) when its mean is above (below) the median of the chip
+    by more than hotSigma robust standard deviations, noisy (random
+    telegraph) when its standard deviation is above the median by more
+    than noisySigma.
+    """
+    sizes, sizep = camera.getCameraSize()
+    regions, shutter = camera._ROI, camera.shutterOpenMode
+    camera._ROI = []
+    camera.addExposureROI((0, sizes - 1, 1, 0, sizep - 1, 1))
+    try:
+        camera.shutterOpenMode = ShutterOpenMode.never
+        kwargs = {} if maxMemory is None else {'maxMemory': maxMemory}
+        statistics = camera.acquireStatistics(frames, **kwargs)[0]
+    finally:
+        camera._ROI = regions
+        camera.shutterOpenMode = shutter
+    mean, std = statistics.mean, statistics.std
+    median, spread = _robustSpread(mean)
+    deviation = (mean - median) / max(spread, 1e-6)
+    median, spread = _robustSpread(std)
+    # in units of the threshold hotSigma, in the order of DEFECT_KINDS
+    levels = numpy.array([deviation, (std - median) / max(spread, 1e-6) * hotSigma / noisySigma, -deviation])
+    level = levels.max(axis=0)
+    row, column = numpy.nonzero(level > hotSigma)
+    pixels = numpy.zeros(len(row), dtype=CHIP_DEFECT_DTYPE)
+    pixels['row'], pixels['column'] = row, column
+    pixels['kind'] = levels[:, row, column].argmax(axis=0)
+    pixels['level'] = level[row, column]
+    info = {'frames': frames, 'exposureTime': camera._exposureSeconds(), 'hotSigma': hotSigma,
+            'noisySigma': noisySigma}
+    return DefectMap(_chipName(camera), mean.shape, pixels, hotSigma, info)
+
+
+def calibrationDirectory(directory=None):
+    """Directory of the calibrations: directory, else $PVCAM_CALIBRATION,
+    else the 'calibration' directory next to this module."""
+    if directory is None:
+        directory = os.environ.get('PVCAM_CALIBRATION')
+    if directory is None:
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), CALIBRATION_DIRECTORY)
+    return os.path.abspath(directory)
+
+
+class CalibrationStore(object):
+    """CalibrationMaps kept on disk, one directory per CalibrationKey (see
+    keyName) with an .npy file per map and an info.json.
+
+    The maps loaded are memory-mapped (read only) and kept until their
+    info.json changes.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = calibrationDirectory(directory)
+        self._cache = {}  # key: (modification time, CalibrationMaps or None)
+
+    def path(self, key):
+        return os.path.join(self.directory, keyName(key))
+
+    def save(self, maps):
+        """Writes maps (the files are replaced, never half written)."""
+        path = self.path(maps.key)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        arrays = {'gain': maps.gain, 'offset': maps.offset, 'defects': maps.defects}
+        for name in MAP_NAMES:
+            arrays[name] = getattr(maps, name)
+        for name, array in arrays.items():
+            filename = os.path.join(path, name + '.npy')
+            if array is None:
+                if os.path.exists(filename):
+                    os.remove(filename)
+                continue
+            with open(filename + '.tmp', 'wb') as f:
+                numpy.save(f, numpy.asarray(array))
+            os.replace(filename + '.tmp', filename)
+        info = dict(maps.info, chip=maps.key.chip, roi=list(maps.key.roi), gain=maps.key.gain, speed=maps.key.speed)
+        with open(os.path.join(path, 'info.json.tmp'), 'w') as f:
+            json.dump(info, f, indent=1)
+        os.replace(os.path.join(path, 'info.json.tmp'), os.path.join(path, 'info.json'))
+        self._cache.pop(maps.key, None)
+
+    def load(self, key):
+        """CalibrationMaps of key, None if there is none."""
+        filename = os.path.join(self.path(key), 'info.json')
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            self._cache.pop(key, None)
+            return None
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(filename) as f:
+            info = json.load(f)
+        for field in CalibrationKey._fields:
+            info.pop(field, None)
+        arrays = {}
+        for name in MAP_NAMES + PREPARED_NAMES:
+            arrayFile = os.path.join(self.path(key), name + '.npy')
+            arrays[name] = numpy.load(arrayFile, mmap_mode='r') if os.path.exists(arrayFile) else None
+        maps = CalibrationMaps(key, arrays['dark'], arrays['flat'], arrays['badPixels'], info,
+                               prepared=(arrays['gain'], arrays['offset'], arrays['defects']))
+        self._cache[key] = (mtime, maps)
+        return maps
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self.path(key), 'info.json'))
+
+    def keys(self):
+        """CalibrationKey of the maps of the store."""
+        keys = []
+        if not os.path.isdir(self.directory):
+            return keys
+        for name in sorted(os.listdir(self.directory)):
+            filename = os.path.join(self.directory, name, 'info.json')
+            if os.path.exists(filename):
+                with open(filename) as f:
+                    info = json.load(f)
+                keys.append(CalibrationKey(info['chip'], tuple(info['roi']), info['gain'], info['speed']))
+        return keys
+
+    def remove(self, key):
+        """Deletes the maps of key."""
+        path = self.path(key)
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+            os.rmdir(path)
+        self._cache.pop(key, None)
+
+    def _defectsPath(self, chip):
+        return os.path.join(self.directory, chip + '_defects.npy')
+
+    def saveDefects(self, defectMap):
+        """Writes the DefectMap of a chip."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self._defectsPath(defectMap.chip)
+        with open(path + '.tmp', 'wb') as f:
+            numpy.save(f, defectMap.pixels)
+        os.replace(path + '.tmp', path)
+        info = dict(defectMap.info, chip=defectMap.chip, shape=list(defectMap.shape), threshold=defectMap.threshold)
+        with open(path[:-4] + '.json', 'w') as f:
+            json.dump(info, f, indent=1)
+        self._cache.pop(('defects', defectMap.chip), None)
+
+    def loadDefects(self, chip):
+        """DefectMap of chip (CHIP_NAME, with or without spaces), None if there is none."""
+        if isinstance(chip, bytes):
+            chip = chip.decode('UTF-8')
+        chip = chip.replace(' ', '')
+        path = self._defectsPath(chip)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        cached = self._cache.get(('defects', chip))
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(path[:-4] + '.json') as f:
+            info = json.load(f)
+        defectMap = DefectMap(info.pop('chip'), info.pop('shape'), numpy.load(path), info.pop('threshold'), info)
+        self._cache[('defects', chip)] = (mtime, defectMap)
+        return defectMap
+
+    def forCamera(self, camera):
+        """CalibrationMaps (or None) of each ROI of the current setup of camera."""
+        return [self.load(key) for key in cameraKeys(camera)]
+
+
+def acquireMean(camera, frames=20, maxMemory=None):
+    """Mean frame of each ROI over frames exposures of the current setup
+    (list of float64 arrays (rows, columns)), summed chunk by chunk."""
+    kwargs = {} if maxMemory is None else {'maxMemory': maxMemory}
+    sums = None
+    for index, images in camera.streamSequence(frames, **kwargs):
+        if sums is None:
+            sums = [numpy.zeros(image.shape[1:]) for image in images]
+        for total, image in zip(sums, images):
+            total += image.sum(axis=0, dtype=numpy.float64)
+    return [total / frames for total in sums]
+
+
+def buildMaps(camera, dark=None, flat=None, badPixels=True, smooth=None, info=None, defectMap=None, **limits):
+    """CalibrationMaps of each ROI of the current setup of camera.
+
+    Parameters
+    ----------
+    dark : list of dark frames (one per ROI, see acquireMean), or None
+    flat : list of frames of a uniform illumination (the dark is
+        subtracted), or None
+    badPixels : find the bad pixels (see findBadPixels, limits being its
+        parameters), or list of boolean arrays, or None
+    smooth : width of the running median (along the rows) the flat is
+        divided by, to correct only the pixel response (spectrometer lamp),
+        or None
+    info : dict saved with the maps, the exposure time is added
+    defectMap : DefectMap of the chip, its pixels are added to the bad pixels
+    """
+    info = dict(info or {})
+    info.setdefault('exposureTime', camera._exposureSeconds())
+    mapsList = []
+    for number, key in enumerate(cameraKeys(camera)):
+        d = None if dark is None else numpy.asarray(dark[number], dtype=numpy.float32)
+        f = None
+        if flat is not None:
+            f = numpy.asarray(flat[number], dtype=numpy.float64)
+            if d is not None:
+                f = f - d
+            if smooth:
+                f = f / numpy.maximum(_runningMedian(f, min(smooth, f.shape[1])), 1e-6)
+            f = f.astype(numpy.float32)
+        if badPixels is True:
+            b = findBadPixels(d, f, **limits) if d is not None or f is not None else None
+        elif badPixels is None or badPixels is False:
+            b = None
+        else:
+            b = numpy.asarray(badPixels[number], dtype=bool)
+        if defectMap is not None:
+            b = defectMap.mask(key.roi) if b is None else b | defectMap.mask(key.roi)
+        mapsList.append(CalibrationMaps(key, d, f, b, info))
+    return mapsList
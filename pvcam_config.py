@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration of the cameras (easy_pvcam.yaml).
+
+The file is read with yaml.safe_load and validated once (it is read again
+only if it changes). It has one section per chip, keyed by CHIP_NAME without
+spaces. The fields of a section are its 'default' preset, other presets
+override some of them:
+
+    EEV400x1340B:
+        setpoint_temperature: -100  # celcius
+        speed: 0
+        gain: 1
+        exposureTime: 1  # second
+        shutter:
+            opened: never
+            closed: presequence
+            delay: 0.1  # second
+        presets:
+            fast focus:
+                speed: 1
+                exposureTime: 0.01
+
+applyPreset() compares the parameters of a preset with the last values known
+by the camera (Princeton.getParameterCachedValue) and writes only the ones
+that differ, in one batch.
+
+Examples
+--------
+>>> import pvcam_config
+>>> config = pvcam_config.loadConfig()
+>>> profile = config.profile(camera.getParameterCurrentValue('CHIP_NAME'))
+>>> report = pvcam_config.applyPreset(camera, profile, 'fast focus')
+>>> report['changed'], report['total']
+"""
+
+from __future__ import division, print_function
+
+import os
+import time
+import collections
+
+from master_Header_wrapper import ShutterOpenMode, ExposureUnits
+
+CONFIG_NAME = 'easy_pvcam.yaml'
+
+DEFAULT_PRESET = 'default'
+
+# order in which the parameters are written (the speed table changes the gains)
+PARAMETER_ORDER = ('SPDTAB_INDEX', 'GAIN_INDEX', 'EXP_RES_INDEX', 'EXP_TIME', 'TEMP_SETPOINT')
+
+
+class ConfigError(ValueError):
+    """Invalid configuration file."""
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# field: (check, description)
+FIELDS = {
+    'setpoint_temperature': (lambda v: _number(v) and -110 <= v <= 20, 'number between -110 and 20 (celcius)'),
+    'speed': (lambda v: _integer(v) and v >= 0, 'ADC speed index (integer >= 0)'),
+    'gain': (lambda v: _integer(v) and v >= 1, 'ADC gain index (integer >= 1)'),
+    'exposureTime': (lambda v: _number(v) and 0 < v <= 65.535, 'number of seconds (up to 65.535)'),
+    'shutter': (lambda v: isinstance(v, dict), 'mapping with opened, closed and delay'),
+}
+
+SHUTTER_FIELDS = {
+    'opened': (lambda v: v in ShutterOpenMode.__members__, 'one of ' + ', '.join(ShutterOpenMode.__members__)),
+    'closed': (lambda v: v in ShutterOpenMode.__members__, 'one of ' + ', '.join(ShutterOpenMode.__members__)),
+    'delay': (lambda v: _number(v) and v >= 0, 'number of seconds >= 0'),
+}
+
+
+def chipKey(chipName):
+    """Key of a chip in the configuration: CHIP_NAME without spaces."""
+    if isinstance(chipName, bytes):
+        chipName = chipName.decode('UTF-8')
+    return chipName.replace(' ', '')
+
+
+def exposureParameters(exposure):
+    """(EXP_RES_INDEX, EXP_TIME) of an exposure time in seconds, microsecond
+    resolution for the exposures shorter than 65.535 ms."""
+    if exposure < 0.065535:  # short exposure, microsecond resolution
+        return ExposureUnits.microsecond.value, int(round(exposure * 1e6))
+    return ExposureUnits.millisecond.value, int(round(exposure * 1e3))
+
+
+def _validate(fields, where, errors):
+    for field, value in fields.items():
+        if field not in FIELDS:
+            errors.append('{0}: unknown field {1!r} (expected {2})'.format(where, field, ', '.join(sorted(FIELDS))))
+            continue
+        check, description = FIELDS[field]
+        if not check(value):
+            errors.append('{0}.{1}: {2!r} is not a {3}'.format(where, field, value, description))
+        elif field == 'shutter':
+            for key in SHUTTER_FIELDS:
+                if key not in value:
+                    errors.append('{0}.shutter: missing {1}'.format(where, key))
+            for key, v in value.items():
+                if key not in SHUTTER_FIELDS:
+                    errors.append('{0}.shutter: unknown field {1!r}'.format(where, key))
+                elif not SHUTTER_FIELDS[key][0](v):
+                    errors.append('{0}.shutter.{1}: {2!r} is not {3}'.format(where, key, v, SHUTTER_FIELDS[key][1]))
+
+
+class ChipProfile(object):
+    """Presets of one chip.
+
+    Attributes
+    ----------
+    name : key of the chip (CHIP_NAME without spaces)
+    presets : dict preset name: dict of fields (complete, the default preset
+        fields being included in the other presets)
+    """
+
+    def __init__(self, name, section, errors):
+        self.name = name
+        section = dict(section or {})
+        presets = section.pop('presets', None) or {}
+        _validate(section, name, errors)
+        self.presets = collections.OrderedDict([(DEFAULT_PRESET, section)])
+        if not isinstance(presets, dict):
+            errors.append('{0}.presets: should be a mapping of preset names'.format(name))
+            presets = {}
+        for presetName, fields in presets.items():
+            fields = fields or {}
+            if not isinstance(fields, dict):
+                errors.append('{0}.presets.{1}: should be a mapping'.format(name, presetName))
+                continue
+            _validate(fields, '{0}.presets.{1}'.format(name, presetName), errors)
+            preset = dict(section)
+            preset.update(fields)
+            self.presets[str(presetName)] = preset
+
+    def preset(self, name=DEFAULT_PRESET):
+        """dict of the fields of the preset name."""
+        try:
+            return self.presets[name]
+        except KeyError:
+            raise KeyError('no preset {0!r} for {1} (presets: {2})'.format(name, self.name, ', '.join(self.presets)))
+
+    def __repr__(self):
+        return 'ChipProfile({0!r}, presets={1})'.format(self.name, list(self.presets))
+
+
+class CameraConfig(object):
+    """Validated content of a configuration file.
+
+    Raises ConfigError listing all the problems of the file.
+    """
+
+    def __init__(self, data, path=None):
+        self.path = path
+        errors = []
+        if data is None:
+            data = {}
+        if not isinstance(data, dict):
+            raise ConfigError('{0}: should be a mapping of chip names'.format(path))
+        self.profiles = {}
+        for name, section in data.items():
+            if section is not None and not isinstance(section, dict):
+                errors.append('{0}: should be a mapping'.format(name))
+                continue
+            self.profiles[chipKey(str(name))] = ChipProfile(chipKey(str(name)), section, errors)
+        if errors:
+            raise ConfigError('invalid configuration {0}:\n  '.format(path) + '\n  '.join(errors))
+
+    def profile(self, chipName):
+        """ChipProfile of the chip (CHIP_NAME, with or without spaces), None if it is not configured."""
+        return self.profiles.get(chipKey(chipName))
+
+
+_cache = {}  # path: (modification time, CameraConfig)
+
+
+def configPath(path=None):
+    """Path of the configuration: path, else easy_pvcam.yaml of the current
+    directory if it exists, else the one next to this module."""
+    if path is None:
+        path = CONFIG_NAME
+        if not os.path.exists(path):
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_NAME)
+    return os.path.abspath(path)
+
+
+def loadConfig(path=None):
+    """CameraConfig of the file (see configPath), read again only if it changed."""
+    path = configPath(path)
+    mtime = os.path.getmtime(path)
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    import yaml
+    with open(path, 'r') as f:
+        try:
+            data = yaml.safe_load(f)
+        except yaml.YAMLError as error:
+            raise ConfigError('{0}: {1}'.format(path, error))
+    config = CameraConfig(data, path)
+    _cache[path] = (mtime, config)
+    return config
+
+
+def targetParameters(fields):
+    """OrderedDict parameter name: value of the fields of a preset, in PARAMETER_ORDER."""
+    values = {}
+    if 'speed' in fields:
+        values['SPDTAB_INDEX'] = fields['speed']
+    if 'gain' in fields:
+        values['GAIN_INDEX'] = fields['gain']
+    if 'exposureTime' in fields:
+        values['EXP_RES_INDEX'], values['EXP_TIME'] = exposureParameters(fields['exposureTime'])
+    if 'setpoint_temperature' in fields:
+        values['TEMP_SETPOINT'] = int(round(fields['setpoint_temperature'] * 100))
+    return collections.OrderedDict((name, values[name]) for name in PARAMETER_ORDER if name in values)
+
+
+def diff(camera, fields):
+    """OrderedDict parameter name: (known value, preset value) of the
+    parameters that must be written to apply fields (the gain is written
+    again after a change of the speed table, which can reset it)."""
+    changes = collections.OrderedDict()
+    for name, value in targetParameters(fields).items():
+        current = camera.getParameterCachedValue(name)
+        if current != value or (name == 'GAIN_INDEX' and 'SPDTAB_INDEX' in changes):
+            changes[name] = (current, value)
+    return changes
+
+
+def applyPreset(camera, profile, preset=DEFAULT_PRESET):
+    """Writes the parameters of a preset that differ from the camera state.
+
+    Parameters
+    ----------
+    camera : Princeton (the shutter is configured only by the cameras
+        having a _configureShutter method, like Easy_pvcam)
+    profile : ChipProfile
+    preset : name of the preset, or dict of fields
+
+    Returns
+    -------
+    report : dict with
+        preset : name of the preset
+        changed : OrderedDict parameter: (old value, new value)
+        unchanged : names of the parameters already right
+        durations : dict parameter: second to write it
+        diff : second to find the changes
+        total : second
+    """
+    import Princeton_wrapper  # loads the driver, not needed to read the configuration
+    start = time.perf_counter()
+    fields = profile.preset(preset) if not isinstance(preset, dict) else preset
+    report = {'preset': preset if not isinstance(preset, dict) else None,
+              'changed': collections.OrderedDict(),
+              'unchanged': [],
+              'durations': collections.OrderedDict()}
+    with Princeton_wrapper.driverLock:
+        targets = targetParameters(fields)
+        changes = diff(camera, fields)
+        report['diff'] = time.perf_counter() - start
+        for name, (old, new) in changes.items():
+            t = time.perf_counter()
+            camera.setParameterValue(name, new)
+            report['durations'][name] = time.perf_counter() - t
+            report['changed'][name] = (old, new)
+        report['unchanged'] = [name for name in targets if name not in changes]
+        if 'EXP_TIME' in targets:
+            camera.expTime = targets['EXP_TIME']  # used by the sequence setup
+        if 'shutter' in fields and hasattr(camera, '_configureShutter'):
+            t = time.perf_counter()
+            if camera._configureShutter(fields['shutter']):
+                report['durations']['shutter'] = time.perf_counter() - t
+                report['changed']['shutter'] = fields['shutter']
+    report['total'] = time.perf_counter() - start
+    return report
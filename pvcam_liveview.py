@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Live view: small uint8 previews of the frames at screen rate, for alignment.
+
+The frames are offered to a LiveView (offer(), or as a stage of a
+pvcam_pipeline.PipelinedAcquisition), which only keeps a reference to the
+last one: offering a frame costs the same whatever the preview does, so it
+never slows the acquisition feeding it. A thread makes the previews, at
+most rate per second, from the last frame offered; the frames offered in
+between are dropped, never queued, so a preview is never late by more than
+one preview time.
+
+A preview is the frame binned (block mean) to fit maxShape, scaled to uint8
+between two percentiles computed on a subsample of the pixels. The arrays
+are allocated once; latest() returns the last preview without waiting.
+
+LiveView.continuous(camera) also runs the acquisition: the camera acquires
+in continuous mode (circular buffer) and the latest frame is read at the
+preview rate.
+
+Examples
+--------
+>>> with pvcam_liveview.LiveView.continuous(camera, rate=25) as view:
+...     while aligning:
+...         preview = view.wait(timeout=1)
+...         show(preview.image)
+>>> # next to a recording
+>>> view = pvcam_liveview.LiveView().start()
+>>> run = camera.acquirePipelined(10000, [view, ('save', save)])
+"""
+
+from __future__ import division
+
+import collections
+import threading
+import time
+
+import numpy
+
+import Princeton_wrapper
+import pvcam_processing
+
+Preview = collections.namedtuple('Preview', 'image index timestamp low high latency')
+Preview.__doc__ = """Preview of a frame.
+
+image : uint8 array (rows, columns), valid until the second next preview
+    (copy it to keep it)
+index : number of the frame
+timestamp : time.perf_counter() when the frame was offered
+low, high : counts shown as 0 and 255
+latency : second from the offer of the frame to the preview
+"""
+
+
+def previewFactors(shape, maxShape):
+    """Binning (rows, columns) fitting a frame of shape in maxShape."""
+    return tuple(max(1, -(-size // maximum)) for size, maximum in zip(shape, maxShape))
+
+
+def percentiles(image, lower, upper, sample=4096):
+    """lower and upper percentiles of about sample pixels of image taken
+    at regular intervals."""
+    flat = image.reshape(-1)
+    values = flat[::max(1, flat.size // sample)]
+    low, high = numpy.percentile(values, (lower, upper))
+    return float(low), float(high)
+
+
+class LiveView(object):
+    """Previews of the last frame offered (see the module documentation).
+
+    Parameters
+    ----------
+    maxShape : largest (rows, columns) of a preview
+    rate : previews per second at most
+    lower, upper : percentiles of the counts shown as 0 and 255
+    sample : pixels used to compute the percentiles
+    smoothing : weight of the previous limits in the new ones (0 to 1),
+        to avoid flickering
+    roi : ROI previewed when used as a pipeline stage
+    """
+
+    def __init__(self, maxShape=(256, 512), rate=25., lower=1., upper=99.5, sample=4096, smoothing=0., roi=0):
+        self.maxShape = tuple(maxShape)
+        self.rate = rate
+        self.lower = lower
+        self.upper = upper
+        self.sample = sample
+        self.smoothing = smoothing
+        self.roi = roi
+        self.offered = 0  # frames offered
+        self.dropped = 0  # frames replaced before their preview
+        self.previews = 0
+        self._pending = None  # (frame, index, timestamp) waiting for the preview thread
+        self._lock = threading.Lock()
+        self._newFrame = threading.Event()
+        self._newPreview = threading.Condition()
+        self._stop = threading.Event()
+        self._latest = None
+        self._limits = None
+        self._binning = None  # (shape, Bin, float32 array)
+        self._images = None  # two uint8 arrays, used in turn
+        self._threads = []
+        self._camera = None
+        self.error = None
+
+    # Input
+
+    def offer(self, frame, index=None):
+        """Gives the last frame (rows, columns) to preview; the frame must
+        not be changed afterwards (copy it if its buffer is reused)."""
+        with self._lock:
+            if self._pending is not None:
+                self.dropped += 1
+            self.offered += 1
+            self._pending = (frame, self.offered - 1 if index is None else index, time.perf_counter())
+        self._newFrame.set()
+
+    def __call__(self, index, images):
+        """Stage of a PipelinedAcquisition: offers the last frame of the ROI
+        roi of the chunk, returns images."""
+        frames = images[self.roi]
+        self.offer(frames[-1], index + len(frames) - 1)
+        return images
+
+    # Previews
+
+    def _preview(self, frame, index, timestamp):
+        frame = numpy.asarray(frame)
+        if frame.ndim == 1:
+            frame = frame[numpy.newaxis]
+        if self._binning is None or self._binning[0] != frame.shape:
+            rows, columns = previewFactors(frame.shape, self.maxShape)
+            stage = pvcam_processing.Bin(rows, columns)
+            shape = stage.outputShape((1,) + frame.shape)
+            self._binning = (frame.shape, stage, numpy.empty(shape, dtype=numpy.float32))
+            self._images = [numpy.empty(shape[1:], dtype=numpy.uint8) for i in range(2)]
+        shape, stage, binned = self._binning
+        stage.apply(frame[numpy.newaxis], binned)
+        image = binned[0]
+        image /= stage.rows * stage.columns
+        low, high = percentiles(image, self.lower, self.upper, self.sample)
+        if self._limits is not None and self.smoothing:
+            low = self.smoothing * self._limits[0] + (1 - self.smoothing) * low
+            high = self.smoothing * self._limits[1] + (1 - self.smoothing) * high
+        self._limits = (low, high)
+        image -= low
+        image *= 255. / max(high - low, 1e-6)
+        numpy.clip(image, 0, 255, out=image)
+        numpy.rint(image, out=image)  # the cast truncates
+        output = self._images[self.previews % 2]  # not the one of the last preview
+        numpy.copyto(output, image, casting='unsafe')
+        return Preview(output, index, timestamp, low, high, time.perf_counter() - timestamp)
+
+    def _run(self):
+        interval = 1. / self.rate
+        try:
+            while not self._stop.is_set():
+                if not self._newFrame.wait(0.05):
+                    continue
+                start = time.perf_counter()
+                with self._lock:
+                    pending, self._pending = self._pending, None
+                    self._newFrame.clear()
+                if pending is None:
+                    continue
+                preview = self._preview(*pending)
+                with self._newPreview:
+                    self._latest = preview
+                    self.previews += 1
+                    self._newPreview.notify_all()
+                self._stop.wait(max(interval - (time.perf_counter() - start), 0))
+        except Exception as error:
+            self._fail(error)
+
+    def _fail(self, error):
+        self.error = error
+        self._stop.set()
+        with self._newPreview:
+            self._newPreview.notify_all()
+
+    def latest(self):
+        """Last Preview, None before the first one."""
+        return self._latest
+
+    def wait(self, timeout=None):
+        """Waits for the next preview. Returns it, or None after timeout second."""
+        with self._newPreview:
+            last = self._latest
+            self._newPreview.wait_for(lambda: self._latest is not last or self._stop.is_set(), timeout)
+            if self.error is not None:
+                raise self.error
+            return self._latest if self._latest is not last else None
+
+    # Continuous acquisition
+
+    @classmethod
+    def continuous(cls, camera, **options):
+        """LiveView of camera acquiring in continuous mode (started by start())."""
+        view = cls(**options)
+        view._camera = camera
+        return view
+
+    def _acquire(self):
+        camera = self._camera
+        rows, columns = camera._frameShapes()[0]
+        size = rows * columns
+        interval = 1. / self.rate
+        last = None
+        try:
+            camera.startContinuous()
+            try:
+                while not self._stop.is_set():
+                    start = time.perf_counter()
+                    with Princeton_wrapper.driverLock:
+                        status, number, byteCount, count = camera.exposureCheckContinuousStatus()
+                        frame = None
+                        if count and count != last:
+                            pointer = camera._exposureGetLatestFrame()
+                            if pointer is not None:
+                                frame = numpy.ctypeslib.as_array(pointer, shape=(size,)).reshape(rows, columns).copy()
+                    if frame is not None:
+                        camera.telemetry.addFrames(count - (last or 0))  # acquired since the last preview
+                        last = count
+                        self.offer(frame, count - 1)
+                    self._stop.wait(max(interval - (time.perf_counter() - start), 0.001))
+            finally:
+                camera.stopContinuous()
+        except Exception as error:
+            self._fail(error)
+
+    # Use
+
+    def start(self):
+        """Starts the preview thread (and the acquisition of continuous()). Returns the LiveView."""
+        if not self._threads:
+            self._stop.clear()
+            targets = [('liveview preview', self._run)]
+            if self._camera is not None:
+                targets.append(('liveview acquire', self._acquire))
+            for name, target in targets:
+                thread = threading.Thread(target=target, name=name)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Stops the threads (and the continuous acquisition)."""
+        self._stop.set()
+        with self._newPreview:
+            self._newPreview.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def stats(self):
+        """dict with offered, dropped, previews and latency (of the last preview)."""
+        latest = self._latest
+        return {'offered': self.offered,
+                'dropped': self.dropped,
+                'previews': self.previews,
+                'latency': None if latest is None else latest.latency}
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Pipelined acquisition: the camera acquires the next frames while the
+previous ones are processed.
+
+The acquisition runs in its own thread (Princeton.streamSequence, which
+already starts the next sub-sequence before delivering the previous one),
+copies each chunk out of the pixel streams and passes it to the processing
+stages. Each stage runs in its own thread; the stages are connected by
+bounded queues, so a slow stage makes the previous ones wait instead of
+filling the memory. In steady state the throughput is the one of the
+slowest stage; PipelinedAcquisition.stats() tells which one it is.
+
+A stage is a function f(index, data) returning the data given to the next
+stage, index being the index of the first frame of the chunk and data, for
+the first stage, the list (one per ROI) of numpy arrays (frames of the
+chunk, rows, columns) of uint16.
+
+Examples
+--------
+>>> def spectrum(index, images):
+...     return images[0].sum(axis=1)
+>>> with camera.acquirePipelined(1000, [('sum', spectrum)]) as run:
+...     for index, spectra in run:
+...         store(index, spectra)
+>>> run.stats()['sum']['utilisation']
+"""
+
+from __future__ import division
+
+import collections
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+_END = object()  # end of the acquisition, passed through the queues
+
+
+class StageStats(object):
+    """Activity of a stage of a PipelinedAcquisition (second).
+
+    Attributes
+    ----------
+    name : name of the stage
+    items : number of chunks processed
+    frames : number of frames acquired (acquisition stage)
+    busy : time spent working
+    waitInput : time spent waiting for the previous stage
+    waitOutput : time spent waiting for room in the queue of the next stage
+    maxQueue : largest number of chunks seen waiting in the input queue
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.frames = 0
+        self.busy = 0.
+        self.waitInput = 0.
+        self.waitOutput = 0.
+        self.maxQueue = 0
+
+    def asdict(self, elapsed):
+        return {'items': self.items,
+                'frames': self.frames,
+                'busy': self.busy,
+                'waitInput': self.waitInput,
+                'waitOutput': self.waitOutput,
+                'maxQueue': self.maxQueue,
+                'utilisation': self.busy / elapsed if elapsed > 0 else 0.}
+
+
+class PipelinedAcquisition(object):
+    """Acquisition of frames exposures by chunks, processed by stages in
+    other threads while the camera goes on (see the module documentation).
+
+    Iterate over it to get the (index, data) of the last stage, in order.
+    The acquisition is stopped (the sequence in progress aborted) by close()
+    or at the end of a with block.
+
+    Parameters
+    ----------
+    camera : Princeton
+    frames : number of exposures
+    stages : list of functions f(index, data) or of (name, function)
+    queueSize : number of chunks waiting between two stages
+    chunk : number of frames of a sub-sequence of the camera
+    maxMemory : bytes for the pixel streams of the camera (see
+        Princeton.streamSequence)
+    """
+
+    def __init__(self, camera, frames, stages=(), queueSize=2, chunk=1, maxMemory=None):
+        self.camera = camera
+        self.frames = frames
+        self.chunk = chunk
+        self.maxMemory = maxMemory
+        self._functions = []
+        names = ['acquire']
+        for stage in stages:
+            name, function = stage if isinstance(stage, tuple) else (getattr(stage, '__name__', 'stage'), stage)
+            while name in names:
+                name = name + "'"
+            names.append(name)
+            self._functions.append(function)
+        self._stats = collections.OrderedDict((name, StageStats(name)) for name in names)
+        # queue i is the input of stage i (the acquisition is stage 0)
+        self._queues = [queue.Queue(maxsize=queueSize) for i in names]
+        self._stop = threading.Event()
+        self._error = None
+        self._threads = []
+        self._started = None
+        self._ended = None
+
+    # Threads
+
+    def _put(self, q, item, stats):
+        t = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.05)
+                break
+            except queue.Full:
+                pass
+        stats.waitOutput += time.perf_counter() - t
+        return not self._stop.is_set()
+
+    def _get(self, q, stats):
+        t = time.perf_counter()
+        stats.maxQueue = max(stats.maxQueue, q.qsize())
+        item = _END
+        while not self._stop.is_set():
+            try:
+                item = q.get(timeout=0.05)
+                break
+            except queue.Empty:
+                pass
+        stats.waitInput += time.perf_counter() - t
+        return item
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _acquire(self):
+        stats = self._stats['acquire']
+        output = self._queues[1 % len(self._queues)]
+        kwargs = {} if self.maxMemory is None else {'maxMemory': self.maxMemory}
+        sequence = self.camera.streamSequence(self.frames, chunk=self.chunk, **kwargs)
+        try:
+            t = time.perf_counter()
+            for index, images in sequence:
+                data = [image.copy() for image in images]  # the pixel streams are reused
+                stats.busy += time.perf_counter() - t
+                stats.items += 1
+                stats.frames += len(data[0])
+                if not self._put(output, (index, data), stats):
+                    break
+                t = time.perf_counter()
+        except Exception as error:
+            self._fail(error)
+        finally:
+            sequence.close()  # aborts the sequence in progress
+            self._put(output, _END, stats)
+
+    def _process(self, number):
+        stats = list(self._stats.values())[number]
+        function = self._functions[number - 1]
+        q, output = self._queues[number], self._queues[(number + 1) % len(self._queues)]
+        try:
+            while True:
+                item = self._get(q, stats)
+                if item is _END:
+                    break
+                index, data = item
+                t = time.perf_counter()
+                data = function(index, data)
+                stats.busy += time.perf_counter() - t
+                stats.items += 1
+                if not self._put(output, (index, data), stats):
+                    break
+        except Exception as error:
+            self._fail(error)
+        finally:
+            self._put(output, _END, stats)
+
+    # Use
+
+    def start(self):
+        """Starts the threads. Returns the PipelinedAcquisition."""
+        if self._started is None:
+            self._started = time.perf_counter()
+            targets = [self._acquire] + [lambda number=number: self._process(number)
+                                         for number in range(1, len(self._queues))]
+            for name, target in zip(self._stats, targets):
+                thread = threading.Thread(target=target, name='pipeline ' + name)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def __iter__(self):
+        self.start()
+        # the output of the last stage is the input queue of the acquisition
+        output = self._queues[0]
+        try:
+            while True:
+                try:
+                    item = output.get(timeout=0.05)
+                except queue.Empty:
+                    if self._stop.is_set() or not any(thread.is_alive() for thread in self._threads):
+                        break
+                    continue
+                if item is _END:
+                    break
+                yield item
+        finally:
+            self._ended = time.perf_counter()
+        if self._error is not None:
+            raise self._error
+
+    def run(self):
+        """Runs the whole acquisition. Returns the list of (index, data) of the last stage."""
+        with self:
+            return list(self)
+
+    def close(self):
+        """Stops the acquisition and the stages, and waits for the threads."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        if self._ended is None and self._started is not None:
+            self._ended = time.perf_counter()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def elapsed(self):
+        """Second since the start (until the end of the acquisition)."""
+        if self._started is None:
+            return 0.
+        return (self._ended or time.perf_counter()) - self._started
+
+    def stats(self):
+        """OrderedDict stage name: dict with items, frames, busy, waitInput,
+        waitOutput, maxQueue and utilisation (busy / elapsed)."""
+        elapsed = self.elapsed
+        return collections.OrderedDict((name, stats.asdict(elapsed)) for name, stats in self._stats.items())
+
+    @property
+    def bottleneck(self):
+        """Name of the busiest stage."""
+        return max(self._stats.values(), key=lambda stats: stats.busy).name
+
+    @property
+    def frameRate(self):
+        """Frames per second acquired since the start."""
+        elapsed = self.elapsed
+        return self._stats['acquire'].frames / elapsed if elapsed > 0 else 0.
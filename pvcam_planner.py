@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Prediction of the frame rate of an acquisition before running it.
+
+The readout of a frame is modelled like the CCD does it: every row of the
+chip is shifted (PAR_SHIFT_TIME), and for each output row of each region the
+serial register is shifted (SER_SHIFT_TIME per serial pixel) and the output
+pixels are digitised (PIX_TIME, which depends on the speed index
+SPDTAB_INDEX). The model is scaled to the READOUT_TIME given by the camera
+for its last setup, and the host overhead of a sequence (setup, buffer,
+finish) is measured from the last sequences of the camera.
+
+The parameters are read once into a CameraTiming (Princeton.cameraTiming);
+predict() and search() do not call the driver.
+
+The signal to noise ratio of a binned pixel is
+
+    SNR = S / sqrt(S + D + readNoise**2)
+
+with S = signal * t * bins and D = dark * t * bins (electrons), signal and
+dark being electrons per second per pixel of the chip.
+
+Examples
+--------
+>>> plan = camera.planAcquisition(exposure=0.01, frames=100)
+>>> plan.frameRate, plan.throughput, plan.memory
+>>> best = camera.findFastestConfiguration(targetSnr=50, signal=2000.)
+>>> best.speed, best.rois, best.exposure
+"""
+
+from __future__ import division
+
+import collections
+
+import numpy
+
+# bytes of a pixel in the buffers (uns16)
+PIXEL_BYTES = 2
+
+DEFAULT_READ_NOISE = 5.  # electrons rms, when it is not known
+
+
+class CameraTiming(object):
+    """Timing parameters of a camera (second).
+
+    Attributes
+    ----------
+    serSize, parSize : size of the chip (pixels)
+    parShift : time to shift one row
+    serShift : time to shift one pixel of the serial register
+    pixelTimes : dict speed index: time to digitise one pixel
+    expMin : shortest exposure
+    readoutScale : READOUT_TIME of the camera / readout time of the model
+    overhead : host time added to each sequence (setup, buffer, finish)
+    frameOverhead : host time added to each frame
+    """
+
+    def __init__(self, serSize, parSize, parShift, serShift, pixelTimes, expMin=0., readoutScale=1., overhead=0.,
+                 frameOverhead=0.):
+        self.serSize = serSize
+        self.parSize = parSize
+        self.parShift = parShift
+        self.serShift = serShift
+        self.pixelTimes = dict(pixelTimes)
+        self.expMin = expMin
+        self.readoutScale = readoutScale
+        self.overhead = overhead
+        self.frameOverhead = frameOverhead
+
+    def __repr__(self):
+        return ('CameraTiming(chip={0}x{1}, parShift={2:g}, serShift={3:g}, pixelTimes={4}, '
+                'expMin={5:g}, readoutScale={6:.3f}, overhead={7:.4f}, frameOverhead={8:.4f})'.format(
+                    self.serSize, self.parSize, self.parShift, self.serShift, self.pixelTimes,
+                    self.expMin, self.readoutScale, self.overhead, self.frameOverhead))
+
+
+AcquisitionPlan = collections.namedtuple(
+    'AcquisitionPlan', 'speed rois exposure frames readoutTime frameTime sequenceTime frameRate throughput memory snr')
+AcquisitionPlan.__doc__ = """Predicted acquisition (see predict).
+
+speed : speed index (SPDTAB_INDEX)
+rois : list of (s1, s2, sbin, p1, p2, pbin)
+exposure : second (at least the shortest exposure of the camera)
+frames : number of exposures of the sequence
+readoutTime : second to read one frame
+frameTime : second between two frames (exposure + readout + host time per frame)
+sequenceTime : second for the whole sequence, host overhead included
+frameRate : frames per second of the sequence, host overhead included
+throughput : MB/s of pixels during the sequence
+memory : bytes of the buffer of the sequence
+snr : signal to noise ratio of a binned pixel (None without signal)
+"""
+
+
+def roiPixels(roi):
+    """Number of output pixels of roi (s1, s2, sbin, p1, p2, pbin)."""
+    s1, s2, sbin, p1, p2, pbin = roi
+    return ((s2 - s1 + 1) // sbin) * ((p2 - p1 + 1) // pbin)
+
+
+def modelReadoutTime(timing, rois, speed):
+    """Readout time (second) of a frame with the regions rois, not scaled."""
+    time_ = timing.parSize * timing.parShift
+    pixelTime = timing.pixelTimes[speed]
+    for (s1, s2, sbin, p1, p2, pbin) in rois:
+        outputRows = (p2 - p1 + 1) // pbin
+        time_ += outputRows * (timing.serSize * timing.serShift + ((s2 - s1 + 1) // sbin) * pixelTime)
+    return time_
+
+
+def readoutTime(timing, rois, speed):
+    """Readout time (second) of a frame, scaled to the camera."""
+    return modelReadoutTime(timing, rois, speed) * timing.readoutScale
+
+
+def snr(exposure, bins, signal, dark=0., readNoise=DEFAULT_READ_NOISE):
+    """Signal to noise ratio of a pixel binning bins pixels of the chip."""
+    s = signal * exposure * bins
+    return s / numpy.sqrt(s + dark * exposure * bins + readNoise ** 2)
+
+
+def exposureForSnr(target, bins, signal, dark=0., readNoise=DEFAULT_READ_NOISE):
+    """Shortest exposure (second) giving the signal to noise ratio target."""
+    if signal <= 0:
+        raise ValueError('the signal should be positive to reach a signal to noise ratio')
+    a = signal * bins
+    b = target ** 2 * (a + dark * bins)
+    return (b + numpy.sqrt(b ** 2 + 4 * a ** 2 * target ** 2 * readNoise ** 2)) / (2 * a ** 2)
+
+
+def _readNoise(readNoise, speed):
+    if isinstance(readNoise, dict):
+        return readNoise[speed]
+    return readNoise
+
+
+def predict(timing, rois, exposure, frames=1, speed=0, signal=None, dark=0., readNoise=DEFAULT_READ_NOISE):
+    """AcquisitionPlan of a sequence.
+
+    Parameters
+    ----------
+    timing : CameraTiming
+    rois : list of (s1, s2, sbin, p1, p2, pbin)
+    exposure : second
+    frames : number of exposures
+    speed : speed index
+    signal : electrons per second per pixel of the chip (for the snr)
+    dark : electrons per second per pixel of the chip
+    readNoise : electrons rms, or dict speed index: electrons rms
+    """
+    exposure = max(exposure, timing.expMin)
+    readout = readoutTime(timing, rois, speed)
+    frameTime = exposure + readout + timing.frameOverhead
+    sequenceTime = timing.overhead + frames * frameTime
+    pixels = sum(roiPixels(roi) for roi in rois)
+    if signal is None:
+        ratio = None
+    else:
+        ratio = float(min(snr(exposure, roi[2] * roi[5], signal, dark, _readNoise(readNoise, speed)) for roi in rois))
+    return AcquisitionPlan(speed=speed,
+                           rois=list(rois),
+                           exposure=exposure,
+                           frames=frames,
+                           readoutTime=readout,
+                           frameTime=frameTime,
+                           sequenceTime=sequenceTime,
+                           frameRate=frames / sequenceTime,
+                           throughput=frames * pixels * PIXEL_BYTES / sequenceTime / 1e6,
+                           memory=frames * pixels * PIXEL_BYTES,
+                           snr=ratio)
+
+
+def _binnings(size):
+    """Divisors of size: the binnings that read all the pixels (1340 binned
+    by 1024 would drop 316 columns)."""
+    small = [b for b in range(1, int(size ** 0.5) + 1) if size % b == 0]
+    return sorted(set(small + [size // b for b in small]))
+
+
+def search(timing, region, frames=1, targetRate=None, targetSnr=None, signal=None, dark=0.,
+           readNoise=DEFAULT_READ_NOISE, exposure=None, speeds=None, sbins=None, pbins=None):
+    """Configurations of region meeting the targets, fastest first.
+
+    The binning and the speed index are varied over region, the exposure is
+    the shortest one giving targetSnr (or exposure when it is given).
+
+    Parameters
+    ----------
+    timing : CameraTiming
+    region : (s1, s2, p1, p2) part of the chip to read
+    frames : number of exposures
+    targetRate : minimum frames per second (host overhead included)
+    targetSnr : minimum signal to noise ratio of a binned pixel (needs signal)
+    signal, dark, readNoise : see predict
+    exposure : second, fixed exposure (shortest one if None and no targetSnr)
+    speeds : speed indexes to try (all of timing by default)
+    sbins, pbins : binnings to try (the divisors of the size of region by
+        default, so that no pixel is dropped)
+
+    Returns
+    -------
+    plans : list of AcquisitionPlan sorted by frameRate (highest first),
+        then by number of pixels (highest first)
+    """
+    if targetSnr is not None and signal is None:
+        raise ValueError('targetSnr needs the signal (electrons per second per pixel)')
+    s1, s2, p1, p2 = region
+    if speeds is None:
+        speeds = sorted(timing.pixelTimes)
+    if sbins is None:
+        sbins = _binnings(s2 - s1 + 1)
+    if pbins is None:
+        pbins = _binnings(p2 - p1 + 1)
+    plans = []
+    for speed in speeds:
+        for sbin in sbins:
+            for pbin in pbins:
+                if exposure is not None:
+                    t = exposure
+                elif targetSnr is not None:
+                    t = float(exposureForSnr(targetSnr, sbin * pbin, signal, dark, _readNoise(readNoise, speed)))
+                else:
+                    t = timing.expMin
+                plan = predict(timing, [(s1, s2, sbin, p1, p2, pbin)], t, frames, speed, signal, dark, readNoise)
+                if targetRate is not None and plan.frameRate < targetRate:
+                    continue
+                if targetSnr is not None and plan.snr < targetSnr:
+                    continue
+                plans.append(plan)
+    plans.sort(key=lambda plan: (-plan.frameRate, -plan.memory))
+    return plans
+
+
+def hostOverhead(timing, sequences):
+    """Host time (second) added to a sequence and to each of its frames.
+
+    Parameters
+    ----------
+    timing : CameraTiming
+    sequences : list of (frames, exposure, rois, speed, duration) measured
+        by the camera
+
+    Returns
+    -------
+    (overhead, frameOverhead) : fitted on the time not explained by the
+        model, the time per frame needs sequences of different lengths
+    """
+    frames = []
+    extra = []
+    for n, exposure, rois, speed, duration in sequences:
+        if speed in timing.pixelTimes:
+            frames.append(n)
+            extra.append(duration - n * (max(exposure, timing.expMin) + readoutTime(timing, rois, speed)))
+    if not extra:
+        return 0., 0.
+    if len(set(frames)) < 2:
+        return max(float(numpy.median(extra)), 0.), 0.
+    frameOverhead, overhead = numpy.polyfit(frames, extra, 1)
+    if frameOverhead < 0:
+        return max(float(numpy.median(extra)), 0.), 0.
+    if overhead < 0:
+        return 0., float(numpy.median(numpy.array(extra) / frames))
+    return float(overhead), float(frameOverhead)
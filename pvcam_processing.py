@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+"""
+Processing of the frames of a measurement by a pipeline of stages.
+
+The frames (uint16) are converted once into a float32 buffer of shape
+(frames, rows, columns); every stage then works in place on it, or writes
+into a buffer allocated the first time (stages changing the shape, like
+binning or resampling). The buffers are kept for the next measurements of
+the same shape, so adding a correction does not add a copy of the frames.
+
+The stages are applied in the order of the list ProcessingPipeline.stages,
+which can be changed between two measurements. The stages working frame by
+frame are run on a thread pool when the pipeline has several workers; the
+stages needing the whole stack (SequentialSpikeRemoval, Accumulate) run on
+all the frames at once.
+
+Stages
+------
+DarkSubtract(dark) : subtracts a dark (or background) frame
+FlatField(flat) : corrects the pixel response with a flat frame
+SpikeRemoval(threshold) : replaces the pixels far from their neighbours
+SequentialSpikeRemoval(threshold) : replaces the pixels far from the same
+    pixel in the other frames
+Bin(rows, columns) : sums neighbouring pixels
+Resample(source, target) : interpolates the columns on a new axis
+    (wavelengths)
+Accumulate(mode) : sum, mean, median or robust sum of the frames
+
+Examples
+--------
+>>> import pvcam_processing as pp
+>>> pipeline = pp.ProcessingPipeline([pp.DarkSubtract(dark), pp.SpikeRemoval(0.5),
+...                                   pp.Accumulate('sum')], workers=4)
+>>> spectrum = pipeline.run(frames)  # frames (n, rows, columns)
+>>> pipeline.report()
+"""
+
+from __future__ import division
+
+import collections
+import threading
+import time
+
+import numpy
+
+_local = threading.local()
+
+
+def _scratch(key, shape):
+    """float32 scratch array of shape, kept for the current thread."""
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    array = buffers.get((key, shape))
+    if array is None:
+        array = buffers[(key, shape)] = numpy.empty(shape, dtype=numpy.float32)
+    return array
+
+
+class Stage(object):
+    """Base class of the stages.
+
+    Attributes
+    ----------
+    name : name in ProcessingPipeline.report()
+    perFrame : the frames are processed independently (False if the stage
+        needs the whole stack)
+    """
+    perFrame = True
+
+    @property
+    def name(self):
+        return type(self).__name__
+
+    def outputShape(self, shape):
+        """Shape (frames, rows, columns) of the output for an input of shape."""
+        return shape
+
+    def apply(self, data, out):
+        """Processes data (float32, frames x rows x columns) into out, which
+        is data itself when the shape does not change."""
+        raise NotImplementedError
+
+    def __repr__(self):
+        return self.name + '()'
+
+
+class DarkSubtract(Stage):
+    """Subtracts dark, a frame (rows, columns), a spectrum (columns) or a number."""
+
+    def __init__(self, dark):
+        self.dark = numpy.asarray(dark, dtype=numpy.float32)
+
+    def apply(self, data, out):
+        numpy.subtract(data, self.dark, out=out)
+
+
+class FlatField(Stage):
+    """Divides by flat (rows, columns or columns) normalised to its mean;
+    the pixels where flat is not positive are set to zero."""
+
+    def __init__(self, flat):
+        flat = numpy.asarray(flat, dtype=numpy.float64)
+        positive = flat > 0
+        gain = numpy.zeros(flat.shape)
+        gain[positive] = flat[positive].mean() / flat[positive]
+        self.gain = gain.astype(numpy.float32)
+
+    def apply(self, data, out):
+        numpy.multiply(data, self.gain, out=out)
+
+
+class SpikeRemoval(Stage):
+    """Replaces the pixels departing from the median of their width
+    neighbours on each side (along the columns) by more than threshold
+    (relative to the median), like Easy_pvcam.cosmic_peaks_spatial."""
+
+    def __init__(self, threshold, width=2):
+        self.threshold = threshold
+        self.width = width
+
+    def _median(self, data):
+        """Median of the neighbours of each pixel (in a scratch array)."""
+        n, rows, columns = data.shape
+        w = self.width
+        padded = _scratch('padded', (n, rows, columns + 2 * w))
+        padded[:, :, w:w + columns] = data
+        padded[:, :, :w] = data[:, :, :1]
+        padded[:, :, w + columns:] = data[:, :, -1:]
+        neighbours = [padded[:, :, w + d:w + d + columns] for d in range(-w, w + 1) if d != 0]
+        median = _scratch('median', data.shape)
+        if w == 1:
+            numpy.add(neighbours[0], neighbours[1], out=median)
+            median *= 0.5
+        elif w == 2:
+            # median of 4 values: (sum - max - min) / 2
+            numpy.add(neighbours[0], neighbours[1], out=median)
+            median += neighbours[2]
+            median += neighbours[3]
+            high = _scratch('high', data.shape)
+            other = _scratch('other', data.shape)
+            numpy.maximum(neighbours[0], neighbours[1], out=high)
+            numpy.maximum(neighbours[2], neighbours[3], out=other)
+            numpy.maximum(high, other, out=high)
+            median -= high
+            numpy.minimum(neighbours[0], neighbours[1], out=high)
+            numpy.minimum(neighbours[2], neighbours[3], out=other)
+            numpy.minimum(high, other, out=high)
+            median -= high
+            median *= 0.5
+        else:
+            stacked = numpy.stack(neighbours, axis=-1)
+            stacked.partition((w - 1, w), axis=-1)
+            numpy.add(stacked[..., w - 1], stacked[..., w], out=median)
+            median *= 0.5
+        return median
+
+    def apply(self, data, out):
+        median = self._median(data)
+        deviation = _scratch('deviation', data.shape)
+        numpy.subtract(median, data, out=deviation)
+        numpy.abs(deviation, out=deviation)
+        limit = _scratch('high', data.shape)
+        numpy.abs(median, out=limit)
+        limit *= self.threshold
+        numpy.copyto(data, median, where=deviation > limit)
+
+    def __repr__(self):
+        return 'SpikeRemoval({0!r}, width={1!r})'.format(self.threshold, self.width)
+
+
+class SequentialSpikeRemoval(Stage):
+    """Replaces the pixels departing from the median of the same pixel in
+    all the frames by more than threshold standard deviations (see
+    spikes.findSpike). Needs at least minimum frames, does nothing with
+    fewer."""
+    perFrame = False
+
+    def __init__(self, threshold=2., minimum=5):
+        self.threshold = threshold
+        self.minimum = minimum
+
+    def apply(self, data, out):
+        if len(data) < self.minimum:
+            return
+        median = numpy.median(data, axis=0)
+        limit = data.std(axis=0)
+        limit *= self.threshold
+        deviation = _scratch('deviation', data.shape)
+        numpy.subtract(data, median, out=deviation)
+        numpy.abs(deviation, out=deviation)
+        numpy.copyto(data, numpy.broadcast_to(median, data.shape), where=deviation > limit)
+
+    def __repr__(self):
+        return 'SequentialSpikeRemoval({0!r}, minimum={1!r})'.format(self.threshold, self.minimum)
+
+
+class Bin(Stage):
+    """Sums rows x columns pixels (the pixels left at the end are dropped)."""
+
+    def __init__(self, rows=1, columns=1):
+        self.rows = rows
+        self.columns = columns
+
+    def outputShape(self, shape):
+        return (shape[0], shape[1] // self.rows, shape[2] // self.columns)
+
+    def apply(self, data, out):
+        n, rows, columns = out.shape
+        # sums of strided slices, faster than reductions over short axes
+        partial = _scratch('partial', (n, data.shape[1], columns))
+        numpy.copyto(partial, data[:, :, 0:columns * self.columns:self.columns])
+        for j in range(1, self.columns):
+            partial += data[:, :, j:columns * self.columns:self.columns]
+        numpy.copyto(out, partial[:, 0:rows * self.rows:self.rows])
+        for i in range(1, self.rows):
+            out += partial[:, i:rows * self.rows:self.rows]
+
+    def __repr__(self):
+        return 'Bin(rows={0!r}, columns={1!r})'.format(self.rows, self.columns)
+
+
+class Resample(Stage):
+    """Linear interpolation of the columns, given at the positions source
+    (increasing, e.g. the wavelength of each pixel), at the positions target.
+    The positions outside source take the value of the closest end."""
+
+    def __init__(self, source, target):
+        source = numpy.asarray(source, dtype=numpy.float64)
+        target = numpy.clip(numpy.asarray(target, dtype=numpy.float64), source[0], source[-1])
+        index = numpy.clip(numpy.searchsorted(source, target, side='right') - 1, 0, len(source) - 2)
+        self.source = source
+        self.target = target
+        self._index = index
+        self._weight = ((target - source[index]) / (source[index + 1] - source[index])).astype(numpy.float32)
+
+    def outputShape(self, shape):
+        return (shape[0], shape[1], len(self.target))
+
+    def apply(self, data, out):
+        numpy.take(data, self._index, axis=2, out=out)
+        upper = _scratch('upper', out.shape)
+        numpy.take(data, self._index + 1, axis=2, out=upper)
+        upper -= out
+        upper *= self._weight
+        out += upper
+
+    def __repr__(self):
+        return 'Resample({0} -> {1} columns)'.format(len(self.source), len(self.target))
+
+
+class Accumulate(Stage):
+    """Combines the frames into one: 'sum', 'mean', 'median' or 'robustSum'
+    (median times the number of frames, insensitive to the spikes, as
+    spikes.cleanSpikes)."""
+    perFrame = False
+    MODES = ('sum', 'mean', 'median', 'robustSum')
+
+    def __init__(self, mode='sum'):
+        if mode not in self.MODES:
+            raise ValueError('mode should be one of {0}, not {1!r}'.format(', '.join(self.MODES), mode))
+        self.mode = mode
+
+    def outputShape(self, shape):
+        return (1,) + tuple(shape[1:])
+
+    def apply(self, data, out):
+        if self.mode == 'sum':
+            data.sum(axis=0, out=out[0])
+        elif self.mode == 'mean':
+            data.mean(axis=0, out=out[0])
+        else:
+            out[0] = numpy.median(data, axis=0)
+            if self.mode == 'robustSum':
+                out *= len(data)
+
+    def __repr__(self):
+        return 'Accumulate({0!r})'.format(self.mode)
+
+
+class ProcessingPipeline(object):
+    """Stages applied in order to stacks of frames (see the module documentation).
+
+    Parameters
+    ----------
+    stages : list of Stage (the attribute stages can be changed later)
+    workers : threads processing the frames for the stages working frame
+        by frame
+    """
+
+    def __init__(self, stages=(), workers=1):
+        self.stages = list(stages)
+        self.workers = workers
+        self._pool = None
+        self._buffers = {}  # (stage number, shape): float32 array
+        self._times = collections.defaultdict(float)  # stage name: second
+        self._calls = collections.Counter()
+
+    def _buffer(self, key, shape):
+        buffer_ = self._buffers.get((key, shape))
+        if buffer_ is None:
+            buffer_ = self._buffers[(key, shape)] = numpy.empty(shape, dtype=numpy.float32)
+        return buffer_
+
+    def outputShape(self, shape):
+        """Shape of the result for frames of shape (frames, rows, columns)."""
+        for stage in self.stages:
+            shape = stage.outputShape(shape)
+        return shape
+
+    def _names(self):
+        names = []
+        for stage in self.stages:
+            name = stage.name
+            while name in names:
+                name = name + "'"
+            names.append(name)
+        return names
+
+    @staticmethod
+    def _applyStages(steps, start, stop):
+        """Applies steps (stage, data, out) to frames start to stop. Returns the second spent in each."""
+        times = []
+        for stage, data, out in steps:
+            t = time.perf_counter()
+            stage.apply(data[start:stop], out[start:stop])
+            times.append(time.perf_counter() - t)
+        return times
+
+    def run(self, frames, copy=False):
+        """Processes frames.
+
+        Parameters
+        ----------
+        frames : numpy array (frames, rows, columns), or (rows, columns) for
+            one frame
+        copy : return a copy of the result, otherwise the result is a buffer
+            of the pipeline, overwritten by the next run of the same shape
+
+        Returns
+        -------
+        result : float32 array of shape outputShape(frames.shape)
+        """
+        frames = numpy.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[numpy.newaxis]
+        t = time.perf_counter()
+        data = self._buffer('input', frames.shape)
+        numpy.copyto(data, frames, casting='unsafe')
+        self._times['convert'] += time.perf_counter() - t
+        self._calls['convert'] += 1
+        names = self._names()
+        number = 0
+        while number < len(self.stages):
+            # the stages working frame by frame following each other are run together
+            steps = []
+            while number < len(self.stages):
+                stage = self.stages[number]
+                if steps and not stage.perFrame:
+                    break
+                shape = stage.outputShape(data.shape)
+                out = data if shape == data.shape else self._buffer(number, shape)
+                steps.append((stage, data, out))
+                data = out
+                number += 1
+                if not stage.perFrame:
+                    break
+            first = number - len(steps)
+            if steps[0][0].perFrame and self.workers > 1 and len(data) > 1:
+                if self._pool is None:
+                    from multiprocessing.pool import ThreadPool  # not loaded with the camera control
+                    self._pool = ThreadPool(self.workers)
+                bounds = numpy.linspace(0, len(data), min(self.workers, len(data)) + 1).astype(int)
+                results = self._pool.starmap(self._applyStages, [(steps, start, stop) for start, stop in
+                                                                 zip(bounds[:-1], bounds[1:])])
+                times = numpy.sum(results, axis=0)  # summed over the workers
+            else:
+                times = self._applyStages(steps, 0, None)
+            for name, seconds in zip(names[first:number], times):
+                self._times[name] += seconds
+                self._calls[name] += 1
+        return data.copy() if copy else data
+
+    def __call__(self, index, images):
+        """Stage of a pvcam_pipeline.PipelinedAcquisition: processes the
+        frames of the first ROI, returns a copy of the result."""
+        return self.run(images[0], copy=True)
+
+    def report(self):
+        """OrderedDict stage name: dict with calls and seconds (summed over
+        the workers), 'convert' being the conversion to float32."""
+        report = collections.OrderedDict()
+        for name in ['convert'] + self._names():
+            report[name] = {'calls': self._calls[name], 'seconds': self._times[name]}
+        return report
+
+    def resetReport(self):
+        self._times.clear()
+        self._calls.clear()
+
+    def close(self):
+        """Stops the threads of the workers."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __repr__(self):
+        return 'ProcessingPipeline({0!r}, workers={1})'.format(self.stages, self.workers)
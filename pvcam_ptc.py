@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Photon transfer curve (PTC): conversion gain and read noise of each speed
+and gain index of a camera.
+
+For each speed index (SPDTAB_INDEX), gain index (GAIN_INDEX) and exposure
+time, a few frames are taken in the dark and under a constant illumination.
+The running statistics of each pixel (pvcam_statistics) give the temporal
+variance without the fixed pattern of the chip, averaged over the pixels:
+
+    signal = mean(flat) - mean(dark)    (ADU)
+    variance = var(flat) - var(dark)    (ADU**2, shot noise of the signal)
+
+In the shot noise regime variance = signal / K, K being the conversion gain
+(electrons per ADU); K is fitted on the points below the full well (the
+variance falls at the saturation). The read noise is the temporal standard
+deviation of the darks at the shortest exposure. Without darks, the
+variance of the flats is fitted against their mean (bias included), which
+gives K but not the read noise.
+
+The parameters are swept speed first, then gain, then exposure, writing
+only the parameters that change (pvcam_config.applyPreset), and the
+shutter is switched twice per speed and gain (all the darks, then all the
+flats).
+
+The results are kept per chip in a GainTable (<chip>_gain.json in the
+calibration directory, see pvcam_calibration), used by Easy_pvcam to give
+the measurements in electrons.
+
+Examples
+--------
+>>> import pvcam_ptc
+>>> points = pvcam_ptc.sweep(camera, numpy.geomspace(0.001, 2, 12))
+>>> table = pvcam_ptc.GainTable.forChip(chipName)
+>>> for entry in pvcam_ptc.analyse(points):
+...     table.add(entry)
+>>> table.save()
+>>> camera.units = 'electrons'
+"""
+
+from __future__ import division
+
+import collections
+import json
+import os
+
+import numpy
+
+import pvcam_calibration
+import pvcam_config
+import pvcam_processing
+
+PTCPoint = collections.namedtuple('PTCPoint', 'speed gain exposure signal variance darkSignal darkVariance frames')
+PTCPoint.__doc__ = """Statistics of the frames of one setup (ADU, averaged over the pixels).
+
+speed, gain : SPDTAB_INDEX, GAIN_INDEX
+exposure : second
+signal : mean of the flats minus mean of the darks (if any)
+variance : temporal variance of the flats
+darkSignal, darkVariance : mean and temporal variance of the darks (None
+    without darks)
+frames : number of frames of each kind
+"""
+
+GainEntry = collections.namedtuple('GainEntry', 'speed gain conversionGain readNoise offset fullWell points')
+GainEntry.__doc__ = """Calibration of one speed and gain index.
+
+conversionGain : electrons per ADU
+readNoise : electrons rms (None without darks)
+offset : bias in ADU (mean of the darks at the shortest exposure, None without darks)
+fullWell : signal (ADU) of the last point before the saturation
+points : number of points of the fit
+"""
+
+
+def _defaultShutter(camera):
+    """Function opening (True) and closing (False) the shutter of camera, None if it has none."""
+    if getattr(camera, '_shutter_present', False):
+        def shutter(opened):
+            camera.shutter = 'opened' if opened else 'closed'
+        return shutter
+    return None
+
+
+def _statistics(camera, exposure, frames, roi):
+    pvcam_config.applyPreset(camera, None, {'exposureTime': float(exposure)})
+    return camera.acquireStatistics(frames)[roi]
+
+
+def sweep(camera, exposures, speeds=None, gains=None, frames=4, shutter='auto', roi=0):
+    """PTCPoint of each speed index, gain index and exposure.
+
+    Parameters
+    ----------
+    camera : Princeton, with the ROI to calibrate
+    exposures : second (up to 65.535, see pvcam_config.FIELDS)
+    speeds : speed indexes, the current one if None
+    gains : gain indexes, the current one if None
+    frames : frames per point (at least 2)
+    shutter : function shutter(opened) opening or closing the light, None
+        to measure without darks, 'auto' for the shutter of an Easy_pvcam
+    roi : number of the ROI whose pixels are used
+
+    Returns
+    -------
+    points : list of PTCPoint
+    """
+    if frames < 2:
+        raise ValueError('the variance needs at least 2 frames per point')
+    exposures = sorted(float(t) for t in exposures)
+    check, description = pvcam_config.FIELDS['exposureTime']
+    invalid = [t for t in exposures if not check(t)]
+    if invalid:  # checked before any change of the camera (EXP_TIME would overflow)
+        raise ValueError('the exposures {0} are not a {1}'.format(invalid, description))
+    if shutter == 'auto':
+        shutter = _defaultShutter(camera)
+    speed0 = camera.getParameterCurrentValue('SPDTAB_INDEX')
+    gain0 = camera.getParameterCurrentValue('GAIN_INDEX')
+    exposure0 = camera._exposureSeconds()
+    speeds = [speed0] if speeds is None else list(speeds)
+    gains = [gain0] if gains is None else list(gains)
+    points = []
+    try:
+        for speed in speeds:
+            for gain in gains:
+                pvcam_config.applyPreset(camera, None, {'speed': speed, 'gain': gain})
+                darks = [None] * len(exposures)
+                if shutter is not None:
+                    shutter(False)
+                    darks = [_statistics(camera, t, frames, roi) for t in exposures]
+                    shutter(True)
+                for exposure, dark in zip(exposures, darks):
+                    flat = _statistics(camera, exposure, frames, roi)
+                    signal, variance = flat.meanVariance()
+                    darkSignal = darkVariance = None
+                    if dark is not None:
+                        darkSignal, darkVariance = dark.meanVariance()
+                        signal -= darkSignal
+                    points.append(PTCPoint(speed, gain, exposure, signal, variance, darkSignal, darkVariance, frames))
+    finally:
+        pvcam_config.applyPreset(camera, None, {'speed': speed0, 'gain': gain0, 'exposureTime': exposure0})
+    return points
+
+
+def fitPTC(signal, variance, tolerance=0.1):
+    """(conversion gain in electrons per ADU, intercept in ADU**2, full well
+    in ADU, number of points) of a photon transfer curve.
+
+    The points of highest signal whose variance / signal falls below the
+    median of the points under them by more than tolerance (some pixels
+    saturate) are left out, the signal of the last point used being the
+    full well. The points of less than 1% of its signal, dominated by the
+    read noise, do not count in the median.
+    """
+    signal = numpy.asarray(signal, dtype=numpy.float64)
+    variance = numpy.asarray(variance, dtype=numpy.float64)
+    order = numpy.argsort(signal)
+    signal, variance = signal[order], variance[order]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ratio = variance / signal
+    top = len(signal) - 1
+    while top >= 2:
+        below = ratio[:top][signal[:top] >= signal[top] / 100]
+        if len(below) < 2 or ratio[top] >= (1 - tolerance) * numpy.median(below):
+            break
+        top -= 1
+    used = slice(0, top + 1)
+    if top < 1:
+        raise ValueError('the photon transfer curve needs at least 2 points below saturation')
+    slope, intercept = numpy.polyfit(signal[used], variance[used], 1)
+    if slope <= 0:
+        raise ValueError('the variance does not increase with the signal')
+    return 1 / slope, float(intercept), float(signal[top]), top + 1
+
+
+def analyse(points):
+    """GainEntry of each speed and gain index of points (list of PTCPoint)."""
+    setups = collections.OrderedDict()
+    for point in points:
+        setups.setdefault((point.speed, point.gain), []).append(point)
+    entries = []
+    for (speed, gain), group in setups.items():
+        variances = [p.variance - (p.darkVariance or 0.) for p in group]
+        conversionGain, intercept, fullWell, used = fitPTC([p.signal for p in group], variances)
+        first = min(group, key=lambda p: p.exposure)
+        readNoise = offset = None
+        if first.darkVariance is not None:
+            readNoise = float(numpy.sqrt(first.darkVariance) * conversionGain)
+            offset = first.darkSignal
+        entries.append(GainEntry(speed, gain, float(conversionGain), readNoise, offset, fullWell, used))
+    return entries
+
+
+class GainTable(object):
+    """Conversion gains of the speed and gain indexes of a chip.
+
+    Parameters
+    ----------
+    chip : CHIP_NAME (with or without spaces)
+    path : json file, <chip>_gain.json of the calibration directory if None
+    """
+
+    def __init__(self, chip, path=None):
+        self.chip = pvcam_config.chipKey(chip)
+        if path is None:
+            path = os.path.join(pvcam_calibration.calibrationDirectory(), self.chip + '_gain.json')
+        self.path = path
+        self.entries = collections.OrderedDict()  # (speed, gain): GainEntry
+
+    @classmethod
+    def forChip(cls, chip, path=None):
+        """GainTable of chip, read from its file if it exists."""
+        table = cls(chip, path)
+        if os.path.exists(table.path):
+            with open(table.path) as f:
+                for entry in json.load(f)['entries']:
+                    table.add(GainEntry(**entry))
+        return table
+
+    def add(self, entry):
+        self.entries[(entry.speed, entry.gain)] = entry
+
+    def entry(self, speed, gain):
+        """GainEntry of the speed and gain indexes, None if not calibrated."""
+        return self.entries.get((speed, gain))
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'chip': self.chip, 'entries': [entry._asdict() for entry in self.entries.values()]}, f,
+                      indent=1)
+        os.replace(self.path + '.tmp', self.path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return 'GainTable({0}, {1})'.format(self.chip, ', '.join(
+            'speed {0} gain {1}: {2:.3f} e/ADU'.format(s, g, e.conversionGain) for (s, g), e in self.entries.items()))
+
+
+class ToElectrons(pvcam_processing.Stage):
+    """Converts counts to electrons: (counts - offset) * conversionGain."""
+
+    def __init__(self, conversionGain, offset=0.):
+        self.conversionGain = conversionGain
+        self.offset = offset
+
+    def apply(self, data, out):
+        if self.offset:
+            numpy.subtract(data, self.offset, out=out)
+            out *= self.conversionGain
+        else:
+            numpy.multiply(data, self.conversionGain, out=out)
+
+    def __repr__(self):
+        return 'ToElectrons({0:.4g}, offset={1:.4g})'.format(self.conversionGain, self.offset)
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+Replay driver: frames recorded on a camera served through the Princeton API.
+
+Stands for Pvcam32.dll like pvcam_sim, but the frames and the parameters
+are the ones of a recording: the processing (convertStream, calibration,
+pipelines) runs on real data along exactly the code path of a live
+acquisition, on computers without the camera. It is selected with the
+environment variables PVCAM_DRIVER=replay and PVCAM_REPLAY=<recording>,
+read by Princeton_wrapper.API().
+
+A recording is a directory with
+
+frames.npy : uint16 array (frames, pixels), the pixel stream of each frame
+    (the ROIs one after the other, as read out), memory-mapped when played
+times.npy : second from the start of the acquisition to the end of each frame
+recording.json : camera name, ROIs, exposure and the parameters of the
+    camera (current value, range, access and enumerated values of every
+    available parameter)
+
+Sequences (takePicture, streamSequence, acquirePipelined...) and continuous
+acquisitions get the recorded frames in order, starting again from the
+first one after the last. The frames are delivered at the recorded times
+multiplied by timeScale; with timeScale = 0 they are all ready at once (a
+continuous acquisition gets a new frame at each check of its status), to
+measure the throughput of the processing alone.
+
+The recorded parameters are served as they are: they can be written, but
+the frames do not change, and only the ROIs of the recording can be
+acquired (error C3_RGN_NOT_FOUND otherwise, see configure), in its readout
+mode (error C2_NOT_AVAILABLE for kinetics if the recording is not).
+
+Environment variables
+---------------------
+PVCAM_REPLAY : directory of the recording
+PVCAM_REPLAY_TIMESCALE : multiplies the recorded times (default 1, 0 for no waiting)
+PVCAM_SIM_CALL_LATENCY : time (second) spent in each driver call (default 0)
+
+Examples
+--------
+>>> # with the camera
+>>> pvcam_replay.record(camera, 'recordings/neon', 1000)
+>>> # on a server: PVCAM_DRIVER=replay PVCAM_REPLAY=recordings/neon PVCAM_REPLAY_TIMESCALE=0
+>>> camera = Princeton_wrapper.Princeton()
+>>> pvcam_replay.configure(camera)
+>>> run = camera.acquirePipelined(100000, stages)
+"""
+
+from __future__ import division
+
+import datetime
+import json
+import os
+import time
+
+import numpy
+
+import pvcam_sim
+
+RECORDING_FILE = 'recording.json'
+
+_ERR_NOT_AVAILABLE = 2016
+_ERR_RGN_NOT_FOUND = 3016
+
+# attributes of a recorded parameter (pvcam_sim parameter dict) and AttributeType
+_ATTRIBUTES = (('min', 3), ('max', 4), ('default', 5), ('increment', 6))
+
+
+def _raw(value):
+    """Value of a parameter without the description of an enumerated value."""
+    return value[1] if isinstance(value, tuple) else value
+
+
+def _text(value):
+    return value.decode('latin-1') if isinstance(value, bytes) else value
+
+
+def snapshot(camera):
+    """Parameters of camera (Princeton), by name: dict of value, access, min,
+    max, default, increment, enum (list of (value, description)) and type,
+    as kept in a recording."""
+    import Princeton_wrapper
+    AttributeType = Princeton_wrapper.AttributeType
+    access = dict((text, code) for code, text in camera.PropertyForATTR_ACCESS.items())
+    parameters = {}
+    with Princeton_wrapper.driverLock:
+        for name in sorted(camera.ParamSet):
+            try:
+                if not camera.getParameterValue(name, AttributeType.available):
+                    continue
+                value = _raw(camera.getParameterCurrentValue(name))
+                parameter = {'value': _text(value),
+                             'type': camera.getParameterValue(name, AttributeType.typeValue),
+                             'access': access.get(camera.getParameterValue(name, AttributeType.access), 1),
+                             'enum': None}
+            except Princeton_wrapper.PrincetonError:
+                continue
+            for attribute, mode in _ATTRIBUTES:
+                parameter[attribute] = parameter['value']
+                if parameter['type'] != 'char_ptr':  # no range for a string
+                    try:
+                        parameter[attribute] = _raw(camera.getParameterValue(name, mode))
+                    except Princeton_wrapper.PrincetonError:
+                        pass
+            if camera._descriptor(name).isEnum:
+                entries = []
+                for index in range(camera.getParameterValue(name, AttributeType.count)):
+                    length = camera._enumDescriptionLength(name, index)
+                    description, entry = camera._getEnumeratedParameter(name, index, length)
+                    entries.append((entry, _text(description)))
+                parameter['enum'] = entries
+            parameters[name] = parameter
+    return parameters
+
+
+class Recording(object):
+    """Recording read from the directory path (see the module documentation).
+
+    Attributes
+    ----------
+    frames : uint16 array (frames, pixels), memory-mapped
+    times : second from the start to the end of each frame
+    rois : list of (s1, s2, sbin, p1, p2, pbin)
+    exposure : second
+    parameters : dict name: parameter (see snapshot)
+    cameraName : name of the camera recorded
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, RECORDING_FILE)) as f:
+            info = json.load(f)
+        self.info = info
+        self.cameraName = info['camera']
+        self.rois = [tuple(roi) for roi in info['rois']]
+        self.exposure = info['exposure']
+        self.parameters = info['parameters']
+        self.frames = numpy.load(os.path.join(path, 'frames.npy'), mmap_mode='r')
+        self.times = numpy.load(os.path.join(path, 'times.npy'))
+        pixels = sum([((s2 - s1 + 1) // sbin) * ((p2 - p1 + 1) // pbin) for (s1, s2, sbin, p1, p2, pbin) in self.rois])
+        if self.frames.ndim != 2 or self.frames.shape[1] != pixels or len(self.times) != len(self.frames):
+            raise ValueError('{0}: frames of shape {1} and {2} times for ROIs of {3} pixels'.format(
+                path, self.frames.shape, len(self.times), pixels))
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def duration(self):
+        """Second from the start to the end of the last frame."""
+        return float(self.times[-1]) if len(self.times) else 0.
+
+    def driverParameters(self):
+        """Parameters in the form of the simulated driver (pvcam_sim)."""
+        parameters = {}
+        for name, recorded in self.parameters.items():
+            parameter = dict(recorded)
+            if parameter.pop('type', None) == 'char_ptr':
+                for key in ('value', 'min', 'max', 'default', 'increment'):
+                    parameter[key] = parameter[key].encode('latin-1')
+            if parameter['enum']:
+                parameter['enum'] = [(value, description.encode('latin-1')) for value, description in parameter['enum']]
+            parameters[name] = parameter
+        return parameters
+
+    def __repr__(self):
+        return 'Recording({0!r}, {1} frames, {2:.3g} s)'.format(self.path, len(self), self.duration)
+
+
+def record(camera, path, frames, maxMemory=None, chunk=None):
+    """Records frames exposures of camera (Princeton) with its current setup
+    in the directory path (created).
+
+    The frames are acquired by camera.streamSequence (see it for maxMemory
+    and chunk); the frames of a chunk, delivered together, are given
+    times evenly spread since the previous chunk.
+
+    Returns
+    -------
+    recording : Recording
+    """
+    import Princeton_wrapper
+    if maxMemory is None:
+        maxMemory = Princeton_wrapper.SEQUENCE_MEMORY_LIMIT
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    info = {'camera': _text(getattr(camera, '_camname', b'')) or 'Replay0',
+            'rois': [list(roi) for roi in camera.ROI],
+            'exposure': camera._exposureSeconds(),
+            'date': datetime.datetime.now().isoformat(),
+            'parameters': snapshot(camera)}
+    frameSize = sum([rows * columns for rows, columns in camera._frameShapes()])
+    filename = os.path.join(path, 'frames.npy')
+    data = numpy.lib.format.open_memmap(filename + '.tmp', mode='w+', dtype=numpy.uint16, shape=(frames, frameSize))
+    times = numpy.zeros(frames)
+    start = time.perf_counter()
+    last = 0.
+    try:
+        for index, images in camera.streamSequence(frames, maxMemory, chunk):
+            number = len(images[0])
+            offset = 0
+            for image in images:
+                size = image[0].size
+                data[index:index + number, offset:offset + size] = image.reshape(number, size)
+                offset += size
+            now = time.perf_counter() - start
+            times[index:index + number] = last + (now - last) * numpy.arange(1, number + 1) / number
+            last = now
+        data.flush()
+    finally:
+        del data
+    os.replace(filename + '.tmp', filename)
+    with open(os.path.join(path, 'times.npy.tmp'), 'wb') as f:
+        numpy.save(f, times)
+    os.replace(os.path.join(path, 'times.npy.tmp'), os.path.join(path, 'times.npy'))
+    with open(os.path.join(path, RECORDING_FILE + '.tmp'), 'w') as f:
+        json.dump(info, f, indent=1)
+    os.replace(os.path.join(path, RECORDING_FILE + '.tmp'), os.path.join(path, RECORDING_FILE))
+    return Recording(path)
+
+
+def configure(camera, recording=None):
+    """Sets the ROIs and the exposure of camera (Princeton) to the ones of
+    recording (the recording played by the driver if None)."""
+    import Princeton_wrapper
+    import pvcam_config
+    if recording is None:
+        recording = getattr(Princeton_wrapper.API, 'recording', None)
+        if recording is None:
+            raise RuntimeError('the driver is not the replay driver (PVCAM_DRIVER=replay)')
+    while camera.ROI:
+        camera.removeLastExposureROI()
+    for roi in recording.rois:
+        camera.addExposureROI(roi)
+    pvcam_config.applyPreset(camera, None, {'exposureTime': recording.exposure})
+
+
+class _ReplayAcquisition(pvcam_sim._Acquisition):
+    """Sequence (or continuous acquisition) of the recorded frames, from
+    the one following the last frame of the previous acquisition."""
+
+    def __init__(self, camera, frames, rois, exposure, triggered, continuous=False):
+        recording = camera.recording
+        self.recorded = recording.frames
+        self.recordedTimes = recording.times
+        self.loop = recording.duration  # the frames start again after the last one
+        self.first = 0  # recorded frame of the first frame
+        self.base = 0.  # recording time of the start
+        pvcam_sim._Acquisition.__init__(self, camera, frames, rois, exposure, triggered, continuous=continuous)
+
+    def start(self, stream):
+        pvcam_sim._Acquisition.start(self, stream)
+        self.first = self.camera.position
+        self.base = self._recordedEnd(self.first - 1)
+
+    def _recordedEnd(self, j):
+        """Time (second) of the end of the recorded frame j (int or array),
+        counting the repetitions of the recording."""
+        count = len(self.recordedTimes)
+        return (j // count) * self.loop + self.recordedTimes[j % count]
+
+    def frameEnd(self, k):
+        """Time after start (second, recording time) of the end of frame k
+        (int or array)."""
+        return self._recordedEnd(self.first + k) - self.base
+
+    def completed(self):
+        elapsed = self.elapsed()
+        if elapsed == float('inf') or self.loop <= 0:
+            # as fast as possible: a new frame at each check of a continuous acquisition
+            n = self.written + 1 if self.continuous else self.frames
+        else:
+            # recorded frames ended before the recording time of start + elapsed
+            loops, rest = divmod(self.base + elapsed, self.loop)
+            n = int(loops) * len(self.recordedTimes) + int(numpy.searchsorted(self.recordedTimes, rest, side='right'))
+            n = max(n - self.first, 0)
+        if self.frames is not None:
+            n = min(n, self.frames)
+        return n
+
+    def write(self):
+        """Copies in the stream the recorded frames completed since the last call."""
+        n = self.completed()
+        slots = len(self.stream) // self.frameSize
+        first = max(self.written, n - slots) if self.continuous else self.written
+        if n > first:
+            k = numpy.arange(first, n)
+            frames = self.stream[:slots * self.frameSize].reshape(slots, self.frameSize)
+            frames[k % slots if self.continuous else k] = self.recorded[(self.first + k) % len(self.recorded)]
+            self.times.extend((self.startedWall + self.frameEnd(k) * self.camera.timeScale).tolist())
+        self.written = max(self.written, n)
+        self.camera.position = self.first + self.written
+        return n
+
+
+class ReplayCamera(pvcam_sim.SimulatedCamera):
+    """State of the replay camera: recorded parameters and frames."""
+
+    def __init__(self, recording, timeScale=1.):
+        self.recording = recording
+        self.name = recording.cameraName.encode('latin-1')
+        self.timeScale = timeScale
+        self.parameters = recording.driverParameters()
+        self.triggerRate = 100.
+        self.rois = None
+        self.isOpen = False
+        self.acquisition = None
+        self.position = 0  # recorded frame given by the next acquisition
+
+    def value(self, name):
+        return self.parameters[name]['value']
+
+    def setValue(self, name, value):
+        self.parameters[name]['value'] = value
+
+    def readoutTime(self, rois):
+        """Recorded READOUT_TIME (second), 0 if the camera does not give it."""
+        parameter = self.parameters.get('READOUT_TIME')
+        return parameter['value'] * 1e-3 if parameter is not None else 0.
+
+    def newAcquisition(self, frames, rois, exposure, triggered, continuous):
+        return _ReplayAcquisition(self, frames, rois, exposure, triggered, continuous=continuous)
+
+
+class ReplayPvcam(pvcam_sim.SimulatedPvcam):
+    """Object standing for the Pvcam32.dll library (see Princeton_wrapper.API).
+
+    Parameters
+    ----------
+    path : directory of the recording (or Recording), PVCAM_REPLAY if None
+    timeScale : multiplies the recorded times, PVCAM_REPLAY_TIMESCALE if None
+    callLatency : second spent in each driver call, PVCAM_SIM_CALL_LATENCY if None
+    """
+
+    def __init__(self, path=None, timeScale=None, callLatency=None):
+        if path is None:
+            path = os.environ.get('PVCAM_REPLAY')
+            if not path:
+                raise ValueError('PVCAM_REPLAY should give the directory of the recording to replay')
+        if timeScale is None:
+            timeScale = float(os.environ.get('PVCAM_REPLAY_TIMESCALE', 1))
+        self.recording = path if isinstance(path, Recording) else Recording(path)
+        pvcam_sim.SimulatedPvcam.__init__(self, timeScale, callLatency, 0, ReplayCamera(self.recording, timeScale))
+
+    def _setupAcquisition(self, handle, frames, rois, mode, expTime, continuous):
+        if self._checkHandle(handle):
+            if rois != self.recording.rois:
+                return _ERR_RGN_NOT_FOUND
+            recorded = self.recording.parameters.get('PMODE')
+            if recorded is not None and self.camera.value('PMODE') != recorded['value']:
+                return _ERR_NOT_AVAILABLE  # kinetics frames from a normal recording, or the reverse
+        return pvcam_sim.SimulatedPvcam._setupAcquisition(self, handle, frames, rois, mode, expTime, continuous)
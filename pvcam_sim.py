@@ -0,0 +1,956 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated PVCAM driver.
+
+Stands for Pvcam32.dll so Princeton_wrapper can be used on computers without
+the camera (Linux servers, benchmarks, development of processing code).
+It is selected with the environment variable PVCAM_DRIVER=simulated, read by
+Princeton_wrapper.API().
+
+The simulated camera is an EEV 400x1340B on a ST133 controller, with the same
+parameters as the liquid nitrogen cooled detector of easy_pvcam.yaml. It
+produces spectra (a few gaussian lines over a bias and a dark current), read
+noise, photon noise, a fixed set of hot pixels and random cosmic rays.
+
+Timing follows the camera settings: exposure time (EXP_TIME and
+EXP_RES_INDEX) plus a readout time computed from PAR_SHIFT_TIME,
+SER_SHIFT_TIME and PIX_TIME for the ROI. Triggered exposure modes wait for an
+internal trigger at triggerRate Hz.
+
+Environment variables
+---------------------
+PVCAM_SIM_TIMESCALE : multiplies every duration (default 1, 0 for no waiting)
+PVCAM_SIM_CALL_LATENCY : time (second) spent in each driver call, as through USB (default 0)
+PVCAM_SIM_SEED : seed of the random generator (default 0)
+
+Only the functions used by Princeton_wrapper are implemented. Like the dll,
+they return 1 (PV_OK) on success and 0 (PV_FAIL) on failure, the error code
+being given by pl_error_code().
+"""
+
+from __future__ import division
+
+import os
+import time
+import datetime
+import ctypes as ct
+import numpy
+
+# Error codes (see PrincetonError.CODES)
+_ERR_ALREADY_OPEN = 117
+_ERR_INVALID_HANDLE = 116
+_ERR_NAME_OUT_OF_RANGE = 128
+_ERR_NAME_NOT_FOUND = 129
+_ERR_ALREADY_INITED = 2001
+_ERR_NOT_INITED = 2002
+_ERR_NOT_AVAILABLE = 2016
+_ERR_PARAMETER_INVALID = 2018
+_ERR_ATTRIBUTE_INVALID = 2019
+_ERR_INDEX_OUT_OF_RANGE = 2020
+_ERR_CANT_SET = 2025
+_ERR_FAILED_TO_SET = 2003
+_ERR_NOT_INITIALIZED = 3019
+_ERR_RGN_OUTSIDE = 3013
+_ERR_RGN_BINNING = 3012
+_ERR_INVALID_BUFFER = 4009
+_ERR_INVALID_IMAGE = 4008
+_ERR_INVALID_EXPOSURE = 4012
+_ERR_NO_FRAME = 3029
+
+# Data types of the parameters, bits 24-31 of the parameter ID
+_TYPE_CHAR_PTR = 13
+_TYPE_ENUM = 9
+_TYPE_BOOLEAN = 11
+_TYPE_FLT64 = 4
+
+# Access
+_READ_ONLY = 1
+_READ_WRITE = 2
+
+# Status (ReadoutStatus)
+_READOUT_NOT_ACTIVE = 0
+_EXPOSURE_IN_PROGRESS = 1
+_READOUT_IN_PROGRESS = 2
+_READOUT_COMPLETE = 3
+_READOUT_FAILED = 4
+
+
+def _value(x):
+    """Python value of a ctypes scalar or of a python number."""
+    return getattr(x, 'value', x)
+
+
+def _target(reference):
+    """ctypes object referenced by ct.byref(x) or ct.pointer(x)."""
+    obj = getattr(reference, '_obj', None)
+    if obj is not None:
+        return obj
+    return reference.contents
+
+
+def _parameter(value, access=_READ_ONLY, minimum=None, maximum=None, default=None, increment=1, enum=None):
+    if minimum is None:
+        minimum = value
+    if maximum is None:
+        maximum = value
+    if default is None:
+        default = value
+    return {'value': value, 'access': access, 'min': minimum, 'max': maximum,
+            'default': default, 'increment': increment, 'enum': enum}
+
+
+def _defaultParameters():
+    """Parameters of the simulated camera, by name (without PARAM_)."""
+    shutterModes = [(0, b'Never'), (1, b'Pre Exposure'), (2, b'Pre Sequence'), (3, b'Pre Trigger'), (4, b'No Change')]
+    logicOutputs = [(0, b'Not Scan'), (1, b'Shutter'), (2, b'Not Ready'), (3, b'Logic 0'), (4, b'Clearing'),
+                    (5, b'Not FT Image Shift'), (7, b'Logic 1')]
+    return {
+        'CHIP_NAME': _parameter(b'EEV 400x1340B'),
+        'HEAD_SER_NUM_ALPHA': _parameter(b'SIM0001'),
+        'DD_VERSION': _parameter(512),
+        'CAMERA_TYPE': _parameter(26),
+        'SENSOR_TYPE': _parameter(102),
+        'SER_SIZE': _parameter(1340),
+        'PAR_SIZE': _parameter(400),
+        'PREMASK': _parameter(0),
+        'PRESCAN': _parameter(24),
+        'POSTMASK': _parameter(8),
+        'POSTSCAN': _parameter(24),
+        'PIX_PAR_DIST': _parameter(20000),
+        'PIX_PAR_SIZE': _parameter(20000),
+        'PIX_SER_DIST': _parameter(20000),
+        'PIX_SER_SIZE': _parameter(20000),
+        'FTSCAN': _parameter(0),
+        'BIT_DEPTH': _parameter(16),
+        'MIN_BLOCK': _parameter(4, _READ_WRITE, 0, 1340),
+        'NUM_MIN_BLOCK': _parameter(250, _READ_WRITE, 0, 1340),
+        'NUM_OF_STRIPS_PER_CLR': _parameter(400, _READ_WRITE, 1, 400),
+        'SKIP_AT_ONCE_BLK': _parameter(0, _READ_WRITE, 0, 400),
+        'CLEAR_CYCLES': _parameter(1, _READ_WRITE, 0, 16),
+        'CLEAR_MODE': _parameter(1, _READ_WRITE, 0, 5, enum=[(0, b'Never'), (1, b'Pre-Exposure'), (2, b'Pre-Sequence'),
+                                                             (3, b'Post-Sequence'), (4, b'Pre-Post Sequence'),
+                                                             (5, b'Pre-Exposure Post-Sequence')]),
+        'PMODE': _parameter(0, _READ_WRITE, 0, 9, enum=[(0, b'Normal'), (9, b'Kinetics')]),
+        'KIN_WIN_SIZE': _parameter(1, _READ_WRITE, 1, 400),
+        'PAR_SHIFT_TIME': _parameter(9200, _READ_WRITE, 4600, 100000),  # ns
+        'SER_SHIFT_TIME': _parameter(100, _READ_ONLY),  # ns
+        'PAR_SHIFT_INDEX': _parameter(0, _READ_WRITE, 0, 3),
+        'TEMP': _parameter(2000),  # hundredth of celcius, follows TEMP_SETPOINT
+        'TEMP_SETPOINT': _parameter(2000, _READ_WRITE, -11000, 2000),
+        'COOLING_MODE': _parameter(1, enum=[(0, b'Normal'), (1, b'Cryo')]),
+        'CONTROLLER_ALIVE': _parameter(1),
+        'MPP_CAPABLE': _parameter(0, enum=[(0, b'Unknown'), (1, b'Always Off'), (2, b'Always On'), (3, b'Selectable')]),
+        'ADC_OFFSET': _parameter(0, _READ_WRITE, -4096, 4096),
+        'GAIN_INDEX': _parameter(1, _READ_WRITE, 1, 3),
+        'SPDTAB_INDEX': _parameter(0, _READ_WRITE, 0, 1),
+        'PIX_TIME': _parameter(10000),  # ns, depends on SPDTAB_INDEX
+        'READOUT_PORT': _parameter(0, enum=[(0, b'Normal')]),
+        'READOUT_TIME': _parameter(0.),  # ms, computed for the current ROI
+        'SHTR_OPEN_MODE': _parameter(1, _READ_WRITE, 0, 4, enum=shutterModes),
+        'SHTR_STATUS': _parameter(4, enum=[(0, b'Fault'), (1, b'Opening'), (2, b'Open'), (3, b'Closing'), (4, b'Closed')]),
+        'SHTR_OPEN_DELAY': _parameter(0, _READ_WRITE, 0, 65535),
+        'SHTR_CLOSE_DELAY': _parameter(0, _READ_WRITE, 0, 65535),
+        'LOGIC_OUTPUT': _parameter(0, _READ_WRITE, 0, 7, enum=logicOutputs),
+        'EDGE_TRIGGER': _parameter(2, _READ_WRITE, 2, 3, enum=[(2, b'Positive'), (3, b'Negative')]),
+        'EXP_TIME': _parameter(1, _READ_WRITE, 0, 65535),
+        'EXP_RES': _parameter(0, _READ_WRITE, 0, 1, enum=[(0, b'One Millisecond'), (1, b'One Microsecond')]),
+        'EXP_RES_INDEX': _parameter(0, _READ_WRITE, 0, 1),
+        'EXP_MIN_TIME': _parameter(0.001),  # ms
+        'CIRC_BUFFER': _parameter(1),
+        'FRAME_CAPABLE': _parameter(0),
+        'CUSTOM_CHIP': _parameter(0),
+        'CUSTOM_TIMING': _parameter(0),
+        'INTENSIFIER_GAIN': _parameter(0),
+        'SHTR_GATE_MODE': _parameter(0, enum=[(0, b'Safe')]),
+        'TG_OPTION_BD_TYPE': _parameter(1, enum=[(1, b'None')]),
+        'HEAD_COOLING_CTRL': _parameter(1, enum=[(0, b'N/A'), (1, b'On'), (2, b'Off')]),
+        'COOLING_FAN_CTRL': _parameter(1, enum=[(0, b'N/A'), (1, b'On'), (2, b'Off')]),
+        'IO_TYPE': _parameter(0, enum=[(0, b'TTL'), (1, b'DAC')]),
+        'IO_DIRECTION': _parameter(1, enum=[(0, b'Input'), (1, b'Output'), (2, b'Input/Output')]),
+        'IO_STATE': _parameter(0., _READ_WRITE, 0., 255.),
+        'TTL_LINES': _parameter(0, _READ_WRITE, 0, 255),
+        'TTL_DIR_CTRL': _parameter(0, _READ_WRITE, 0, 255),
+    }
+
+
+class SimulatedCamera(object):
+    """State of the simulated camera: parameters, acquisition and images.
+
+    Attributes that can be changed to tune the simulation:
+
+    illumination : counts per second per pixel at the top of the lines (shutter open)
+    darkCurrent : counts per second per pixel
+    bias : counts
+    readNoise : counts rms (multiplied by GAIN_INDEX)
+    triggerRate : Hz, rate of the external trigger for triggered exposure modes
+    cosmicRate : cosmic rays per second on the whole chip
+    coolingTime : second, time constant of the temperature regulation
+    """
+
+    name = b'SimCam0'
+
+    def __init__(self, timeScale=1., seed=0):
+        self.timeScale = timeScale
+        self.random = numpy.random.RandomState(seed)
+        self.parameters = _defaultParameters()
+        self.illumination = 2000.
+        self.darkCurrent = 5.
+        self.bias = 600.
+        self.readNoise = 4.
+        self.triggerRate = 100.
+        self.cosmicRate = 0.5
+        self.coolingTime = 20.
+        serSize = self.parameters['SER_SIZE']['value']
+        parSize = self.parameters['PAR_SIZE']['value']
+        # spectrum: a few gaussian lines along the serial axis, uniform along the parallel axis
+        x = numpy.arange(serSize)
+        lines = numpy.zeros(serSize)
+        for center, width, height in [(200, 3., 1.), (530, 5., .4), (800, 2., .7), (1100, 8., .25)]:
+            lines = lines + height * numpy.exp(-0.5 * ((x - center) / width) ** 2)
+        self.spectrum = 0.05 + lines
+        self.flat = 1 + 0.02 * self.random.standard_normal((parSize, serSize))  # pixel response
+        self.hotPixels = (self.random.randint(0, parSize, 30), self.random.randint(0, serSize, 30))
+        self.hotPixelCurrent = 2000. * (1 + self.random.random_sample(30))  # counts per second
+        self._temperatureTime = time.time()
+        self.isOpen = False
+        self.acquisition = None
+
+    # Parameters
+
+    def value(self, name):
+        if name == 'TEMP':
+            self._updateTemperature()
+        elif name == 'PIX_TIME':
+            return 10000 if self.parameters['SPDTAB_INDEX']['value'] == 0 else 1000
+        elif name == 'READOUT_TIME':
+            return self.readoutTime(self.rois) * 1e3 if getattr(self, 'rois', None) else 0.
+        return self.parameters[name]['value']
+
+    def setValue(self, name, value):
+        if name == 'TEMP_SETPOINT':
+            self._updateTemperature()
+        self.parameters[name]['value'] = value
+
+    def _updateTemperature(self):
+        now = time.time()
+        dt = now - self._temperatureTime
+        self._temperatureTime = now
+        temperature = self.parameters['TEMP']
+        setpoint = self.parameters['TEMP_SETPOINT']['value']
+        if self.coolingTime <= 0 or self.timeScale == 0:
+            temperature['value'] = setpoint
+        else:
+            factor = numpy.exp(-dt / (self.coolingTime * self.timeScale))
+            temperature['value'] = int(round(setpoint + (temperature['value'] - setpoint) * factor))
+
+    # Timing
+
+    def exposureTime(self, expTime):
+        """Exposure time in second of expTime, in units of EXP_RES_INDEX."""
+        return expTime * (1e-3 if self.parameters['EXP_RES_INDEX']['value'] == 0 else 1e-6)
+
+    def readoutTime(self, rois):
+        """Readout time (second) of one frame with the regions rois."""
+        parSize = self.parameters['PAR_SIZE']['value']
+        serSize = self.parameters['SER_SIZE']['value']
+        parShift = self.parameters['PAR_SHIFT_TIME']['value'] * 1e-9
+        serShift = self.parameters['SER_SHIFT_TIME']['value'] * 1e-9
+        pixTime = self.value('PIX_TIME') * 1e-9
+        if self.parameters['PMODE']['value'] == 9:  # kinetics: only the window is shifted out
+            rows = self.parameters['KIN_WIN_SIZE']['value']
+        else:
+            rows = parSize
+        time_ = rows * parShift
+        for (s1, s2, sbin, p1, p2, pbin) in rois:
+            outputRows = (p2 - p1 + 1) // pbin
+            time_ += outputRows * (serSize * serShift + ((s2 - s1 + 1) // sbin) * pixTime)
+        return time_
+
+    # Images
+
+    def newAcquisition(self, frames, rois, exposure, triggered, continuous):
+        """Acquisition set up by pl_exp_setup_seq (frames) or pl_exp_setup_cont (frames None)."""
+        return _Acquisition(self, frames, rois, exposure, triggered, continuous=continuous)
+
+    def frame(self, roi, exposure, kineticsWindow=None):
+        """Simulated uint16 image of roi (binned), shape (rows, columns)."""
+        s1, s2, sbin, p1, p2, pbin = roi
+        shutterOpen = self.parameters['SHTR_OPEN_MODE']['value'] != 0
+        illumination = self.illumination if shutterOpen else 0.
+        rows = slice(p1, p2 + 1)
+        columns = slice(s1, s2 + 1)
+        rate = self.darkCurrent + illumination * self.spectrum[columns] * self.flat[rows, columns]
+        electrons = rate * exposure
+        hot = numpy.zeros_like(electrons)
+        for p, s, current in zip(self.hotPixels[0], self.hotPixels[1], self.hotPixelCurrent):
+            if p1 <= p <= p2 and s1 <= s <= s2:
+                hot[p - p1, s - s1] = current * exposure
+        electrons = electrons + hot
+        electrons = electrons + numpy.sqrt(electrons) * self.random.standard_normal(electrons.shape)
+        cosmics = self.random.poisson(self.cosmicRate * exposure * electrons.size / self.flat.size)
+        if cosmics:
+            electrons[self.random.randint(0, electrons.shape[0], cosmics),
+                      self.random.randint(0, electrons.shape[1], cosmics)] += 5000 * (1 + self.random.random_sample(cosmics))
+        nrows = (p2 - p1 + 1) // pbin
+        ncols = (s2 - s1 + 1) // sbin
+        binned = electrons[:nrows * pbin, :ncols * sbin].reshape(nrows, pbin, ncols, sbin).sum(axis=(1, 3))
+        gain = self.parameters['GAIN_INDEX']['value']
+        counts = self.bias + binned / gain + self.readNoise * self.random.standard_normal(binned.shape)
+        return numpy.clip(counts, 0, 65535).astype(numpy.uint16)
+
+
+class _Acquisition(object):
+    """One sequence (or continuous acquisition) started on the simulated camera."""
+
+    def __init__(self, camera, frames, rois, exposure, triggered, stream=None, continuous=False):
+        self.camera = camera
+        self.frames = frames
+        self.rois = rois
+        self.exposure = exposure
+        self.triggered = triggered
+        self.continuous = continuous
+        self.pixels = [((r[1] - r[0] + 1) // r[2]) * ((r[4] - r[3] + 1) // r[5]) for r in rois]
+        self.frameSize = sum(self.pixels)  # in pixels
+        self.readout = camera.readoutTime(rois)
+        self.stream = None
+        self.started = None
+        self.written = 0
+        self.times = []  # time.time() of the end of each frame
+        if stream is not None:
+            self.start(stream)
+
+    def start(self, stream):
+        self.stream = numpy.frombuffer(stream, dtype=numpy.uint16)
+        self.written = 0  # the same setup can be started again
+        self.times = []
+        self.started = time.perf_counter()
+        self.startedWall = time.time()
+
+    def frameEnd(self, k):
+        """Time after start (second, simulation time) of the end of the readout of frame k."""
+        period = self.exposure + self.readout
+        if self.triggered:
+            trigger = 1. / self.camera.triggerRate
+            # the triggers coming while the camera is busy are missed
+            period = numpy.ceil(period / trigger - 1e-9) * trigger
+            return trigger + k * period + self.exposure + self.readout
+        return (k + 1) * period
+
+    def elapsed(self):
+        scale = self.camera.timeScale
+        if scale == 0:
+            return float('inf')
+        return (time.perf_counter() - self.started) / scale
+
+    def completed(self):
+        """Number of frames completely read out."""
+        elapsed = self.elapsed()
+        if elapsed == float('inf'):  # no waiting: a new frame at each check of a continuous acquisition
+            return self.written + 1 if self.continuous else self.frames
+        period = self.frameEnd(1) - self.frameEnd(0)
+        n = int((elapsed - self.frameEnd(0)) // period) + 1 if elapsed >= self.frameEnd(0) else 0
+        if self.frames is not None:
+            n = min(n, self.frames)
+        return n
+
+    def status(self):
+        n = self.completed()
+        if self.frames is not None and n >= self.frames:
+            return _READOUT_COMPLETE
+        if self.continuous and n > 0:
+            return _READOUT_COMPLETE
+        elapsed = self.elapsed()
+        if elapsed > self.frameEnd(n) - self.readout:
+            return _READOUT_IN_PROGRESS
+        return _EXPOSURE_IN_PROGRESS
+
+    def write(self):
+        """Writes in the stream the frames completed since the last call."""
+        n = self.completed()
+        slots = len(self.stream) // self.frameSize
+        first = max(self.written, n - slots) if self.continuous else self.written
+        for k in range(first, n):
+            offset = (k % slots if self.continuous else k) * self.frameSize
+            for roi, pixels in zip(self.rois, self.pixels):
+                self.stream[offset:offset + pixels] = self.camera.frame(roi, self.exposure).ravel()
+                offset += pixels
+            self.times.append(self.startedWall + self.frameEnd(k) * self.camera.timeScale)
+        self.written = max(self.written, n)
+        return n
+
+    def wait(self):
+        """Waits the end of the sequence (simulated pl_exp_finish_seq during the readout)."""
+        if self.camera.timeScale == 0:
+            return
+        remaining = (self.frameEnd(self.frames - 1) - self.elapsed()) * self.camera.timeScale
+        if remaining > 0:
+            time.sleep(remaining)
+
+
+class _Buffer(object):
+    """Buffer allocated by pl_buf_alloc."""
+
+    def __init__(self, exposures, precision, rois, firstImageHandle):
+        self.precision = precision
+        self.rois = rois
+        self.dates = [None] * exposures
+        self.images = []  # [exposure][roi] = (handle, ctypes array)
+        handle = firstImageHandle
+        for e in range(exposures):
+            images = []
+            for r in rois:
+                pixels = ((r[1] - r[0] + 1) // r[2]) * ((r[4] - r[3] + 1) // r[5])
+                images.append((handle, (ct.c_uint16 * pixels)()))
+                handle += 1
+            self.images.append(images)
+
+
+class SimulatedPvcam(object):
+    """Object standing for the Pvcam32.dll library (see Princeton_wrapper.API)."""
+
+    def __init__(self, timeScale=None, callLatency=None, seed=None, camera=None):
+        if timeScale is None:
+            timeScale = float(os.environ.get('PVCAM_SIM_TIMESCALE', 1))
+        if callLatency is None:
+            callLatency = float(os.environ.get('PVCAM_SIM_CALL_LATENCY', 0))
+        if seed is None:
+            seed = int(os.environ.get('PVCAM_SIM_SEED', 0))
+        self.callLatency = callLatency
+        self.camera = SimulatedCamera(timeScale, seed) if camera is None else camera
+        self._error = 0
+        self._initialized = False
+        self._expInitialized = False
+        self._bufInitialized = False
+        self._handle = 1
+        self._parameterNames = None
+        self._buffers = {}
+        self._images = {}  # image handle: (buffer handle, exposure, roi index, ctypes array)
+        self._nextBuffer = 1
+        self._nextImage = 1
+        self._setup = None
+
+    @property
+    def timeScale(self):
+        """Multiplies the durations of the camera (0: no waiting)."""
+        return self.camera.timeScale
+
+    # Helpers
+
+    def _fail(self, code):
+        self._error = code
+        return 0
+
+    def _call(self):
+        if self.callLatency:
+            time.sleep(self.callLatency)
+
+    def _name(self, paramId):
+        if self._parameterNames is None:
+            self._parameterNames = dict((value, name[len('PARAM_'):]) for name, value in vars(self).items()
+                                        if name.startswith('PARAM_'))
+        return self._parameterNames.get(_value(paramId))
+
+    def _checkHandle(self, handle):
+        return self.camera.isOpen and _value(handle) == self._handle
+
+    @staticmethod
+    def _rois(number, array):
+        return [(r.s1, r.s2, r.sbin, r.p1, r.p2, r.pbin) for r in array[:_value(number)]]
+
+    def _checkRois(self, rois):
+        serSize = self.camera.parameters['SER_SIZE']['value']
+        parSize = self.camera.parameters['PAR_SIZE']['value']
+        for (s1, s2, sbin, p1, p2, pbin) in rois:
+            if not (0 <= s1 <= s2 < serSize and 0 <= p1 <= p2 < parSize):
+                return _ERR_RGN_OUTSIDE
+            if sbin < 1 or pbin < 1 or sbin > s2 - s1 + 1 or pbin > p2 - p1 + 1:
+                return _ERR_RGN_BINNING
+        return 0
+
+    # Class 0
+
+    def pl_pvcam_init(self):
+        self._call()
+        if self._initialized:
+            return self._fail(_ERR_ALREADY_INITED)
+        self._initialized = True
+        return 1
+
+    def pl_pvcam_uninit(self):
+        self._call()
+        if not self._initialized:
+            return self._fail(_ERR_NOT_INITED)
+        self._initialized = False
+        self.camera.isOpen = False
+        return 1
+
+    def pl_pvcam_get_ver(self, version):
+        _target(version).value = 0x0207
+        return 1
+
+    def pl_ddi_get_ver(self, version):
+        _target(version).value = 512
+        return 1
+
+    def pl_cam_get_total(self, total):
+        self._call()
+        if not self._initialized:
+            return self._fail(_ERR_NOT_INITED)
+        _target(total).value = 1
+        return 1
+
+    def pl_cam_get_name(self, number, name):
+        self._call()
+        if not self._initialized:
+            return self._fail(_ERR_NOT_INITED)
+        if _value(number) != 0:
+            return self._fail(_ERR_NAME_OUT_OF_RANGE)
+        name.value = self.camera.name
+        return 1
+
+    def pl_cam_open(self, name, handle, mode):
+        self._call()
+        if not self._initialized:
+            return self._fail(_ERR_NOT_INITED)
+        name = getattr(name, 'value', name)
+        if name != self.camera.name:
+            return self._fail(_ERR_NAME_NOT_FOUND)
+        if self.camera.isOpen:
+            return self._fail(_ERR_ALREADY_OPEN)
+        self.camera.isOpen = True
+        _target(handle).value = self._handle
+        return 1
+
+    def pl_cam_close(self, handle):
+        self._call()
+        if not self._checkHandle(handle):
+            return self._fail(_ERR_INVALID_HANDLE)
+        self.camera.isOpen = False
+        return 1
+
+    def pl_cam_check(self, handle):
+        return 1 if self._checkHandle(handle) else self._fail(_ERR_INVALID_HANDLE)
+
+    def pl_cam_get_diags(self, handle):
+        return 1 if self._checkHandle(handle) else self._fail(_ERR_INVALID_HANDLE)
+
+    # Class 1
+
+    def pl_error_code(self):
+        return self._error
+
+    def pl_error_message(self, code, message):
+        message.value = ('error %i' % _value(code)).encode()
+        return 1
+
+    # Class 2
+
+    def pl_get_param(self, handle, paramId, attribute, value):
+        self._call()
+        if not self._checkHandle(handle):
+            return self._fail(_ERR_INVALID_HANDLE)
+        name = self._name(paramId)
+        if name is None:
+            return self._fail(_ERR_PARAMETER_INVALID)
+        attribute = _value(attribute)
+        target = _target(value)
+        parameter = self.camera.parameters.get(name)
+        if attribute == 8:  # ATTR_AVAIL
+            target.value = parameter is not None
+            return 1
+        if parameter is None:
+            return self._fail(_ERR_NOT_AVAILABLE)
+        if attribute == 0:  # ATTR_CURRENT
+            target.value = self.camera.value(name)
+        elif attribute == 1:  # ATTR_COUNT
+            target.value = len(parameter['enum']) if parameter['enum'] else 1
+        elif attribute == 2:  # ATTR_TYPE
+            target.value = (_value(paramId) >> 24) & 0xFF
+        elif attribute == 3:
+            target.value = parameter['min']
+        elif attribute == 4:
+            target.value = parameter['max']
+        elif attribute == 5:
+            target.value = parameter['default']
+        elif attribute == 6:
+            target.value = parameter['increment']
+        elif attribute == 7:  # ATTR_ACCESS
+            target.value = parameter['access']
+        else:
+            return self._fail(_ERR_ATTRIBUTE_INVALID)
+        return 1
+
+    def pl_set_param(self, handle, paramId, value):
+        self._call()
+        if not self._checkHandle(handle):
+            return self._fail(_ERR_INVALID_HANDLE)
+        name = self._name(paramId)
+        if name is None:
+            return self._fail(_ERR_PARAMETER_INVALID)
+        parameter = self.camera.parameters.get(name)
+        if parameter is None:
+            return self._fail(_ERR_NOT_AVAILABLE)
+        if parameter['access'] != _READ_WRITE:
+            return self._fail(_ERR_CANT_SET)
+        newValue = _target(value).value
+        if parameter['enum']:
+            if newValue not in [v for v, description in parameter['enum']]:
+                return self._fail(_ERR_FAILED_TO_SET)
+        elif not parameter['min'] <= newValue <= parameter['max']:
+            return self._fail(_ERR_FAILED_TO_SET)
+        self.camera.setValue(name, newValue)
+        return 1
+
+    def _enum(self, handle, paramId, index):
+        if not self._checkHandle(handle):
+            return _ERR_INVALID_HANDLE, None
+        name = self._name(paramId)
+        parameter = self.camera.parameters.get(name) if name else None
+        if parameter is None or not parameter['enum']:
+            return _ERR_PARAMETER_INVALID, None
+        index = _value(index)
+        if not 0 <= index < len(parameter['enum']):
+            return _ERR_INDEX_OUT_OF_RANGE, None
+        return 0, parameter['enum'][index]
+
+    def pl_get_enum_param(self, handle, paramId, index, value, description, length):
+        self._call()
+        error, entry = self._enum(handle, paramId, index)
+        if error:
+            return self._fail(error)
+        _target(value).value = entry[0]
+        description.value = entry[1][:_value(length) - 1]
+        return 1
+
+    def pl_enum_str_length(self, handle, paramId, index, length):
+        self._call()
+        error, entry = self._enum(handle, paramId, index)
+        if error:
+            # like the dll, the length of the description of the index-th value
+            # is asked with the value itself by Princeton.getEnumeratedParameterAsString
+            parameter = self.camera.parameters.get(self._name(paramId) or '')
+            if parameter is None or not parameter['enum']:
+                return self._fail(error)
+            entry = (0, max([d for v, d in parameter['enum']], key=len))
+        _target(length).value = len(entry[1]) + 1
+        return 1
+
+    # Class 3
+
+    def pl_exp_init_seq(self):
+        self._call()
+        self._expInitialized = True
+        return 1
+
+    def pl_exp_uninit_seq(self):
+        self._call()
+        self._expInitialized = False
+        return 1
+
+    def _setupAcquisition(self, handle, frames, rois, mode, expTime, continuous):
+        if not self._checkHandle(handle):
+            return _ERR_INVALID_HANDLE
+        if not self._expInitialized:
+            return _ERR_NOT_INITIALIZED
+        error = self._checkRois(rois)
+        if error:
+            return error
+        camera = self.camera
+        camera.rois = rois
+        triggered = _value(mode) in (1, 2, 3)  # strobed, bulb, trigger first
+        self._setup = camera.newAcquisition(frames, rois, camera.exposureTime(_value(expTime)), triggered,
+                                            continuous)
+        return 0
+
+    def pl_exp_setup_seq(self, handle, exposures, numberRois, rois, mode, expTime, size):
+        self._call()
+        error = self._setupAcquisition(handle, _value(exposures), self._rois(numberRois, rois), mode, expTime, False)
+        if error:
+            return self._fail(error)
+        _target(size).value = self._setup.frames * self._setup.frameSize * 2
+        return 1
+
+    def pl_exp_start_seq(self, handle, stream):
+        self._call()
+        if not self._checkHandle(handle):
+            return self._fail(_ERR_INVALID_HANDLE)
+        if self._setup is None:
+            return self._fail(_ERR_NOT_INITIALIZED)
+        self._setup.start(stream)
+        self.camera.acquisition = self._setup
+        return 1
+
+    def pl_exp_setup_cont(self, handle, numberRois, rois, mode, expTime, size, circularMode):
+        self._call()
+        error = self._setupAcquisition(handle, None, self._rois(numberRois, rois), mode, expTime, True)
+        if error:
+            return self._fail(error)
+        _target(size).value = self._setup.frameSize * 2
+        return 1
+
+    def pl_exp_start_cont(self, handle, stream, size):
+        return self.pl_exp_start_seq(handle, stream)
+
+    def pl_exp_check_status(self, handle, status, byteCount):
+        self._call()
+        acquisition = self.camera.acquisition
+        if not self._checkHandle(handle):
+            return self._fail(_ERR_INVALID_HANDLE)
+        if acquisition is None:
+            _target(status).value = _READOUT_NOT_ACTIVE
+            _target(byteCount).value = 0
+            return 1
+        n = acquisition.write()
+        _target(status).value = acquisition.status()
+        _target(byteCount).value = n * acquisition.frameSize * 2
+        return 1
+
+    def pl_exp_check_cont_status(self, handle, status, byteCount, bufferCount):
+        result = self.pl_exp_check_status(handle, status, byteCount)
+        if result:
+            acquisition = self.camera.acquisition
+            _target(bufferCount).value = acquisition.written if acquisition is not None else 0
+        return result
+
+    def _frameAddress(self, k):
+        acquisition = self.camera.acquisition
+        slots = len(acquisition.stream) // acquisition.frameSize
+        offset = (k % slots) * acquisition.frameSize * 2
+        return acquisition.stream.ctypes.data + offset
+
+    def pl_exp_get_latest_frame(self, handle, frame):
+        self._call()
+        acquisition = self.camera.acquisition
+        if not self._checkHandle(handle):
+            return self._fail(_ERR_INVALID_HANDLE)
+        if acquisition is None or acquisition.write() == 0:
+            return self._fail(_ERR_NO_FRAME)
+        _target(frame).value = self._frameAddress(acquisition.written - 1)
+        return 1
+
+    def pl_exp_get_oldest_frame(self, handle, frame):
+        self._call()
+        acquisition = self.camera.acquisition
+        if not self._checkHandle(handle):
+            return self._fail(_ERR_INVALID_HANDLE)
+        if acquisition is None or acquisition.write() == 0:
+            return self._fail(_ERR_NO_FRAME)
+        oldest = getattr(acquisition, 'unlocked', 0)
+        slots = len(acquisition.stream) // acquisition.frameSize
+        oldest = max(oldest, acquisition.written - slots)
+        if oldest >= acquisition.written:
+            return self._fail(_ERR_NO_FRAME)
+        acquisition.unlocked = oldest
+        _target(frame).value = self._frameAddress(oldest)
+        return 1
+
+    def pl_exp_unlock_oldest_frame(self, handle):
+        acquisition = self.camera.acquisition
+        if acquisition is not None:
+            acquisition.unlocked = getattr(acquisition, 'unlocked', 0) + 1
+        return 1
+
+    def pl_exp_stop_cont(self, handle, mode):
+        self._call()
+        self.camera.acquisition = None
+        return 1
+
+    def pl_exp_abort(self, handle, mode):
+        self._call()
+        self.camera.acquisition = None
+        return 1
+
+    def pl_exp_finish_seq(self, handle, stream, bufferHandle):
+        self._call()
+        acquisition = self.camera.acquisition
+        if not self._checkHandle(handle):
+            return self._fail(_ERR_INVALID_HANDLE)
+        if acquisition is None:
+            return self._fail(_ERR_NOT_INITIALIZED)
+        acquisition.wait()
+        acquisition.write()
+        self.camera.acquisition = None
+        buffer_ = self._buffers.get(_value(bufferHandle))
+        if buffer_ is not None:
+            offset = 0
+            for e, images in enumerate(buffer_.images[:acquisition.frames]):
+                for (imageHandle, image), pixels in zip(images, acquisition.pixels):
+                    numpy.frombuffer(image, dtype=numpy.uint16)[:] = acquisition.stream[offset:offset + pixels]
+                    offset += pixels
+                buffer_.dates[e] = acquisition.times[e] if e < len(acquisition.times) else time.time()
+        return 1
+
+    def pl_exp_unravel(self, *args):
+        return self._fail(_ERR_NOT_AVAILABLE)
+
+    def pl_exp_get_driver_buffer(self, handle, pointer, size):
+        _target(pointer).value = None
+        _target(size).value = 0
+        return 1
+
+    def pl_exp_wait_start_xfer(self, handle, timeout):
+        return self._fail(_ERR_NOT_AVAILABLE)
+
+    def pl_exp_wait_end_xfer(self, handle, timeout):
+        return self._fail(_ERR_NOT_AVAILABLE)
+
+    def pl_io_script_control(self, *args):
+        return 1
+
+    def pl_io_clear_script_control(self, *args):
+        return 1
+
+    # Class 4
+
+    def pl_buf_init(self):
+        self._call()
+        self._bufInitialized = True
+        return 1
+
+    def pl_buf_uninit(self):
+        self._call()
+        self._bufInitialized = False
+        return 1
+
+    def pl_buf_alloc(self, bufferHandle, exposures, precision, numberRois, rois):
+        self._call()
+        rois = self._rois(numberRois, rois)
+        error = self._checkRois(rois)
+        if error:
+            return self._fail(error)
+        buffer_ = _Buffer(_value(exposures), _value(precision), rois, self._nextImage)
+        handle = self._nextBuffer
+        self._nextBuffer += 1
+        self._buffers[handle] = buffer_
+        for e, images in enumerate(buffer_.images):
+            for r, (imageHandle, image) in enumerate(images):
+                self._images[imageHandle] = (handle, e, r, image)
+                self._nextImage = imageHandle + 1
+        _target(bufferHandle).value = handle
+        return 1
+
+    def pl_buf_free(self, bufferHandle):
+        self._call()
+        buffer_ = self._buffers.pop(_value(bufferHandle), None)
+        if buffer_ is None:
+            return self._fail(_ERR_INVALID_BUFFER)
+        for images in buffer_.images:
+            for imageHandle, image in images:
+                self._images.pop(imageHandle, None)
+        return 1
+
+    def _buffer(self, bufferHandle):
+        return self._buffers.get(_value(bufferHandle))
+
+    def pl_buf_get_bits(self, bufferHandle, bits):
+        self._call()
+        buffer_ = self._buffer(bufferHandle)
+        if buffer_ is None:
+            return self._fail(_ERR_INVALID_BUFFER)
+        _target(bits).value = buffer_.precision
+        return 1
+
+    def pl_buf_get_exp_date(self, bufferHandle, exposure, year, month, day, hour, minute, second, millisecond):
+        self._call()
+        buffer_ = self._buffer(bufferHandle)
+        if buffer_ is None:
+            return self._fail(_ERR_INVALID_BUFFER)
+        exposure = _value(exposure)
+        if not 0 <= exposure < len(buffer_.dates):
+            return self._fail(_ERR_INVALID_EXPOSURE)
+        date = datetime.datetime.fromtimestamp(buffer_.dates[exposure] or time.time())
+        for reference, value in zip((year, month, day, hour, minute, second, millisecond),
+                                    (date.year, date.month, date.day, date.hour, date.minute, date.second,
+                                     date.microsecond // 1000)):
+            _target(reference).value = value
+        return 1
+
+    def pl_buf_set_exp_date(self, *args):
+        return 1
+
+    def pl_buf_get_exp_time(self, bufferHandle, exposure, time_):
+        """Like the dll with our cameras, always zero."""
+        self._call()
+        if self._buffer(bufferHandle) is None:
+            return self._fail(_ERR_INVALID_BUFFER)
+        _target(time_).value = 0
+        return 1
+
+    def pl_buf_get_exp_total(self, bufferHandle, total):
+        self._call()
+        buffer_ = self._buffer(bufferHandle)
+        if buffer_ is None:
+            return self._fail(_ERR_INVALID_BUFFER)
+        _target(total).value = len(buffer_.images)
+        return 1
+
+    def pl_buf_get_img_total(self, bufferHandle, total):
+        self._call()
+        buffer_ = self._buffer(bufferHandle)
+        if buffer_ is None:
+            return self._fail(_ERR_INVALID_BUFFER)
+        _target(total).value = len(buffer_.rois)
+        return 1
+
+    def pl_buf_get_img_handle(self, bufferHandle, exposure, roi, imageHandle):
+        self._call()
+        buffer_ = self._buffer(bufferHandle)
+        if buffer_ is None:
+            return self._fail(_ERR_INVALID_BUFFER)
+        exposure = _value(exposure)
+        roi = _value(roi)
+        if not (0 <= exposure < len(buffer_.images) and 0 <= roi < len(buffer_.rois)):
+            return self._fail(_ERR_INVALID_EXPOSURE)
+        _target(imageHandle).value = buffer_.images[exposure][roi][0]
+        return 1
+
+    def _image(self, imageHandle):
+        entry = self._images.get(_value(imageHandle))
+        if entry is None:
+            return None, None
+        bufferHandle, exposure, roi, image = entry
+        return self._buffers[bufferHandle].rois[roi], image
+
+    def pl_buf_get_img_size(self, imageHandle, width, height):
+        self._call()
+        roi, image = self._image(imageHandle)
+        if roi is None:
+            return self._fail(_ERR_INVALID_IMAGE)
+        s1, s2, sbin, p1, p2, pbin = roi
+        _target(width).value = (s2 - s1 + 1) // sbin
+        _target(height).value = (p2 - p1 + 1) // pbin
+        return 1
+
+    def pl_buf_get_img_bin(self, imageHandle, sbin, pbin):
+        self._call()
+        roi, image = self._image(imageHandle)
+        if roi is None:
+            return self._fail(_ERR_INVALID_IMAGE)
+        _target(sbin).value = roi[2]
+        _target(pbin).value = roi[5]
+        return 1
+
+    def pl_buf_get_img_ofs(self, imageHandle, s1, p1):
+        self._call()
+        roi, image = self._image(imageHandle)
+        if roi is None:
+            return self._fail(_ERR_INVALID_IMAGE)
+        _target(s1).value = roi[0]
+        _target(p1).value = roi[3]
+        return 1
+
+    def pl_buf_get_img_ptr(self, imageHandle, pointer):
+        self._call()
+        roi, image = self._image(imageHandle)
+        if roi is None:
+            return self._fail(_ERR_INVALID_IMAGE)
+        _target(pointer).value = ct.addressof(image)
+        return 1
+
+    def pl_buf_get_size(self, bufferHandle, size):
+        self._call()
+        buffer_ = self._buffer(bufferHandle)
+        if buffer_ is None:
+            return self._fail(_ERR_INVALID_BUFFER)
+        _target(size).value = sum([len(image) * 2 for images in buffer_.images for h, image in images])
+        return 1
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Running statistics of each pixel (count, mean, variance, min, max) over the
+frames of an acquisition, updated as the frames arrive.
+
+The memory does not depend on the number of frames: the mean and the sum of
+the squared deviations (M2) are kept in float64, the extremes in the type of
+the frames. Each block of BLOCK_FRAMES frames is reduced to its own mean
+and M2 (two passes over the block, no cancellation), then merged with the accumulator with the
+update of Chan et al., which is Welford's algorithm for chunks of one frame:
+
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / n
+    M2 = M2_a + M2_b + delta**2 * n_a * n_b / n
+
+Two accumulators (chunks acquired separately, other cameras with the same
+ROI, other processes) are merged the same way.
+
+PixelStatistics is a stage of pvcam_pipeline.PipelinedAcquisition (it
+returns the images unchanged) and of pvcam_processing.ProcessingPipeline.
+
+Examples
+--------
+>>> stats = camera.acquireStatistics(1000)[0]
+>>> stats.mean, stats.variance, stats.max
+>>> signal, noise = stats.meanVariance()  # one point of a photon transfer curve
+"""
+
+from __future__ import division
+
+import numpy
+
+import pvcam_processing
+
+BLOCK_FRAMES = 16  # frames reduced together (float64 scratch of this many frames)
+
+
+class PixelStatistics(pvcam_processing.Stage):
+    """Per pixel count, mean, variance, min and max of frames.
+
+    Parameters
+    ----------
+    shape : shape of a frame, taken from the first frames if None (they
+        must then be given as an array (frames, ...))
+    roi : number of the ROI used as a pvcam_pipeline stage
+    """
+    perFrame = False
+
+    def __init__(self, shape=None, roi=0):
+        self.roi = roi
+        self.count = 0
+        self._shape = None if shape is None else tuple(shape)
+        self._mean = self._m2 = self._min = self._max = None
+        self._scratch = None
+
+    def _allocate(self, shape, dtype):
+        self._shape = tuple(shape)
+        self._mean = numpy.zeros(shape)
+        self._m2 = numpy.zeros(shape)
+        self._min = numpy.empty(shape, dtype=dtype)
+        self._max = numpy.empty(shape, dtype=dtype)
+
+    def update(self, frames):
+        """Adds frames, one frame or an array (frames, ...) of frames of the shape."""
+        frames = numpy.asarray(frames)
+        if self._shape is not None and frames.shape == self._shape:
+            frames = frames[numpy.newaxis]
+        n = len(frames)
+        if n == 0:
+            return
+        if self._mean is None:
+            if self._shape is not None and frames.shape[1:] != self._shape:
+                raise ValueError('frames of shape {0}, not {1}'.format(frames.shape[1:], self._shape))
+            self._allocate(frames.shape[1:], frames.dtype)
+            numpy.amin(frames, axis=0, out=self._min)
+            numpy.amax(frames, axis=0, out=self._max)
+        elif frames.shape[1:] != self._shape:
+            raise ValueError('frames of shape {0}, not {1}'.format(frames.shape[1:], self._shape))
+        else:
+            numpy.minimum(self._min, frames.min(axis=0), out=self._min, casting='unsafe')
+            numpy.maximum(self._max, frames.max(axis=0), out=self._max, casting='unsafe')
+        # mean and M2 of blocks of frames (bounded scratch memory)
+        for start in range(0, n, BLOCK_FRAMES):
+            block = frames[start:start + BLOCK_FRAMES]
+            mean = block.sum(axis=0, dtype=numpy.float64)
+            mean /= len(block)
+            if self._scratch is None or self._scratch.shape != block.shape:
+                self._scratch = numpy.empty(block.shape)
+            deviation = self._scratch
+            numpy.subtract(block, mean, out=deviation)
+            deviation *= deviation
+            self._merge(len(block), mean, deviation.sum(axis=0))
+
+    def _merge(self, n, mean, m2):
+        """Merges the mean and M2 of n other frames."""
+        total = self.count + n
+        delta = mean - self._mean
+        self._m2 += m2
+        if self.count:
+            self._m2 += delta * delta * (self.count * n / total)
+        delta *= n / total
+        self._mean += delta
+        self.count = total
+
+    def merge(self, other):
+        """Adds the frames of other, a PixelStatistics of frames of the same shape."""
+        if other.count == 0:
+            return self
+        if self._mean is None:
+            self._allocate(other._shape, other._min.dtype)
+            self._min[...] = other._min
+            self._max[...] = other._max
+        elif other._shape != self._shape:
+            raise ValueError('statistics of frames of shape {0}, not {1}'.format(other._shape, self._shape))
+        else:
+            numpy.minimum(self._min, other._min, out=self._min, casting='unsafe')
+            numpy.maximum(self._max, other._max, out=self._max, casting='unsafe')
+        self._merge(other.count, other._mean, other._m2)
+        return self
+
+    @classmethod
+    def combine(cls, statistics):
+        """PixelStatistics of all the frames of a list of PixelStatistics."""
+        result = cls()
+        for other in statistics:
+            result.merge(other)
+        return result
+
+    def reset(self):
+        """Forgets the frames (the arrays are kept)."""
+        self.count = 0
+        if self._mean is not None:
+            self._mean[...] = 0.
+            self._m2[...] = 0.
+            self._min[...] = numpy.iinfo(self._min.dtype).max if self._min.dtype.kind in 'iu' else numpy.inf
+            self._max[...] = numpy.iinfo(self._max.dtype).min if self._max.dtype.kind in 'iu' else -numpy.inf
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def mean(self):
+        """Mean of each pixel (float64 array, the accumulator itself)."""
+        return self._mean
+
+    @property
+    def variance(self):
+        """Unbiased variance of each pixel (NaN with fewer than 2 frames)."""
+        if self._m2 is None:
+            return None
+        if self.count < 2:
+            return numpy.full(self._shape, numpy.nan)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        """Standard deviation of each pixel."""
+        variance = self.variance
+        return None if variance is None else numpy.sqrt(variance)
+
+    @property
+    def min(self):
+        return self._min
+
+    @property
+    def max(self):
+        return self._max
+
+    def meanVariance(self, mask=None):
+        """(mean signal, mean temporal variance) of the pixels (of mask, a
+        boolean array, if given): one point of a photon transfer curve."""
+        mean, variance = self._mean, self.variance
+        if mask is not None:
+            mean, variance = mean[mask], variance[mask]
+        return float(mean.mean()), float(variance.mean())
+
+    def snr(self):
+        """Signal to noise ratio of each pixel (mean / standard deviation)."""
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return self._mean / self.std
+
+    # stage of a PipelinedAcquisition or a ProcessingPipeline
+
+    def __call__(self, index, images):
+        self.update(images[self.roi])
+        return images
+
+    def apply(self, data, out):
+        self.update(data)
+
+    def __repr__(self):
+        return 'PixelStatistics(shape={0}, count={1})'.format(self._shape, self.count)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Step-and-glue stitching of spectra measured in several windows (grating
+positions of a spectrometer).
+
+Each window (wavelengths, spectrum) is interpolated on a common uniform
+grid and added to two accumulators, the weighted sum of the spectra and the
+sum of the weights; the merged spectrum is their ratio. The weight of a
+window decreases linearly to its edges (feathering), so in an overlap the
+merge goes smoothly from one window to the next, and where only one window
+is present the merged spectrum is that window. The grid grows when a window
+falls outside of it, so the windows can be added as they are measured, in
+any order: the merged spectrum is ready as soon as the last window is added.
+
+With scale=True, each window is first scaled to match the merged spectrum
+in their overlap (drift of the source or of the detector between windows).
+
+Examples
+--------
+>>> stitcher = SpectralStitcher(step=0.05)
+>>> for center in (500, 550, 600):
+...     spectrometer.move(center)
+...     spectrum, metadata = camera.measure()
+...     stitcher.add(axisOf(center), spectrum)
+>>> wavelengths, spectrum = stitcher.merged()
+"""
+
+from __future__ import division
+
+import threading
+
+import numpy
+
+MIN_WEIGHT = 1e-3  # weight of the edges of a window, relative to its center
+
+
+def windowWeights(wavelengths, taper=None):
+    """Weights of the pixels of a window: 1 in the center, decreasing
+    linearly to MIN_WEIGHT at the edges over taper (half the window by
+    default)."""
+    wavelengths = numpy.asarray(wavelengths, dtype=numpy.float64)
+    low, high = wavelengths.min(), wavelengths.max()
+    if taper is None:
+        taper = (high - low) / 2
+    distance = numpy.minimum(wavelengths - low, high - wavelengths)
+    return numpy.clip(distance / max(taper, 1e-300), MIN_WEIGHT, 1.)
+
+
+class SpectralStitcher(object):
+    """Incremental merge of spectral windows on a uniform grid.
+
+    Parameters
+    ----------
+    step : step of the grid (unit of the wavelengths), the mean pixel
+        spacing of the first window if None
+    start : wavelength of a point of the grid, the first wavelength of the
+        first window if None
+    taper : width over which the weight of a window goes to its edges, half
+        of each window if None
+    scale : scale each window to the merged spectrum in their overlap
+    minOverlap : points of overlap needed to scale a window
+    """
+
+    def __init__(self, step=None, start=None, taper=None, scale=False, minOverlap=5):
+        self.step = step
+        self.start = start
+        self.taper = taper
+        self.scale = scale
+        self.minOverlap = minOverlap
+        self._first = None  # index of the first point of the accumulators on the grid
+        self._sum = None  # sum of weight * spectrum (..., points)
+        self._weight = None  # sum of weights (points)
+        self.windows = []  # (low, high, scale factor) of the windows added
+
+    def _extend(self, first, last, shape):
+        """Grows the accumulators to cover the grid points first to last."""
+        if self._sum is None:
+            self._first = first
+            self._sum = numpy.zeros(shape + (last - first + 1,))
+            self._weight = numpy.zeros(last - first + 1)
+            return
+        before = max(self._first - first, 0)
+        after = max(last - (self._first + self._weight.size - 1), 0)
+        if before or after:
+            pad = [(0, 0)] * (self._sum.ndim - 1) + [(before, after)]
+            self._sum = numpy.pad(self._sum, pad)
+            self._weight = numpy.pad(self._weight, (before, after))
+            self._first -= before
+
+    def add(self, wavelengths, spectrum, weights=None):
+        """Adds a window.
+
+        Parameters
+        ----------
+        wavelengths : wavelength of each pixel (monotonic)
+        spectrum : numpy array (..., pixels), e.g. the spectrum of
+            Easy_pvcam.measure, or an image (rows, pixels)
+        weights : weight of each pixel, windowWeights by default
+
+        Returns
+        -------
+        factor : scale factor applied to the window (1. without scale)
+        """
+        wavelengths = numpy.asarray(wavelengths, dtype=numpy.float64)
+        spectrum = numpy.asarray(spectrum, dtype=numpy.float64)
+        if spectrum.shape[-1] != wavelengths.size:
+            raise ValueError('{0} wavelengths for spectra of {1} pixels'.format(wavelengths.size, spectrum.shape[-1]))
+        if weights is not None:
+            weights = numpy.asarray(weights, dtype=numpy.float64)
+        if wavelengths[0] > wavelengths[-1]:
+            wavelengths = wavelengths[::-1]
+            spectrum = spectrum[..., ::-1]
+            weights = None if weights is None else weights[::-1]
+        if weights is None:
+            weights = windowWeights(wavelengths, self.taper)
+        if self.step is None:
+            self.step = (wavelengths[-1] - wavelengths[0]) / (wavelengths.size - 1)
+        if self.start is None:
+            self.start = wavelengths[0]
+        if self._sum is not None and self._sum.shape[:-1] != spectrum.shape[:-1]:
+            raise ValueError('spectra of shape {0} cannot be merged with {1}'.format(spectrum.shape[:-1],
+                                                                                     self._sum.shape[:-1]))
+        # grid points inside the window
+        first = int(numpy.ceil((wavelengths[0] - self.start) / self.step - 1e-9))
+        last = int(numpy.floor((wavelengths[-1] - self.start) / self.step + 1e-9))
+        if last < first:
+            raise ValueError('the window {0} - {1} has no point on the grid'.format(wavelengths[0], wavelengths[-1]))
+        self._extend(first, last, spectrum.shape[:-1])
+        grid = self.start + self.step * numpy.arange(first, last + 1)
+        # linear interpolation on the grid, for all the rows at once
+        index = numpy.clip(numpy.searchsorted(wavelengths, grid, side='right') - 1, 0, wavelengths.size - 2)
+        fraction = (grid - wavelengths[index]) / (wavelengths[index + 1] - wavelengths[index])
+        values = spectrum[..., index]
+        values += (spectrum[..., index + 1] - values) * fraction
+        w = weights[index] + (weights[index + 1] - weights[index]) * fraction
+        part = slice(first - self._first, last - self._first + 1)
+        factor = 1.
+        if self.scale:
+            common = self._weight[part] > 0
+            if numpy.count_nonzero(common) >= self.minOverlap:
+                merged = self._sum[..., part][..., common] / self._weight[part][common]
+                total = values[..., common].sum()
+                if total != 0:
+                    factor = float(merged.sum() / total)
+                    values *= factor
+        self._sum[..., part] += values * w
+        self._weight[part] += w
+        self.windows.append((wavelengths[0], wavelengths[-1], factor))
+        return factor
+
+    @property
+    def wavelengths(self):
+        """Grid of the merged spectrum."""
+        if self._weight is None:
+            return numpy.zeros(0)
+        return self.start + self.step * numpy.arange(self._first, self._first + self._weight.size)
+
+    def merged(self):
+        """(wavelengths, spectrum) of the windows added so far, the spectrum
+        being NaN on the points of the grid not covered (gaps between
+        windows)."""
+        if self._weight is None:
+            return numpy.zeros(0), numpy.zeros(0)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            spectrum = self._sum / self._weight
+        spectrum[..., self._weight == 0] = numpy.nan
+        return self.wavelengths, spectrum
+
+    def coverage(self):
+        """Sum of the weights of the windows on each point of the grid."""
+        return numpy.zeros(0) if self._weight is None else self._weight.copy()
+
+    def reset(self):
+        """Forgets the windows (the grid is kept)."""
+        self._first = self._sum = self._weight = None
+        self.windows = []
+
+
+def stitch(windows, **options):
+    """(wavelengths, spectrum) merging windows, a list of (wavelengths,
+    spectrum), see SpectralStitcher for the options."""
+    stitcher = SpectralStitcher(**options)
+    for wavelengths, spectrum in windows:
+        stitcher.add(wavelengths, spectrum)
+    return stitcher.merged()
+
+
+def stepAndGlue(camera, positions, move, axis, stitcher=None, **measureOptions):
+    """Measures a spectrum at each position of a spectrometer and stitches them.
+
+    The spectrometer goes to the next position while the last window is
+    merged.
+
+    Parameters
+    ----------
+    camera : Easy_pvcam (its measure method is used)
+    positions : positions of the spectrometer (e.g. center wavelengths)
+    move : function move(position) setting the spectrometer, returning
+        when it is there
+    axis : function axis(position) giving the wavelength of each pixel of
+        the spectrum measured at position
+    stitcher : SpectralStitcher, a new one if None
+    measureOptions : arguments of camera.measure (exposure, removeBackgound...)
+
+    Returns
+    -------
+    stitcher : SpectralStitcher with all the windows (see merged())
+    """
+    if stitcher is None:
+        stitcher = SpectralStitcher()
+    positions = list(positions)
+    if not positions:
+        return stitcher
+    errors = []
+
+    def moveTo(position):
+        try:
+            move(position)
+        except Exception as error:
+            errors.append(error)
+
+    move(positions[0])
+    for number, position in enumerate(positions):
+        spectrum, metadata = camera.measure(**measureOptions)
+        mover = None
+        if number + 1 < len(positions):
+            mover = threading.Thread(target=moveTo, args=(positions[number + 1],), name='stepAndGlue move')
+            mover.start()
+        try:
+            stitcher.add(axis(position), spectrum)
+        finally:
+            if mover is not None:
+                mover.join()
+        if errors:
+            raise errors[0]
+    return stitcher
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Health telemetry of Princeton cameras.
+
+Collects, for each camera, the cooling state (from its CoolingMonitor), the
+controller alive status, the frame counters of Princeton.telemetry
+(CameraTelemetry) and the driver errors of the process
+(Princeton_wrapper.errorCounts). Everything comes from cached values:
+reading the telemetry never calls the driver, so it does not disturb an
+acquisition. Start the cooling monitor of the camera to have the
+temperatures and the controller status.
+
+The values are available as a dict (snapshot), as Prometheus text
+(formatPrometheus) or from a local HTTP server (TelemetryServer):
+
+    /metrics : Prometheus text format
+    /snapshot : JSON
+
+Examples
+--------
+>>> import pvcam_telemetry
+>>> from Princeton_wrapper import Princeton
+>>> camera = Princeton()
+>>> camera.startCoolingMonitor(interval=5.)
+>>> server = pvcam_telemetry.TelemetryServer([camera], port=9464).start()
+>>> # curl http://127.0.0.1:9464/metrics
+>>> server.stop()
+"""
+
+from __future__ import division, print_function
+
+import json
+import math
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import Princeton_wrapper
+
+# name: (type, help) of the metrics of a camera, in the order of the output
+_METRICS = [
+    ('pvcam_temperature_celsius', 'gauge', 'Last temperature sampled by the cooling monitor.'),
+    ('pvcam_temperature_setpoint_celsius', 'gauge', 'Setpoint temperature.'),
+    ('pvcam_temperature_stable', 'gauge', '1 if the temperature is within the tolerance of the setpoint.'),
+    ('pvcam_temperature_age_seconds', 'gauge', 'Time since the last temperature sample.'),
+    ('pvcam_cooling_monitor_errors_total', 'counter', 'Failed samples of the cooling monitor.'),
+    ('pvcam_controller_alive', 'gauge', 'CONTROLLER_ALIVE at the last sample of the cooling monitor.'),
+    ('pvcam_frames_total', 'counter', 'Frames acquired.'),
+    ('pvcam_acquisitions_total', 'counter', 'Sequences acquired.'),
+    ('pvcam_frame_rate_hertz', 'gauge', 'Frames per second over the telemetry window.'),
+    ('pvcam_dropped_frames_total', 'counter', 'Frames lost (missed triggers).'),
+    ('pvcam_readout_failures_total', 'counter', 'Readouts ending with the status readoutFailed.'),
+    ('pvcam_last_frame_timestamp_seconds', 'gauge', 'Unix time of the last frame.'),
+]
+
+
+def _cameraName(camera):
+    name = camera.getCameraName()
+    return name.decode('ascii', 'replace') if isinstance(name, bytes) else str(name)
+
+
+def snapshot(camera, tolerance=0.5):
+    """dict of the health values of camera (None when unknown).
+
+    Parameters
+    ----------
+    camera : Princeton
+    tolerance : celcius, for pvcam_temperature_stable
+    """
+    telemetry = camera.telemetry
+    monitor = camera.coolingMonitor
+    last = monitor.last if monitor is not None else None
+    return {
+        'camera': _cameraName(camera),
+        'pvcam_temperature_celsius': last[1] if last else None,
+        'pvcam_temperature_setpoint_celsius': last[2] if last else None,
+        'pvcam_temperature_stable': int(monitor.isStable(tolerance, 0.)) if last else None,
+        'pvcam_temperature_age_seconds': monitor.age if last else None,
+        'pvcam_cooling_monitor_errors_total': monitor.errors if monitor is not None else None,
+        'pvcam_controller_alive': int(monitor.controllerAlive) if last and monitor.controllerAlive is not None else None,
+        'pvcam_frames_total': telemetry.frames,
+        'pvcam_acquisitions_total': telemetry.acquisitions,
+        'pvcam_frame_rate_hertz': telemetry.frameRate(),
+        'pvcam_dropped_frames_total': telemetry.droppedFrames,
+        'pvcam_readout_failures_total': telemetry.readoutFailures,
+        'pvcam_last_frame_timestamp_seconds': telemetry.lastFrameTime,
+    }
+
+
+def driverErrors():
+    """dict error code: number of PrincetonError raised in this process."""
+    return dict(Princeton_wrapper.errorCounts)
+
+
+def _number(value):
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escapeLabel(value):
+    """value escaped for a label of the text exposition format."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formatPrometheus(cameras, tolerance=0.5):
+    """Text exposition format (version 0.0.4) of the telemetry of cameras."""
+    snapshots = [snapshot(camera, tolerance) for camera in cameras]
+    lines = []
+    for name, kind, text in _METRICS:
+        lines.append('# HELP {0} {1}'.format(name, text))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        for s in snapshots:
+            if s[name] is not None:
+                lines.append('{0}{{camera="{1}"}} {2}'.format(name, _escapeLabel(s['camera']), _number(s[name])))
+    lines.append('# HELP pvcam_driver_errors_total PrincetonError raised in the process, by PVCAM error code.')
+    lines.append('# TYPE pvcam_driver_errors_total counter')
+    errors = driverErrors()
+    for code in sorted(errors):
+        lines.append('pvcam_driver_errors_total{{code="{0}",error="{1}"}} {2}'.format(
+            code, _escapeLabel(Princeton_wrapper.PrincetonError.CODES.get(code, 'unknown').split('\n')[0].strip()),
+            errors[code]))
+    return '\n'.join(lines) + '\n'
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TelemetryServer(object):
+    """Local HTTP server of the telemetry of cameras (/metrics and /snapshot).
+
+    Parameters
+    ----------
+    cameras : list of Princeton
+    port : TCP port (0 for any free port, see url)
+    host : address to listen on, local only by default
+    tolerance : celcius, for pvcam_temperature_stable
+    """
+
+    def __init__(self, cameras, port=9464, host='127.0.0.1', tolerance=0.5):
+        self.cameras = list(cameras)
+        self.tolerance = tolerance
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/metrics':
+                    body = formatPrometheus(server.cameras, server.tolerance).encode('utf-8')
+                    contentType = 'text/plain; version=0.0.4; charset=utf-8'
+                elif path == '/snapshot':
+                    data = {'cameras': [snapshot(c, server.tolerance) for c in server.cameras],
+                            'driverErrors': dict((str(k), v) for k, v in driverErrors().items())}
+                    body = json.dumps(data).encode('utf-8')
+                    contentType = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', contentType)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = _ThreadingHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    def start(self):
+        """Serves in a daemon thread. Returns the server."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name='TelemetryServer')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
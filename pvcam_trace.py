@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Tracing of the calls to the PVCAM driver.
+
+Every Princeton method talks to the module level Princeton_wrapper.API object.
+TracingAPI is a proxy around that object which records, for each pl_* call,
+the function name, the arguments, the return code, the pl_error_code() on
+failure and the duration. Records are kept in an in-memory ring and can also
+be written to a compact binary log.
+
+The summary gives call counts and latency percentiles per function, and counts
+the repeated pl_get_param of the same parameter without any pl_set_param in
+between (round-trips that a cache would save).
+
+Examples
+--------
+>>> import pvcam_trace
+>>> from Princeton_wrapper import Princeton
+>>> camera = Princeton()
+>>> tracer = pvcam_trace.installTracer(path='acquisition.trace')
+>>> camera.takePicture()
+>>> pvcam_trace.uninstallTracer()
+>>> print(pvcam_trace.formatSummary(pvcam_trace.summarize(tracer.records)))
+
+From a shell, to summarise a binary log:
+
+    python pvcam_trace.py acquisition.trace
+"""
+
+from __future__ import division, print_function
+
+import sys
+import time
+import struct
+import collections
+import numpy
+
+TraceRecord = collections.namedtuple('TraceRecord', 'timestamp function args result error duration')
+TraceRecord.__doc__ = """One driver call.
+
+timestamp : time.time() at the beginning of the call
+function : name of the pl_* function
+args : tuple of the arguments (python values of the ctypes scalars,
+    None for references and arrays)
+result : return value of the function
+error : pl_error_code() if result is 0 (PV_FAIL), else 0
+duration : second
+"""
+
+# Binary log: magic, then records starting with one byte
+#   'N' : function name definition: uint16 index, uint8 length, name
+#   'C' : call: float64 timestamp, float64 duration, uint16 function index,
+#         int32 result, int16 error, uint8 number of arguments, int64 arguments
+#         (arguments that are not numbers are written as _NOT_A_NUMBER)
+_MAGIC = b'PVTRACE1'
+_NAME = struct.Struct('<HB')
+_CALL = struct.Struct('<ddHihB')
+_NOT_A_NUMBER = -2 ** 63
+
+
+def _argument(arg):
+    """Python value recorded for a driver argument."""
+    if isinstance(arg, (int, float, bytes)):
+        return arg
+    value = getattr(arg, 'value', None)
+    if isinstance(value, (int, float)) and not hasattr(arg, '_obj') and not hasattr(arg, '_length_'):
+        return value
+    return None
+
+
+class TracingAPI(object):
+    """Proxy around the ctypes interface recording the pl_* calls.
+
+    Parameters
+    ----------
+    api : object returned by API() (or another proxy)
+    ring : number of records kept in memory (0 for none)
+    path : file of the binary log (None for none)
+    """
+
+    def __init__(self, api, ring=100000, path=None):
+        self._api = api
+        self.records = collections.deque(maxlen=ring)
+        self._keep = ring > 0
+        self._log = None
+        self._names = {}
+        if path is not None:
+            self._log = open(path, 'wb')
+            self._log.write(_MAGIC)
+
+    def __getattr__(self, name):
+        value = getattr(self._api, name)
+        if name.startswith('pl_') and name != 'pl_error_code':
+            value = self._wrap(name, value)
+        setattr(self, name, value)  # next lookups do not go through __getattr__
+        return value
+
+    def _wrap(self, name, function):
+        api = self._api
+
+        def traced(*args):
+            timestamp = time.time()
+            start = time.perf_counter()
+            result = function(*args)
+            duration = time.perf_counter() - start
+            error = api.pl_error_code() if result == 0 else 0
+            self.record(TraceRecord(timestamp, name, tuple([_argument(a) for a in args]), result, error, duration))
+            return result
+        traced.__name__ = name
+        return traced
+
+    def record(self, record):
+        if self._keep:
+            self.records.append(record)
+        if self._log is not None:
+            self._write(record)
+
+    def _write(self, record):
+        index = self._names.get(record.function)
+        if index is None:
+            index = len(self._names)
+            self._names[record.function] = index
+            encoded = record.function.encode('ascii')
+            self._log.write(b'N' + _NAME.pack(index, len(encoded)) + encoded)
+        args = [a if isinstance(a, int) and -2 ** 63 < a < 2 ** 63 else _NOT_A_NUMBER for a in record.args]
+        result = record.result if isinstance(record.result, int) else -1
+        self._log.write(b'C' + _CALL.pack(record.timestamp, record.duration, index, result, record.error, len(args)))
+        self._log.write(struct.pack('<%iq' % len(args), *args))
+
+    def flush(self):
+        if self._log is not None:
+            self._log.flush()
+
+    def close(self):
+        """Closes the binary log."""
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+def readTrace(path):
+    """Returns the list of TraceRecord of a binary log written by TracingAPI."""
+    records = []
+    names = {}
+    with open(path, 'rb') as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("{path} is not a PVCAM trace".format(path=path))
+        while True:
+            kind = f.read(1)
+            if not kind:
+                break
+            if kind == b'N':
+                index, length = _NAME.unpack(f.read(_NAME.size))
+                names[index] = f.read(length).decode('ascii')
+            elif kind == b'C':
+                data = f.read(_CALL.size)
+                if len(data) < _CALL.size:  # truncated log (program killed while writing)
+                    break
+                timestamp, duration, index, result, error, nargs = _CALL.unpack(data)
+                args = struct.unpack('<%iq' % nargs, f.read(8 * nargs))
+                args = tuple([None if a == _NOT_A_NUMBER else a for a in args])
+                records.append(TraceRecord(timestamp, names[index], args, result, error, duration))
+            else:
+                raise ValueError("corrupted trace {path}".format(path=path))
+    return records
+
+
+def summarize(records):
+    """Call counts and latencies per function.
+
+    Returns
+    -------
+    dict function: dict with count, failures, total, mean, p50, p95, p99
+        and max durations (second), sorted by decreasing total time.
+        The key 'redundant pl_get_param' gives, for each (parameter ID,
+        attribute), the number of pl_get_param repeated without any
+        pl_set_param in between.
+    """
+    durations = collections.defaultdict(list)
+    failures = collections.Counter()
+    redundant = collections.Counter()
+    seen = set()
+    for record in records:
+        durations[record.function].append(record.duration)
+        if record.error or record.result == 0:
+            failures[record.function] += 1
+        if record.function == 'pl_set_param':
+            seen = set()
+        elif record.function == 'pl_get_param' and len(record.args) >= 3:
+            key = (record.args[1], record.args[2])
+            if key in seen:
+                redundant[key] += 1
+            seen.add(key)
+    summary = collections.OrderedDict()
+    for function in sorted(durations, key=lambda f: -sum(durations[f])):
+        d = numpy.array(durations[function])
+        summary[function] = {'count': len(d),
+                             'failures': failures[function],
+                             'total': float(d.sum()),
+                             'mean': float(d.mean()),
+                             'p50': float(numpy.percentile(d, 50)),
+                             'p95': float(numpy.percentile(d, 95)),
+                             'p99': float(numpy.percentile(d, 99)),
+                             'max': float(d.max())}
+    summary['redundant pl_get_param'] = dict(redundant)
+    return summary
+
+
+def _parameterName(paramId):
+    try:
+        from Princeton_wrapper import Princeton
+    except Exception:  # no driver on this computer
+        return str(paramId)
+    descriptor = Princeton.ParamTable.get(paramId)
+    return descriptor.name if descriptor is not None else str(paramId)
+
+
+def formatSummary(summary):
+    """Text table of the result of summarize()."""
+    lines = ['{0:<28}{1:>8}{2:>6}{3:>11}{4:>11}{5:>11}{6:>11}{7:>11}'.format(
+        'function', 'count', 'fail', 'total (ms)', 'mean (us)', 'p50 (us)', 'p95 (us)', 'p99 (us)')]
+    for function, s in summary.items():
+        if function == 'redundant pl_get_param':
+            continue
+        lines.append('{0:<28}{1:>8}{2:>6}{3:>11.2f}{4:>11.1f}{5:>11.1f}{6:>11.1f}{7:>11.1f}'.format(
+            function, s['count'], s['failures'], s['total'] * 1e3, s['mean'] * 1e6,
+            s['p50'] * 1e6, s['p95'] * 1e6, s['p99'] * 1e6))
+    redundant = summary.get('redundant pl_get_param')
+    if redundant:
+        lines.append('')
+        lines.append('pl_get_param repeated without pl_set_param in between:')
+        for (paramId, attribute), count in sorted(redundant.items(), key=lambda x: -x[1]):
+            lines.append('  {0:<26} attribute {1:<3}{2:>8}'.format(_parameterName(paramId), attribute, count))
+    return '\n'.join(lines)
+
+
+_tracer = None
+
+
+def installTracer(ring=100000, path=None):
+    """Replaces Princeton_wrapper.API by a TracingAPI around it.
+
+    Every Princeton instance is traced until uninstallTracer().
+    Returns the TracingAPI.
+    """
+    global _tracer
+    import Princeton_wrapper
+    if _tracer is not None:
+        uninstallTracer()
+    _tracer = TracingAPI(Princeton_wrapper.API, ring, path)
+    Princeton_wrapper.API = _tracer
+    return _tracer
+
+
+def uninstallTracer():
+    """Puts back the API wrapped by installTracer(). Returns the TracingAPI with its records."""
+    global _tracer
+    import Princeton_wrapper
+    tracer = _tracer
+    _tracer = None
+    if tracer is not None:
+        Princeton_wrapper._unlinkAPI(tracer)
+        tracer.close()
+    return tracer
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('usage: python pvcam_trace.py trace_file')
+        sys.exit(1)
+    print(formatSummary(summarize(readTrace(sys.argv[1]))))
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Wavelength axis of the spectra: wavelength of each column of a ROI for a
+center wavelength of the spectrometer.
+
+A calibration gives the wavelength (nm) of chip columns (serial pixel
+positions, 0 being the first column, fractional for the center of binned
+pixels) for a center wavelength:
+
+GratingCalibration : grating equation of a Czerny-Turner spectrometer
+    (grooves, focal length, inclusion angle, detector angle), with the pixel
+    pitch of the camera (PIX_SER_DIST), plus an optional polynomial
+    correction fitted on lamp lines
+PolynomialCalibration : polynomial of the column (fitPolynomial), measured
+    at one center wavelength
+TableCalibration : measured wavelength of some columns, interpolated
+
+The axis of a ROI depends only on its serial part (s1, s2, sbin) and on the
+center wavelength: WavelengthAxes computes it once per (s1, s2, sbin,
+center) and returns the same read-only array afterwards, so attaching the
+axis to a spectrum costs nothing. The resampling of the spectra of a ROI on
+a uniform grid (a pvcam_processing.Resample stage, whose indices and
+weights are precomputed) is cached the same way.
+
+A calibration can be kept per chip in <chip>_wavelength.json of the
+calibration directory (see pvcam_calibration), loaded by Easy_pvcam.
+
+Examples
+--------
+>>> import pvcam_wavelength as pw
+>>> calibration = pw.GratingCalibration(grooves=1200, focalLength=300, inclusionAngle=30)
+>>> axes = pw.WavelengthAxes.forCamera(camera, calibration)
+>>> wavelengths = axes.axis(camera.ROI[0], center=546.1)
+>>> grid = pw.uniformGrid(500, 600, 0.05)
+>>> resampled = axes.resample(spectrum, camera.ROI[0], grid, center=546.1)
+>>> pw.saveCalibration(calibration, pw.calibrationPath(chipName))
+"""
+
+from __future__ import division
+
+import json
+import os
+
+import numpy
+
+import pvcam_calibration
+import pvcam_config
+import pvcam_processing
+
+
+def _polynomial(coefficients, columns):
+    return numpy.polyval(coefficients, columns) if coefficients else 0.
+
+
+class GratingCalibration(object):
+    """Grating equation of a Czerny-Turner spectrometer.
+
+    With the grating turned to put center on the optical axis:
+
+        sin(alpha) + sin(beta) = order * center / d,  alpha - beta = inclusionAngle
+
+    and the column at x mm from the optical axis on a detector tilted by
+    detectorAngle receives the wavelength diffracted at beta + xi,
+    tan(xi) = x cos(detectorAngle) / (focalLength + x sin(detectorAngle)).
+
+    Parameters
+    ----------
+    grooves : grooves per mm
+    focalLength : focal length of the focusing mirror (mm)
+    inclusionAngle : angle between the incident and diffracted beams (degree)
+    detectorAngle : tilt of the detector (degree)
+    order : diffraction order
+    opticalCenter : chip column on the optical axis, the middle of the chip if None
+    reverse : the wavelength decreases with the column
+    correction : polynomial coefficients (numpy.polyval, nm) of the column
+        added to the wavelengths
+    """
+    kind = 'grating'
+
+    def __init__(self, grooves, focalLength, inclusionAngle, detectorAngle=0., order=1, opticalCenter=None,
+                 reverse=False, correction=None):
+        self.grooves = grooves
+        self.focalLength = focalLength
+        self.inclusionAngle = inclusionAngle
+        self.detectorAngle = detectorAngle
+        self.order = order
+        self.opticalCenter = opticalCenter
+        self.reverse = reverse
+        self.correction = list(correction) if correction is not None else None
+
+    def wavelengths(self, columns, center, pitch, serSize):
+        """Wavelengths (nm) of columns for the center wavelength center (nm),
+        pitch being PIX_SER_DIST (nm) and serSize the columns of the chip."""
+        if center is None:
+            raise ValueError('the grating equation needs the center wavelength')
+        columns = numpy.asarray(columns, dtype=numpy.float64)
+        d = 1e6 / self.grooves  # nm
+        half = numpy.radians(self.inclusionAngle) / 2
+        ratio = self.order * center / (2 * d * numpy.cos(half))
+        if abs(ratio) > 1:
+            raise ValueError('{0} nm cannot be diffracted on the optical axis in order {1}'.format(center, self.order))
+        psi = numpy.arcsin(ratio)
+        opticalCenter = (serSize - 1) / 2 if self.opticalCenter is None else self.opticalCenter
+        x = (columns - opticalCenter) * pitch * 1e-6  # mm
+        if self.reverse:
+            x = -x
+        tilt = numpy.radians(self.detectorAngle)
+        xi = numpy.arctan2(x * numpy.cos(tilt), self.focalLength + x * numpy.sin(tilt))
+        wavelengths = d / self.order * (numpy.sin(psi + half) + numpy.sin(psi - half + xi))
+        return wavelengths + _polynomial(self.correction, columns)
+
+    def toDict(self):
+        return {'grooves': self.grooves, 'focalLength': self.focalLength, 'inclusionAngle': self.inclusionAngle,
+                'detectorAngle': self.detectorAngle, 'order': self.order, 'opticalCenter': self.opticalCenter,
+                'reverse': self.reverse, 'correction': self.correction}
+
+    def __repr__(self):
+        return 'GratingCalibration({0} g/mm, f={1} mm, {2} deg)'.format(self.grooves, self.focalLength,
+                                                                        self.inclusionAngle)
+
+
+class PolynomialCalibration(object):
+    """Wavelength (nm) polynomial of the column (coefficients of
+    numpy.polyval), measured at the center wavelength center: for another
+    center wavelength the axis is shifted by the difference (small moves
+    of the grating). center None: the axis does not depend on it."""
+    kind = 'polynomial'
+
+    def __init__(self, coefficients, center=None):
+        self.coefficients = [float(c) for c in coefficients]
+        self.center = center
+
+    def wavelengths(self, columns, center=None, pitch=None, serSize=None):
+        wavelengths = numpy.polyval(self.coefficients, numpy.asarray(columns, dtype=numpy.float64))
+        if center is not None and self.center is not None:
+            wavelengths += center - self.center
+        return wavelengths
+
+    def toDict(self):
+        return {'coefficients': self.coefficients, 'center': self.center}
+
+    def __repr__(self):
+        return 'PolynomialCalibration(degree {0}, center={1})'.format(len(self.coefficients) - 1, self.center)
+
+
+class TableCalibration(object):
+    """Wavelengths (nm) of some columns (e.g. lamp lines, or of every
+    column), linearly interpolated, and extrapolated with the slope of the
+    ends. The axis is shifted like PolynomialCalibration for another
+    center wavelength."""
+    kind = 'table'
+
+    def __init__(self, columns, wavelengths, center=None):
+        columns = numpy.asarray(columns, dtype=numpy.float64)
+        wavelengths = numpy.asarray(wavelengths, dtype=numpy.float64)
+        if columns.size < 2 or columns.size != wavelengths.size:
+            raise ValueError('the table needs at least 2 columns, with one wavelength each')
+        order = numpy.argsort(columns)
+        self.columns = columns[order]
+        self.table = wavelengths[order]
+        self.center = center
+
+    def wavelengths(self, columns, center=None, pitch=None, serSize=None):
+        columns = numpy.asarray(columns, dtype=numpy.float64)
+        c, w = self.columns, self.table
+        wavelengths = numpy.interp(columns, c, w)
+        low, high = columns < c[0], columns > c[-1]
+        wavelengths[low] = w[0] + (columns[low] - c[0]) * (w[1] - w[0]) / (c[1] - c[0])
+        wavelengths[high] = w[-1] + (columns[high] - c[-1]) * (w[-1] - w[-2]) / (c[-1] - c[-2])
+        if center is not None and self.center is not None:
+            wavelengths += center - self.center
+        return wavelengths
+
+    def toDict(self):
+        return {'columns': self.columns.tolist(), 'wavelengths': self.table.tolist(), 'center': self.center}
+
+    def __repr__(self):
+        return 'TableCalibration({0} columns, center={1})'.format(self.columns.size, self.center)
+
+
+KINDS = dict((cls.kind, cls) for cls in (GratingCalibration, PolynomialCalibration, TableCalibration))
+
+
+def fitPolynomial(columns, wavelengths, degree=3, center=None):
+    """PolynomialCalibration fitted on the chip columns of known lines
+    (e.g. of a calibration lamp) measured at the center wavelength center.
+
+    Returns
+    -------
+    calibration : PolynomialCalibration
+    residuals : wavelength - fit of each line (nm)
+    """
+    columns = numpy.asarray(columns, dtype=numpy.float64)
+    wavelengths = numpy.asarray(wavelengths, dtype=numpy.float64)
+    if columns.size <= degree:
+        raise ValueError('{0} lines for a polynomial of degree {1}'.format(columns.size, degree))
+    coefficients = numpy.polyfit(columns, wavelengths, degree)
+    return PolynomialCalibration(coefficients, center), wavelengths - numpy.polyval(coefficients, columns)
+
+
+def roiColumns(roi):
+    """Chip column of the center of each (binned) column of roi (s1, s2, sbin, ...)."""
+    s1, s2, sbin = roi[:3]
+    return s1 + sbin * numpy.arange((s2 - s1 + 1) // sbin) + (sbin - 1) / 2
+
+
+def uniformGrid(low, high, step):
+    """Uniform grid from low to high (included if on the grid)."""
+    return low + step * numpy.arange(int(numpy.floor((high - low) / step + 1e-9)) + 1)
+
+
+class WavelengthAxes(object):
+    """Wavelength axes of the ROIs of a camera, computed once per (s1, s2,
+    sbin, center wavelength).
+
+    Parameters
+    ----------
+    calibration : GratingCalibration, PolynomialCalibration or TableCalibration
+    pitch : PIX_SER_DIST (nm)
+    serSize : columns of the chip
+    """
+
+    def __init__(self, calibration, pitch, serSize):
+        self.calibration = calibration
+        self.pitch = pitch
+        self.serSize = serSize
+        self._axes = {}
+        self._resamplers = {}
+
+    @classmethod
+    def forCamera(cls, camera, calibration):
+        """WavelengthAxes of camera (Princeton) with calibration."""
+        serSize, parSize = camera.getCameraSize()
+        return cls(calibration, camera.getParameterCurrentValue('PIX_SER_DIST'), serSize)
+
+    def axis(self, roi, center=None):
+        """Wavelength (nm) of each column of roi (s1, s2, sbin, p1, p2, pbin)
+        at the center wavelength center: read-only float64 array, the same
+        for the next calls."""
+        key = (roi[0], roi[1], roi[2], center)
+        axis = self._axes.get(key)
+        if axis is None:
+            axis = numpy.array(self.calibration.wavelengths(roiColumns(roi), center, self.pitch, self.serSize),
+                               dtype=numpy.float64)
+            axis.flags.writeable = False
+            self._axes[key] = axis
+        return axis
+
+    def resampler(self, roi, grid, center=None):
+        """pvcam_processing.Resample stage interpolating the spectra of roi on
+        grid (wavelengths, nm), cached like the axes."""
+        grid = numpy.asarray(grid, dtype=numpy.float64)
+        key = (roi[0], roi[1], roi[2], center, grid.tobytes())
+        stage = self._resamplers.get(key)
+        if stage is None:
+            axis = self.axis(roi, center)
+            if axis[0] > axis[-1]:  # the stage needs increasing positions
+                stage = pvcam_processing.Resample(-axis, -grid)
+            else:
+                stage = pvcam_processing.Resample(axis, grid)
+            self._resamplers[key] = stage
+        return stage
+
+    def resample(self, spectra, roi, grid, center=None):
+        """spectra (..., columns of roi) interpolated on grid (float32 array
+        (..., grid points)); the values outside the axis are the ones of its
+        ends."""
+        spectra = numpy.asarray(spectra, dtype=numpy.float32)  # like the data of the pipelines
+        stage = self.resampler(roi, grid, center)
+        data = spectra.reshape(-1, 1, spectra.shape[-1])
+        out = numpy.empty(stage.outputShape(data.shape), dtype=numpy.float32)
+        stage.apply(data, out)
+        return out.reshape(spectra.shape[:-1] + (out.shape[-1],))
+
+    def clear(self):
+        """Forgets the cached axes (after a change of the calibration)."""
+        self._axes.clear()
+        self._resamplers.clear()
+
+
+def calibrationPath(chip):
+    """<chip>_wavelength.json of the calibration directory."""
+    return os.path.join(pvcam_calibration.calibrationDirectory(), pvcam_config.chipKey(chip) + '_wavelength.json')
+
+
+def saveCalibration(calibration, path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'kind': calibration.kind, 'parameters': calibration.toDict()}, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def loadCalibration(path):
+    """Calibration saved in path, None if there is no file."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    if data['kind'] not in KINDS:
+        raise ValueError('{0}: unknown wavelength calibration {1!r}'.format(path, data['kind']))
+    return KINDS[data['kind']](**data['parameters'])
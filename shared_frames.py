@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+Shared-memory frame transport between processes.
+
+Only one process can own the camera (pl_cam_open is called with
+OPEN_EXCLUSIVE), so other processes (live view, fitting, recording) receive
+frames through a ring of slots kept in a multiprocessing.shared_memory block.
+
+*FramePublisher* lives in the process owning the Princeton object and writes
+every frame in the next slot, with a sequence number and a descriptor of the
+ROI it comes from (exposure index, ROI index, shape, dtype, timestamp).
+
+*FrameSubscriber* attaches to the block by name from any process and reads the
+frames as numpy views on the shared memory (no copy). Each subscriber keeps its
+own position in the ring and counts the frames it lost because the publisher
+went around the ring before they were read.
+
+A view stays valid until the publisher reuses its slot, i.e. for the next
+(slots - 1) frames. SharedFrame.isValid() tells if it was overwritten, copy
+the data if it must be kept longer.
+
+Examples
+--------
+>>> # camera process
+>>> from Princeton_wrapper import Princeton
+>>> from shared_frames import FramePublisher
+>>> camera = Princeton()
+>>> publisher = FramePublisher.forCamera(camera, slots=32, name='pixis')
+>>> publisher.run(camera, count=100)
+>>>
+>>> # any other process
+>>> from shared_frames import FrameSubscriber
+>>> subscriber = FrameSubscriber('pixis')
+>>> frame = subscriber.next(timeout=5)
+>>> frame.data.mean(), frame.sequence, frame.roi
+>>> subscriber.statistics
+"""
+
+from __future__ import division
+
+import time
+import numpy
+from multiprocessing import shared_memory, resource_tracker
+
+_MAGIC = 0x50564652  # 'PVFR'
+_VERSION = 1
+_ALIGN = 64  # bytes, alignment of slot headers and frame data
+_published = set()  # names of the rings created by the publishers of this process
+
+_HEADER_DTYPE = numpy.dtype([('magic', '<u4'),
+                             ('version', '<u4'),
+                             ('slots', '<u4'),
+                             ('closed', '<u4'),
+                             ('slotBytes', '<u8'),
+                             ('head', '<u8')])  # last sequence number written (0: none)
+
+_SLOT_DTYPE = numpy.dtype([('begin', '<u8'),  # sequence number being written
+                           ('end', '<u8'),  # sequence number completely written
+                           ('timestamp', '<f8'),  # time.time() of the publication
+                           ('exposure', '<u4'),  # exposure index in the acquisition
+                           ('roi', '<u4'),  # ROI index in the acquisition
+                           ('rows', '<u4'),
+                           ('cols', '<u4'),
+                           ('typecode', '<u4')])  # ord(numpy.dtype.char)
+
+
+# dtype of the raw images of Princeton.convertStream (numpy array of the
+# python integers read from the buffer), float32 for the calibrated ones
+_RAW_DTYPE = numpy.asarray([0]).dtype
+_CALIBRATED_DTYPE = numpy.dtype(numpy.float32)
+
+
+def _align(size):
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _roiPixels(ROI):
+    """Number of pixels of a (s1, s2, sbin, p1, p2, pbin) region once binned."""
+    s1, s2, sbin, p1, p2, pbin = ROI
+    return ((s2 - s1 + 1) // sbin) * ((p2 - p1 + 1) // pbin)
+
+
+class _Ring(object):
+    """numpy views on the header and slots of a shared memory block."""
+
+    def __init__(self, shm, slots, slotBytes):
+        self.shm = shm
+        self.slots = slots
+        self.slotBytes = slotBytes
+        self.headerSize = _align(_HEADER_DTYPE.itemsize)
+        self.slotHeaderSize = _align(_SLOT_DTYPE.itemsize)
+        self.slotStride = self.slotHeaderSize + _align(slotBytes)
+        self.header = numpy.ndarray((), _HEADER_DTYPE, buffer=shm.buf)
+        self.slotHeaders = numpy.ndarray((slots,), _SLOT_DTYPE, buffer=shm.buf,
+                                         offset=self.headerSize, strides=(self.slotStride,))
+
+    @classmethod
+    def size(cls, slots, slotBytes):
+        return _align(_HEADER_DTYPE.itemsize) + slots * (_align(_SLOT_DTYPE.itemsize) + _align(slotBytes))
+
+    def dataView(self, index, shape, dtype):
+        offset = self.headerSize + index * self.slotStride + self.slotHeaderSize
+        return numpy.ndarray(shape, dtype, buffer=self.shm.buf, offset=offset)
+
+    def release(self):
+        """Drop the views so the shared memory can be closed."""
+        self.header = None
+        self.slotHeaders = None
+
+
+class SharedFrame(object):
+    """One frame read from the ring.
+
+    data : numpy array, view on the shared memory (rows, cols)
+    sequence : sequence number given by the publisher (starts at 1)
+    exposure, roi : position of the frame in the acquisition, images[exposure][roi]
+    timestamp : time.time() at publication
+    """
+    __slots__ = ('data', 'sequence', 'exposure', 'roi', 'timestamp', '_slotHeader')
+
+    def __init__(self, data, sequence, exposure, roi, timestamp, slotHeader):
+        self.data = data
+        self.sequence = sequence
+        self.exposure = exposure
+        self.roi = roi
+        self.timestamp = timestamp
+        self._slotHeader = slotHeader
+
+    def isValid(self):
+        """False once the publisher started to overwrite the slot of this frame."""
+        return int(self._slotHeader['begin']) == self.sequence
+
+    def copy(self):
+        """Returns a copy of the data that does not depend on the ring."""
+        return numpy.array(self.data)
+
+
+class FramePublisher(object):
+    """Writes frames in a shared memory ring.
+
+    Parameters
+    ----------
+    slotBytes : maximum size of one frame, in bytes
+    slots : number of frames kept in the ring
+    name : name of the shared memory block (random if None), given to FrameSubscriber
+    dtype : frames are converted to this type when copied in the ring
+        (the camera buffers are 16 bits), None to keep the type of each frame
+        (calibrated frames are float32). Conversions losing the kind of the
+        values (float to integer...) are refused, integer frames are accepted
+        if their values fit in dtype.
+    """
+
+    def __init__(self, slotBytes, slots=16, name=None, dtype=numpy.uint16):
+        if slots < 2:
+            raise ValueError("a ring needs at least 2 slots, not {slots}".format(slots=slots))
+        self.dtype = None if dtype is None else numpy.dtype(dtype)
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=_Ring.size(slots, slotBytes))
+        self._ring = _Ring(self._shm, slots, slotBytes)
+        _published.add(self._shm.name)
+        header = self._ring.header
+        header['slots'] = slots
+        header['slotBytes'] = slotBytes
+        header['head'] = 0
+        header['closed'] = 0
+        header['version'] = _VERSION
+        header['magic'] = _MAGIC
+        self._sequence = 0
+
+    @classmethod
+    def forCamera(cls, camera, slots=16, name=None, dtype=numpy.uint16):
+        """Publisher with slots big enough for the largest ROI of camera.
+
+        With dtype None the slots are sized for the images of takePicture,
+        raw or calibrated.
+        """
+        pixels = max([_roiPixels(ROI) for ROI in camera.ROI])
+        if dtype is None:
+            itemsize = max(_RAW_DTYPE.itemsize, _CALIBRATED_DTYPE.itemsize)
+        else:
+            itemsize = numpy.dtype(dtype).itemsize
+        return cls(pixels * itemsize, slots=slots, name=name, dtype=dtype)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def sequence(self):
+        """Sequence number of the last published frame."""
+        return self._sequence
+
+    def publish(self, frame, exposure=0, roi=0, timestamp=None):
+        """Copies one 1D or 2D frame in the next slot of the ring.
+
+        Returns
+        -------
+        sequence : sequence number given to the frame
+        """
+        frame = numpy.asarray(frame)
+        if frame.ndim == 1:
+            frame = frame.reshape(1, -1)
+        if frame.ndim != 2:
+            raise ValueError("a slot holds one 2D frame, not an array of shape {0}".format(frame.shape))
+        dtype = frame.dtype if self.dtype is None else self.dtype
+        casting = 'same_kind'
+        if not numpy.can_cast(frame.dtype, dtype, casting=casting):
+            if not self._fits(frame, dtype):
+                raise ValueError("{0} frames can not be stored as {1} without loss, "
+                                 "create the publisher with dtype=None or {0}".format(frame.dtype, dtype))
+            casting = 'unsafe'  # values checked
+        rows, cols = frame.shape
+        if rows * cols * dtype.itemsize > self._ring.slotBytes:
+            raise ValueError("frame of {0}x{1} does not fit in a slot of {2} bytes".format(rows, cols, self._ring.slotBytes))
+        sequence = self._sequence + 1
+        index = sequence % self._ring.slots
+        slotHeader = self._ring.slotHeaders[index]
+        slotHeader['begin'] = sequence  # readers of the previous frame in this slot see it invalid
+        numpy.copyto(self._ring.dataView(index, (rows, cols), dtype), frame, casting=casting)
+        slotHeader['timestamp'] = time.time() if timestamp is None else timestamp
+        slotHeader['exposure'] = exposure
+        slotHeader['roi'] = roi
+        slotHeader['rows'] = rows
+        slotHeader['cols'] = cols
+        slotHeader['typecode'] = ord(dtype.char)
+        slotHeader['end'] = sequence
+        self._ring.header['head'] = sequence
+        self._sequence = sequence
+        return sequence
+
+    @staticmethod
+    def _fits(frame, dtype):
+        """True if the integer frame has its values in the range of the integer dtype."""
+        if frame.dtype.kind not in 'iu' or dtype.kind not in 'iu':
+            return False
+        if frame.size == 0:
+            return True
+        info = numpy.iinfo(dtype)
+        return info.min <= frame.min() and frame.max() <= info.max
+
+    def publishImages(self, images):
+        """Publishes every ROI of every exposure returned by Princeton.takePicture().
+
+        The sub-frames of a kinetics cube are published one by one.
+        """
+        timestamp = time.time()
+        for exposure, regions in enumerate(images):
+            for roi, image in enumerate(regions):
+                image = numpy.asarray(image)
+                for frame in (image if image.ndim == 3 else [image]):
+                    self.publish(frame, exposure, roi, timestamp)
+        return self._sequence
+
+    def run(self, camera, count=None, stopEvent=None):
+        """Acquisition loop: takes pictures with camera and publishes them.
+
+        Parameters
+        ----------
+        camera : Princeton instance
+        count : number of acquisitions (takePicture calls), None to run until stopEvent is set
+        stopEvent : threading.Event (or anything with is_set()) to end the loop
+        """
+        n = 0
+        while count is None or n < count:
+            if stopEvent is not None and stopEvent.is_set():
+                break
+            images, infos = camera.takePicture(optionDisplayMessage=False)
+            self.publishImages(images)
+            n = n + 1
+        return n
+
+    def close(self, unlink=True):
+        """Marks the ring as closed for the subscribers and frees the shared memory."""
+        if self._ring.header is not None:
+            self._ring.header['closed'] = 1
+            self._ring.release()
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+            _published.discard(self._shm.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameSubscriber(object):
+    """Reads frames published by a FramePublisher in another process.
+
+    Parameters
+    ----------
+    name : name of the shared memory block (FramePublisher.name)
+    startAtLatest : if True, the first frame read is the last one published,
+        otherwise the oldest one still in the ring
+    """
+
+    def __init__(self, name, startAtLatest=True):
+        self._shm = self._attach(name)
+        header = numpy.ndarray((), _HEADER_DTYPE, buffer=self._shm.buf)
+        if int(header['magic']) != _MAGIC or int(header['version']) != _VERSION:
+            del header
+            self._shm.close()
+            raise ValueError("{name} is not a frame ring".format(name=name))
+        self._ring = _Ring(self._shm, int(header['slots']), int(header['slotBytes']))
+        del header
+        head = self._head()
+        if startAtLatest:
+            self._next = max(head, 1)
+        else:
+            self._next = max(head - self._ring.slots + 1, 1)
+        self.received = 0
+        self.dropped = 0
+        self.torn = 0
+        self.maxLag = 0
+
+    @staticmethod
+    def _attach(name):
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:  # python < 3.13 registers the block, and would unlink it at exit
+            shm = shared_memory.SharedMemory(name=name)
+            if name not in _published:  # the registration belongs to the publisher
+                try:
+                    resource_tracker.unregister(shm._name, 'shared_memory')
+                except Exception:
+                    pass
+            return shm
+
+    def _head(self):
+        return int(self._ring.header['head'])
+
+    @property
+    def closed(self):
+        """True when the publisher closed the ring."""
+        return bool(self._ring.header['closed'])
+
+    @property
+    def lag(self):
+        """Number of published frames not read yet."""
+        return max(self._head() - self._next + 1, 0)
+
+    @property
+    def statistics(self):
+        return {'received': self.received,
+                'dropped': self.dropped,
+                'torn': self.torn,
+                'lag': self.lag,
+                'maxLag': self.maxLag}
+
+    def poll(self):
+        """Returns the next frame, or None if it is not published yet."""
+        while True:
+            head = self._head()
+            if self._next > head:
+                return None
+            lag = head - self._next + 1
+            if lag > self.maxLag:
+                self.maxLag = lag
+            oldest = head - self._ring.slots + 1
+            if self._next < oldest:  # the publisher went around the ring
+                self.dropped += oldest - self._next
+                self._next = oldest
+            frame = self._read(self._next)
+            self._next += 1
+            if frame is not None:
+                self.received += 1
+                return frame
+            self.torn += 1
+            self.dropped += 1
+
+    def next(self, timeout=None, interval=0.001):
+        """Waits for the next frame. Returns None on timeout (second) or if the ring is closed."""
+        start = time.time()
+        while True:
+            frame = self.poll()
+            if frame is not None:
+                return frame
+            if self.closed or (timeout is not None and time.time() - start > timeout):
+                return None
+            time.sleep(interval)
+
+    def latest(self):
+        """Skips to the last published frame (skipped frames are not counted as dropped)."""
+        head = self._head()
+        if head == 0:
+            return None
+        self._next = max(self._next, head)
+        return self.poll()
+
+    def _read(self, sequence):
+        slotHeader = self._ring.slotHeaders[sequence % self._ring.slots]
+        if int(slotHeader['end']) != sequence or int(slotHeader['begin']) != sequence:
+            return None
+        rows = int(slotHeader['rows'])
+        cols = int(slotHeader['cols'])
+        dtype = numpy.dtype(chr(int(slotHeader['typecode'])))
+        exposure = int(slotHeader['exposure'])
+        roi = int(slotHeader['roi'])
+        timestamp = float(slotHeader['timestamp'])
+        data = self._ring.dataView(sequence % self._ring.slots, (rows, cols), dtype)
+        frame = SharedFrame(data, sequence, exposure, roi, timestamp, slotHeader)
+        if not frame.isValid():  # overwritten while reading the descriptor
+            return None
+        return frame
+
+    def close(self):
+        """Detaches from the shared memory. Frames read before must not be used anymore."""
+        self._ring.release()
+        try:
+            self._shm.close()
+        except BufferError:  # frames still referenced, the mapping goes away with them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -11,7 +11,6 @@ Created on Tue Aug 18 16:44:05 2015
 :Version: 
   2017.09
 """
-from lmfit.models import LinearModel
 import numpy as np
 from copy import deepcopy
 
@@ -55,6 +54,7 @@ def replaceSpike(x, y, I):
     I is the index of bad points.
     Works by doing a linear fit over the data.
     """
+    from lmfit.models import LinearModel
     mod = LinearModel()
     params = mod.guess(data=np.delete(y, I), x=np.delete(x, I))
 #    print(params)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""The tests run against the simulated driver (pvcam_sim), without camera."""
+
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('PVCAM_DRIVER', 'simulated')
+os.environ.setdefault('PVCAM_SIM_TIMESCALE', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def camera():
+    """Princeton on the simulated camera, closed after the test."""
+    from Princeton_wrapper import Princeton
+    camera = Princeton()
+    yield camera
+    camera.close()
+
+
+@pytest.fixture
+def easy_camera():
+    """Easy_pvcam on the simulated camera, closed after the test."""
+    from easy_pvcam import Easy_pvcam
+    camera = Easy_pvcam()
+    yield camera
+    camera.close()
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import Princeton_wrapper
+import pvcam_trace
+
+
+def test_counting_removed_under_tracer():
+    base = Princeton_wrapper.API
+    Princeton_wrapper._startCallCounting()
+    tracer = pvcam_trace.installTracer(ring=10)
+    Princeton_wrapper.API.pl_pvcam_get_ver
+    Princeton_wrapper._stopCallCounting()
+    assert Princeton_wrapper.API is tracer
+    assert tracer._api is base
+    assert 'pl_pvcam_get_ver' not in vars(tracer)
+    pvcam_trace.uninstallTracer()
+    assert Princeton_wrapper.API is base
+
+
+def test_tracer_removed_under_counting():
+    base = Princeton_wrapper.API
+    pvcam_trace.installTracer(ring=10)
+    counting = Princeton_wrapper._startCallCounting()
+    pvcam_trace.uninstallTracer()
+    assert Princeton_wrapper.API is counting
+    assert counting._api is base
+    Princeton_wrapper._stopCallCounting()
+    assert Princeton_wrapper.API is base
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import numpy
+
+import Princeton_wrapper
+import pvcam_calibration as pc
+from Princeton_wrapper import ExposureUnits
+
+ROWS, COLUMNS = 10, 100
+
+
+def _maps(key):
+    """Maps of a (ROWS, COLUMNS) ROI that are not symmetric in rows and columns."""
+    random = numpy.random.RandomState(0)
+    dark = (600 + 5 * random.standard_normal((ROWS, COLUMNS))).astype(numpy.float32)
+    flat = (1 + 0.1 * numpy.arange(ROWS)[:, None] + 0.002 * numpy.arange(COLUMNS)).astype(numpy.float32)
+    badPixels = numpy.zeros((ROWS, COLUMNS), dtype=bool)
+    badPixels[2, 7] = badPixels[8, 50] = True
+    return pc.CalibrationMaps(key, dark, flat, badPixels, {'exposureTime': 1e-3})
+
+
+def test_store_round_trip(tmp_path):
+    key = pc.CalibrationKey('chip', (0, COLUMNS - 1, 1, 0, ROWS - 1, 1), 1, 0)
+    maps = _maps(key)
+    store = pc.CalibrationStore(str(tmp_path))
+    store.save(maps)
+    assert key in store and store.keys() == [key]
+    loaded = store.load(key)
+    assert store.load(key) is loaded
+    assert loaded.info == {'exposureTime': 1e-3}
+    assert loaded.kinds == ['dark', 'flat', 'badPixels']
+    for name in pc.MAP_NAMES + pc.PREPARED_NAMES:
+        array = getattr(loaded, name)
+        assert isinstance(array, numpy.memmap) and not array.flags.writeable
+        numpy.testing.assert_array_equal(array, getattr(maps, name))
+    frames = numpy.arange(2 * ROWS * COLUMNS, dtype=numpy.uint16).reshape(2, ROWS, COLUMNS)
+    numpy.testing.assert_array_equal(loaded.correct(frames), maps.correct(frames))
+    store.remove(key)
+    assert store.load(key) is None
+
+
+def test_corrected_pictures(camera, tmp_path):
+    camera.changeLastExposureROI((0, COLUMNS - 1, 1, 0, ROWS - 1, 1))
+    maps = _maps(pc.cameraKeys(camera)[0])
+    store = pc.CalibrationStore(str(tmp_path))
+    store.save(maps)
+    camera.calibrationStore = store
+    images, infos = camera.takePicture(optionDisplayMessage=False)
+    corrected = images[0][0]
+    assert corrected.dtype == numpy.float32
+    assert 'calibration\tdark,flat,badPixels\n' in infos[0][0]
+    camera.calibrationStore = None
+    raw = camera.convertStream(None)[0][0][0]  # same buffer, not corrected
+    assert corrected.shape == raw.shape == (COLUMNS, ROWS)
+    # the maps (rows, columns) apply to the pixels in readout order
+    expected = maps.correct(raw.reshape(ROWS, COLUMNS))
+    numpy.testing.assert_allclose(corrected, expected.reshape(raw.shape), rtol=1e-6)
+
+
+def test_detect_defects(camera, monkeypatch):
+    simulated = Princeton_wrapper.API.camera
+    hot = [(3, 40), (200, 700), (399, 1339)]
+    dead = [(0, 0), (150, 900)]
+    monkeypatch.setattr(simulated, 'cosmicRate', 0.)
+    monkeypatch.setattr(simulated, 'hotPixels', tuple(numpy.transpose(hot)))
+    monkeypatch.setattr(simulated, 'hotPixelCurrent', numpy.full(len(hot), 2000.))
+    frame = simulated.frame
+
+    def deadFrame(roi, exposure, kineticsWindow=None):
+        image = frame(roi, exposure, kineticsWindow)
+        for p, s in dead:  # the chip is read without binning
+            image[p - roi[3], s - roi[0]] = 0
+        return image
+    monkeypatch.setattr(simulated, 'frame', deadFrame)
+    camera.changeLastExposureROI((0, COLUMNS - 1, 1, 0, ROWS - 1, 1))
+    camera.setExposureTime(100, ExposureUnits.millisecond)
+    shutter = camera.shutterOpenMode
+    defectMap = pc.detectDefects(camera, frames=8)
+    assert camera.shutterOpenMode == shutter and camera.ROI == [(0, COLUMNS - 1, 1, 0, ROWS - 1, 1)]
+    assert defectMap.shape == (400, 1340)
+    found = {kind: sorted(zip(*(defectMap.pixels[defectMap.pixels['kind'] == index][name].tolist()
+                                for name in ('row', 'column'))))
+             for index, kind in enumerate(pc.DEFECT_KINDS)}
+    assert found == {'hot': hot, 'noisy': [], 'dead': dead}
+    assert defectMap.table((0, COLUMNS - 1, 1, 0, ROWS - 1, 1))['index'].tolist() == [0, 3 * COLUMNS + 40]
+
+
+def _defectMap(pixels, level=100.):
+    """DefectMap of the simulated chip with hot pixels (row, column)."""
+    chipPixels = numpy.zeros(len(pixels), dtype=pc.CHIP_DEFECT_DTYPE)
+    chipPixels['row'], chipPixels['column'] = numpy.transpose(pixels)
+    chipPixels['level'] = level
+    return pc.DefectMap('EEV400x1340B', (400, 1340), chipPixels)
+
+
+def test_defect_correction():
+    roi = (10, 10 + COLUMNS - 1, 1, 5, 5 + ROWS - 1, 1)
+    # two neighbours in a row, the first column of a row, a pixel outside the ROI
+    defectMap = _defectMap([(7, 30), (7, 31), (9, 10), (2, 30)])
+    correction = pc.DefectCorrection(defectMap, roi)
+    assert defectMap.table(roi) is correction.defects
+    frames = numpy.tile(numpy.arange(COLUMNS, dtype=numpy.float32) * 2, (3, ROWS, 1))
+    expected = frames.copy()
+    expected[:, 4, 0] = 2  # only a neighbour at the right
+    frames[:, 2, 20:22] = frames[:, 4, 0] = 60000
+    correction.correct(frames)
+    numpy.testing.assert_array_equal(frames, expected)
+    binned = pc._defects(defectMap.mask((10, 10 + COLUMNS - 1, 2, 5, 5 + ROWS - 1, ROWS)))
+    assert binned['index'].tolist() == [0, 10]  # 100 > 6 sqrt(2 * 10)
+
+
+def test_defect_stage(easy_camera):
+    s1, s2, sbin, p1, p2, pbin = roi = tuple(easy_camera.ROI[0])
+    easy_camera.defectMap = _defectMap([(p1, s1 + 500 * sbin)], level=1e4)
+    stage = easy_camera.processingPipeline().stages[0]
+    assert isinstance(stage, pc.DefectCorrection) and stage.roi == roi
+    rows, columns = pc._shape(roi)
+    frames = numpy.tile(numpy.arange(columns, dtype=numpy.float32), (2, rows, 1))
+    expected = frames.copy()
+    frames[:, 0, 500] = 60000
+    numpy.testing.assert_array_equal(easy_camera.processingPipeline().run(frames), expected)
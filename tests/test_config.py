@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import pytest
+
+import pvcam_config
+
+SECTION = {'setpoint_temperature': -100, 'speed': 0, 'gain': 1, 'exposureTime': 1,
+           'shutter': {'opened': 'never', 'closed': 'presequence', 'delay': 0.1},
+           'presets': {'fast focus': {'speed': 1, 'exposureTime': 0.01}}}
+
+
+def _section(**fields):
+    section = dict(SECTION)
+    section.update(fields)
+    return section
+
+
+@pytest.mark.parametrize('fields, message', [
+    ({'colour': 1}, "unknown field 'colour'"),
+    ({'shutter': {'opened': 'sometimes', 'closed': 'never', 'delay': 0}}, 'shutter.opened'),
+    ({'exposureTime': 70}, 'exposureTime'),
+    ({'presets': {'slow': {'exposureTime': -1}}}, 'presets.slow.exposureTime'),
+])
+def test_validation_errors(fields, message):
+    with pytest.raises(pvcam_config.ConfigError) as error:
+        pvcam_config.CameraConfig({'EEV 400x1340B': _section(**fields)})
+    assert message in str(error.value)
+
+
+def test_presets_over_default():
+    profile = pvcam_config.CameraConfig({'EEV 400x1340B': SECTION}).profile(b'EEV 400x1340B')
+    assert profile.name == 'EEV400x1340B'
+    assert list(profile.presets) == ['default', 'fast focus']
+    fast = profile.preset('fast focus')
+    assert (fast['speed'], fast['exposureTime'], fast['gain']) == (1, 0.01, 1)
+    assert profile.preset()['speed'] == 0
+    with pytest.raises(KeyError):
+        profile.preset('slow')
+
+
+def test_diff_and_apply(camera):
+    profile = pvcam_config.CameraConfig({'EEV 400x1340B': SECTION}).profile('EEV 400x1340B')
+    pvcam_config.applyPreset(camera, profile)
+    assert not pvcam_config.diff(camera, profile.preset())
+    changes = pvcam_config.diff(camera, dict(profile.preset(), exposureTime=2))
+    assert list(changes) == ['EXP_TIME']
+    # the gain is written again after the speed table
+    assert list(pvcam_config.diff(camera, dict(profile.preset(), speed=1))) == ['SPDTAB_INDEX', 'GAIN_INDEX']
+    report = pvcam_config.applyPreset(camera, profile, 'fast focus')
+    assert list(report['changed']) == ['SPDTAB_INDEX', 'GAIN_INDEX', 'EXP_RES_INDEX', 'EXP_TIME']
+    assert report['unchanged'] == ['TEMP_SETPOINT']
+    assert camera.getParameterCurrentValue('SPDTAB_INDEX') == 1
+    assert camera.expTime == 10000  # microseconds
+    assert not pvcam_config.applyPreset(camera, profile, 'fast focus')['changed']
+
+
+def test_load_config_cached(tmp_path):
+    pytest.importorskip('yaml')
+    path = str(tmp_path / 'easy_pvcam.yaml')
+    with open(path, 'w') as f:
+        f.write('EEV400x1340B:\n    speed: 0\n')
+    config = pvcam_config.loadConfig(path)
+    assert pvcam_config.loadConfig(path) is config
+    with open(path, 'w') as f:
+        f.write('EEV400x1340B:\n    speed: 1\n')
+    later = time.time() + 10
+    os.utime(path, (later, later))
+    reloaded = pvcam_config.loadConfig(path)
+    assert reloaded is not config
+    assert reloaded.profile('EEV400x1340B').preset()['speed'] == 1
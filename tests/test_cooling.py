@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import Princeton_wrapper
+
+
+def test_wait_until_stable(camera):
+    monitor = camera.startCoolingMonitor(interval=0.01)
+    assert monitor.waitUntilStable(tolerance=0.5, holdTime=0.05, timeout=5.)
+    assert monitor.isStable(tolerance=0.5, holdTime=0.05)
+    assert monitor.temperature == camera.getParameterCurrentValue('TEMP_SETPOINT') / 100.
+
+
+def test_wait_until_stable_timeout(camera):
+    monitor = camera.startCoolingMonitor(interval=0.01)
+    assert not monitor.waitUntilStable(tolerance=0.5, holdTime=60., timeout=0.1)
+
+
+def test_wait_needs_running_monitor(camera):
+    monitor = camera.startCoolingMonitor(interval=0.01)
+    camera.stopCoolingMonitor()
+    with pytest.raises(RuntimeError):
+        monitor.waitUntilStable()
+
+
+class _LockCheckingAPI(object):
+    """Records the pl_* calls made without driverLock."""
+
+    def __init__(self, api):
+        self._api = api
+        self.unlocked = set()
+
+    def __getattr__(self, name):
+        value = getattr(self._api, name)
+        if not name.startswith('pl_'):
+            return value
+
+        def checked(*args):
+            if not Princeton_wrapper.driverLock._is_owned():
+                self.unlocked.add(name)
+            return value(*args)
+        return checked
+
+
+def test_driver_calls_under_lock(camera, monkeypatch):
+    api = _LockCheckingAPI(Princeton_wrapper.API)
+    monkeypatch.setattr(Princeton_wrapper, 'API', api)
+    camera.numberPicturesToTake = 3
+    camera.takePicture(optionDisplayMessage=False)
+    camera.bufferGetExposureTiming()
+    for chunk in camera.streamSequence(4, chunk=2):
+        pass
+    assert not api.unlocked
+
+
+def test_failed_readout_error_code_under_lock(camera, monkeypatch):
+    run = camera.armTriggeredRun(2)
+    api = _LockCheckingAPI(Princeton_wrapper.API)
+    monkeypatch.setattr(Princeton_wrapper, 'API', api)
+    failed = ('', Princeton_wrapper.ReadoutStatus.readoutFailed.value, 0)
+    monkeypatch.setattr(camera, 'exposureCheckStatus', lambda: failed)
+    with pytest.raises(Princeton_wrapper.PrincetonError):
+        list(run)
+    with pytest.raises(Princeton_wrapper.PrincetonError):
+        camera._waitSequenceEnd()
+    assert not api.unlocked
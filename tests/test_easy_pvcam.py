@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import numpy
+import pytest
+
+from Princeton_wrapper import pvcamSession
+from easy_pvcam import Easy_pvcam
+
+
+def test_open_measure_close():
+    count = pvcamSession.count
+    camera = Easy_pvcam()
+    try:
+        assert pvcamSession.count == count + 1
+        assert camera.checkValidHandle()
+        spectrum, metadata = camera.measure()
+        assert spectrum.size == camera.getCameraSize()[0]
+    finally:
+        camera.close()
+    assert pvcamSession.count == count
+    assert not camera.checkValidHandle()
+
+
+def _pictures(number, columns, seed=0):
+    """takePicture() result of number spectra with a few spikes."""
+    random = numpy.random.RandomState(seed)
+    spectra = random.poisson(1000, (number, 1, columns)).astype(numpy.uint16)
+    spectra[random.randint(number, size=5), 0, random.randint(columns, size=5)] = 60000
+    return [[spectrum] for spectrum in spectra], [['metadata'] for spectrum in spectra]
+
+
+def _baselineMeasure(camera, pictures):
+    """measure() before the processing pipeline, on the pictures."""
+    spectrum = numpy.squeeze(pictures[0]).astype(numpy.float64)
+    if camera.cosmic_peaks_sequential:
+        spectrum = numpy.median(spectrum, 0) * len(spectrum)  # what spikes.cleanSpikes returns
+    for row in numpy.atleast_2d(spectrum):  # each spectrum, in place
+        camera._correct_cosmic_peaks_spatial(row)
+    return spectrum
+
+
+@pytest.mark.parametrize('number, sequential, spatial', [(1, False, None), (3, False, None),
+                                                         (1, False, 0.5), (3, False, 0.5),
+                                                         (5, True, None), (5, True, 0.5)])
+def test_measure_matches_baseline(easy_camera, monkeypatch, number, sequential, spatial):
+    easy_camera.numberPicturesToTake = number
+    easy_camera.cosmic_peaks_sequential = sequential
+    easy_camera.cosmic_peaks_spatial = spatial
+    pictures = _pictures(number, easy_camera.getCameraSize()[0])
+    monkeypatch.setattr(easy_camera, 'takePicture', lambda *args, **kwargs: pictures)
+    spectrum, metadata = easy_camera.measure()
+    assert metadata == 'metadata'
+    numpy.testing.assert_allclose(spectrum, _baselineMeasure(easy_camera, pictures), rtol=1e-6)
+
+
+def test_replaced_pipeline_closed(easy_camera):
+    easy_camera.numberPicturesToTake = 5
+    easy_camera.measure()
+    pipeline = easy_camera.processingPipeline()
+    pipeline.run(numpy.zeros((64, 1, 8), numpy.float32))  # starts the workers
+    easy_camera.cosmic_peaks_sequential = True
+    assert easy_camera.processingPipeline() is not pipeline
+    assert pipeline._pool is None
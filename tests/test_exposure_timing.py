@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import pytest
+
+from Princeton_wrapper import ExposureUnits
+
+
+def test_configured_exposure_reported(camera):
+    camera.setExposureTime(1, ExposureUnits.microsecond)
+    images, infos = camera.takePicture(optionDisplayMessage=False)
+    fields = dict(line.split('\t') for line in infos[0][0].splitlines())
+    assert float(fields['exposureTime (ms)']) == pytest.approx(1e-3)
+    assert 'hostExposureTime (ms)' in fields
+
+
+def test_host_dates_in_local_time(camera):
+    camera.takePicture(optionDisplayMessage=False)
+    timing = camera.bufferGetExposureTiming()
+    assert timing.source == 'configured'
+    date = timing.dates[0].item()
+    assert abs((date - datetime.datetime.now()).total_seconds()) < 60
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""The analysis modules are imported without loading the driver."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _loadsDriver(module):
+    environment = dict(os.environ)
+    environment.pop('PVCAM_DRIVER', None)
+    environment['PYTHONPATH'] = os.pathsep.join([ROOT] + sys.path)
+    output = subprocess.check_output(
+        [sys.executable, '-c', "import sys, {0}; print('Princeton_wrapper' in sys.modules)".format(module)],
+        env=environment, cwd=ROOT)
+    return output.decode().strip() == 'True'
+
+
+@pytest.mark.parametrize('module', ['pvcam_config', 'pvcam_ptc', 'pvcam_wavelength'])
+def test_without_driver(module):
+    assert not _loadsDriver(module)
+
+
+def test_unknown_driver_rejected():
+    environment = dict(os.environ, PVCAM_DRIVER='simulate')
+    environment['PYTHONPATH'] = os.pathsep.join([ROOT] + sys.path)
+    process = subprocess.run([sys.executable, '-c', 'import Princeton_wrapper'],
+                             env=environment, cwd=ROOT, stderr=subprocess.PIPE)
+    assert process.returncode != 0
+    assert b"PVCAM_DRIVER='simulate'" in process.stderr
+
+
+@pytest.mark.parametrize('module', ['Princeton_wrapper', 'easy_pvcam'])
+def test_camera_control_without_heavy_modules(module):
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + sys.path))
+    output = subprocess.check_output(
+        [sys.executable, '-c', "import sys, {0}; print(' '.join(sys.modules))".format(module)],
+        env=environment, cwd=ROOT)
+    loaded = set(name.split('.')[0] for name in output.decode().split())
+    assert not loaded & {'multiprocessing', 'pvcam_statistics', 'yaml', 'matplotlib', 'lmfit'}
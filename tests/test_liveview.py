@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import numpy
+
+import pvcam_liveview
+
+
+def test_frames_dropped_not_queued():
+    view = pvcam_liveview.LiveView(rate=1000.)
+    frames = [numpy.full((4, 6), i, dtype=numpy.uint16) for i in range(5)]
+    for frame in frames:
+        view.offer(frame)
+    assert (view.offered, view.dropped) == (5, 4)
+    assert view.latest() is None
+    with view:
+        preview = view.wait(timeout=1)
+        assert preview.index == 4 and view.latest() is preview
+        assert view.wait(timeout=0.05) is None  # nothing new offered
+        view.offer(frames[0], index=10)
+        assert view.wait(timeout=1).index == 10
+    assert view.stats()['offered'] == 6 and view.stats()['dropped'] == 4 and view.stats()['previews'] == 2
+
+
+def test_uint8_scaling():
+    view = pvcam_liveview.LiveView(maxShape=(50, 256), lower=0., upper=100., sample=50 * 250)
+    frame = (numpy.arange(100 * 1000) * 0.6).astype(numpy.uint16).reshape(100, 1000)
+    preview = view._preview(frame, 0, 0.)
+    assert preview.image.dtype == numpy.uint8 and preview.image.shape == (50, 250)  # binned 2 x 4
+    binned = frame.reshape(50, 2, 250, 4).mean(axis=(1, 3))
+    numpy.testing.assert_allclose((preview.low, preview.high), (binned.min(), binned.max()))
+    assert preview.image[0, 0] == 0 and preview.image[-1, -1] == 255
+    expected = (binned - binned.min()) * 255. / (binned.max() - binned.min())
+    assert numpy.abs(preview.image - expected).max() <= 0.5 + 1e-3
+
+
+def test_continuous_counts_the_frames(camera):
+    camera.changeLastExposureROI((0, 99, 1, 0, 9, 1))
+    frames = camera.telemetry.frames
+    view = pvcam_liveview.LiveView.continuous(camera, rate=100.)
+    offered = []
+    offer = view.offer
+
+    def recording(frame, index=None):
+        offered.append(index)
+        offer(frame, index)
+    view.offer = recording
+    with view:
+        previews = [view.wait(timeout=2) for i in range(3)]
+    assert [preview.image.shape for preview in previews] == [(10, 100)] * 3
+    assert offered == sorted(set(offered))
+    # every frame acquired is counted, not only the previewed ones
+    assert camera.telemetry.frames - frames == offered[-1] + 1
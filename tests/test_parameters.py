@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from Princeton_wrapper import Princeton, API
+
+
+def test_scratch_per_thread():
+    descriptor = Princeton.ParamTable['EXP_TIME']
+    scratch = []
+    thread = threading.Thread(target=lambda: scratch.append(descriptor.scratch))
+    thread.start()
+    thread.join()
+    assert descriptor.scratch is descriptor.scratch
+    assert scratch[0] is not descriptor.scratch
+
+
+def test_unknown_id_descriptor_cached():
+    paramId = (API.TYPE_UNS16 << 24) | (API.CLASS2 << 16) | 9999
+    camera = Princeton()
+    try:
+        descriptor = camera._descriptor(paramId)
+        assert descriptor.id == paramId
+        assert camera._descriptor(paramId) is descriptor
+    finally:
+        Princeton._unknownParams.pop(paramId, None)
+        camera.close()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def small(camera):
+    """camera with one small ROI."""
+    camera.changeLastExposureROI((0, 99, 1, 0, 9, 1))
+    return camera
+
+
+def test_chunks_in_order(small):
+    stages = [('frames', lambda index, images: len(images[0])), ('double', lambda index, frames: 2 * frames)]
+    with small.acquirePipelined(7, stages, chunk=2) as run:
+        results = list(run)
+    assert results == [(0, 4), (2, 4), (4, 4), (6, 2)]
+    stats = run.stats()
+    assert list(stats) == ['acquire', 'frames', 'double']
+    assert stats['acquire']['frames'] == 7
+    assert [stats[name]['items'] for name in stats] == [4, 4, 4]
+
+
+def test_bounded_queues(small):
+    release = threading.Event()
+
+    def blocked(index, images):
+        release.wait(5.)
+        return index
+    with small.acquirePipelined(20, [blocked], queueSize=1) as run:
+        time.sleep(0.2)
+        acquired = run.stats()['acquire']['items']
+        # one chunk in the stage, one in its queue, one waiting to be put
+        assert acquired <= 3
+        release.set()
+        assert [index for index, value in run] == list(range(20))
+    assert run.stats()['acquire']['waitOutput'] > 0
+
+
+def test_stage_error_ends_the_run(small):
+    def failing(index, images):
+        if index == 2:
+            raise ValueError('stage failed')
+        return index
+    run = small.acquirePipelined(10, [failing])
+    with pytest.raises(ValueError):
+        with run:
+            list(run)
+    assert not any(thread.is_alive() for thread in run._threads)
+    assert run.stats()['acquire']['frames'] < 10
+    images, infos = small.takePicture(optionDisplayMessage=False)  # sequence aborted
+    assert images[0][0].shape == (100, 10)
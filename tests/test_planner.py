@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import pvcam_planner
+from Princeton_wrapper import API, AttributeType
+
+
+def test_acquisition_does_not_write_speed(camera, monkeypatch):
+    written = []
+    setParameterValue = camera.setParameterValue
+
+    def recording(parameter, value):
+        written.append(camera._descriptor(parameter).id)
+        return setParameterValue(parameter, value)
+    monkeypatch.setattr(camera, 'setParameterValue', recording)
+    camera.numberPicturesToTake = 3
+    camera.takePicture(optionDisplayMessage=False)
+    camera.cameraTiming()
+    camera.planAcquisition(frames=1)
+    assert API.PARAM_SPDTAB_INDEX not in written
+    speed = camera.getParameterCachedValue(API.PARAM_SPDTAB_INDEX)
+    assert list(camera.cameraTiming().pixelTimes) == [speed]
+
+
+def test_all_speeds_restore_setup(camera):
+    speed = camera.getParameterCurrentValue(API.PARAM_SPDTAB_INDEX)
+    timing = camera.cameraTiming(speeds=None)
+    assert len(timing.pixelTimes) == camera.getParameterValue(API.PARAM_SPDTAB_INDEX, AttributeType.maxValue) + 1
+    assert camera.getParameterCurrentValue(API.PARAM_SPDTAB_INDEX) == speed
+
+
+def test_sequences_keep_a_copy_of_the_rois(camera):
+    camera.takePicture(optionDisplayMessage=False)
+    rois = camera._sequences[-1][2]
+    camera.addExposureROI((0, 9, 1, 0, 9, 1))
+    assert camera._sequences[-1][2] is rois
+    assert len(rois) == 1
+
+
+def test_search_reads_every_pixel():
+    timing = pvcam_planner.CameraTiming(1340, 400, 9.2e-6, 1e-7, {0: 1e-5, 1: 1e-6})
+    plans = pvcam_planner.search(timing, (0, 1339, 0, 399), signal=100., targetSnr=10.)
+    sbins = set(plan.rois[0][2] for plan in plans)
+    pbins = set(plan.rois[0][5] for plan in plans)
+    assert sbins == {1, 2, 4, 5, 10, 20, 67, 134, 268, 335, 670, 1340}
+    assert all(400 % pbin == 0 for pbin in pbins) and {1, 16, 25, 400} <= pbins
+    assert all(pvcam_planner.roiPixels(plan.rois[0]) * plan.rois[0][2] * plan.rois[0][5] == 1340 * 400
+               for plan in plans)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import Princeton_wrapper
+
+
+def test_take_picture_profiled(camera):
+    camera.changeLastExposureROI((0, 99, 1, 0, 9, 1))
+    profiler = camera.enableProfiling(history=2)
+    assert camera.profiler is profiler
+    for i in range(3):
+        camera.takePicture(optionDisplayMessage=False)
+    assert len(profiler.records) == 2  # history
+    phases = profiler.phases
+    # the status polled in between is named after the status seen
+    assert phases[:3] == ['setup', 'allocate', 'start'] and phases[-2:] == ['finish', 'convert'] and len(phases) == 6
+    summary = profiler.summary()
+    assert list(summary) == phases + ['total']
+    assert all(summary[phase]['count'] == 2 and summary[phase]['max'] > 0 for phase in summary)
+    for name in ('pl_exp_setup_seq', 'pl_buf_alloc', 'pl_exp_start_seq', 'pl_exp_finish_seq', 'pl_buf_free'):
+        assert profiler.last.calls[name] == 1
+        assert profiler.callCounts()[name] == 2
+    assert profiler.last.calls['pl_exp_check_status'] >= 1
+    assert camera.disableProfiling() is profiler and camera.profiler is None
+    assert not isinstance(Princeton_wrapper.API, Princeton_wrapper._CallCountingAPI)  # the proxy is removed
+    camera.takePicture(optionDisplayMessage=False)
+    assert len(profiler.records) == 2
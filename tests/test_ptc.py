@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import numpy
+import pytest
+
+import Princeton_wrapper
+import pvcam_ptc
+from Princeton_wrapper import ShutterOpenMode
+
+
+def _curve(conversionGain=2., readNoise=3., fullWell=40000.):
+    """(signal, variance) in ADU of a photon transfer curve saturating above fullWell."""
+    signal = numpy.geomspace(10, 60000, 14)
+    variance = signal / conversionGain + (readNoise / conversionGain) ** 2
+    saturated = signal > fullWell
+    variance[saturated] *= (fullWell / signal[saturated]) ** 2  # the pixels pile up at the full well
+    return signal, variance
+
+
+def test_fit_ptc():
+    signal, variance = _curve()
+    order = numpy.random.RandomState(0).permutation(len(signal))
+    conversionGain, intercept, fullWell, used = pvcam_ptc.fitPTC(signal[order], variance[order])
+    assert used == numpy.count_nonzero(signal <= 40000)
+    assert fullWell == signal[used - 1]
+    assert conversionGain == pytest.approx(2.)
+    assert intercept == pytest.approx((3. / 2.) ** 2)
+    with pytest.raises(ValueError):
+        pvcam_ptc.fitPTC([100, 200], [50, 20])
+
+
+def test_analyse():
+    points = []
+    for gain, conversionGain in ((1, 2.), (2, 1.)):
+        signal, variance = _curve(conversionGain)
+        darkVariance = 4.
+        for exposure, s, v in zip(numpy.arange(len(signal)) + 1., signal, variance):
+            points.append(pvcam_ptc.PTCPoint(0, gain, exposure, s, v + darkVariance, 600. + exposure, darkVariance, 4))
+    entries = pvcam_ptc.analyse(points)
+    assert [(entry.speed, entry.gain) for entry in entries] == [(0, 1), (0, 2)]
+    for entry, conversionGain in zip(entries, (2., 1.)):
+        assert entry.conversionGain == pytest.approx(conversionGain)
+        assert entry.readNoise == pytest.approx(2. * conversionGain)
+        assert entry.offset == 601.
+        assert entry.points == numpy.count_nonzero(_curve()[0] <= 40000)
+
+
+def test_gain_table_round_trip(tmp_path):
+    path = str(tmp_path / 'calibration' / 'chip_gain.json')
+    table = pvcam_ptc.GainTable('EEV 400x1340B', path)
+    table.add(pvcam_ptc.GainEntry(0, 1, 2.5, 7.5, 600., 40000., 11))
+    table.add(pvcam_ptc.GainEntry(1, 2, 1.2, None, None, 30000., 9))
+    table.save()
+    loaded = pvcam_ptc.GainTable.forChip('EEV400x1340B', path)
+    assert loaded.chip == 'EEV400x1340B'
+    assert list(loaded.entries.items()) == list(table.entries.items())
+    assert loaded.entry(1, 1) is None
+    assert len(pvcam_ptc.GainTable.forChip('EEV400x1340B', str(tmp_path / 'none.json'))) == 0
+
+
+def test_sweep(camera, monkeypatch):
+    monkeypatch.setattr(Princeton_wrapper.API.camera, 'cosmicRate', 0.)
+    camera.changeLastExposureROI((0, 99, 1, 0, 9, 1))
+
+    def shutter(opened):
+        camera.shutterOpenMode = ShutterOpenMode.preexposure if opened else ShutterOpenMode.never
+    setup = [camera.getParameterCurrentValue(name) for name in ('SPDTAB_INDEX', 'GAIN_INDEX', 'EXP_TIME')]
+    with pytest.raises(ValueError):
+        pvcam_ptc.sweep(camera, [1., 70.], shutter=shutter)  # EXP_TIME counts up to 65535 ms
+    points = pvcam_ptc.sweep(camera, [20., 1., 5., 10.], gains=[1, 2], frames=8, shutter=shutter)
+    assert [(p.gain, p.exposure) for p in points] == [(g, t) for g in (1, 2) for t in (1., 5., 10., 20.)]
+    assert setup == [camera.getParameterCurrentValue(name) for name in ('SPDTAB_INDEX', 'GAIN_INDEX', 'EXP_TIME')]
+    for entry, gain in zip(pvcam_ptc.analyse(points), (1, 2)):
+        # the simulated camera gives GAIN_INDEX electrons per ADU
+        assert entry.conversionGain == pytest.approx(gain, rel=0.1)
+        assert entry.offset == pytest.approx(600. + 5. / gain, abs=1.)  # bias and 1 s of dark current
+
+
+def test_electrons(easy_camera, monkeypatch):
+    columns = easy_camera._frameShapes()[0][1]
+    counts = numpy.random.RandomState(0).poisson(1000, (1, 1, columns)).astype(numpy.uint16)
+    monkeypatch.setattr(easy_camera, 'takePicture', lambda *args, **kwargs: ([[counts[0]]], [['metadata']]))
+    speed = easy_camera.getParameterCachedValue('SPDTAB_INDEX')
+    gain = easy_camera.getParameterCachedValue('GAIN_INDEX')
+    easy_camera.gainTable = pvcam_ptc.GainTable('EEV400x1340B', 'unused.json')
+    easy_camera.units = 'electrons'
+    with pytest.raises(ValueError):
+        easy_camera.measure()  # not calibrated
+    easy_camera.gainTable.add(pvcam_ptc.GainEntry(speed, gain, 2.5, 7.5, 600., 40000., 11))
+    spectrum, metadata = easy_camera.measure()
+    assert [repr(stage) for stage in easy_camera.processingPipeline().stages] == ['ToElectrons(2.5, offset=600)']
+    numpy.testing.assert_allclose(spectrum, (counts.ravel() - 600.) * 2.5, rtol=1e-6)
+    easy_camera.units = 'counts'
+    numpy.testing.assert_allclose(easy_camera.measure()[0], counts.ravel())
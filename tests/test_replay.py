@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+
+import numpy
+
+import pvcam_replay
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# played by the replay driver: 7 frames of the recording of 5, then kinetics, then an other ROI
+_PLAY = """
+import sys
+import numpy
+import Princeton_wrapper
+import pvcam_replay
+
+camera = Princeton_wrapper.Princeton()
+pvcam_replay.configure(camera)
+frames = [numpy.concatenate([image.reshape(len(image), -1) for image in images], axis=1)
+          for index, images in camera.streamSequence(7, chunk=3)]
+numpy.save(sys.argv[1], numpy.concatenate(frames))
+camera.enableKineticsMode(2)
+try:
+    camera.takePicture(optionDisplayMessage=False)
+except Princeton_wrapper.PrincetonError as error:
+    print(error.value)
+camera.disableKineticsMode()
+camera.changeLastExposureROI((0, 9, 1, 0, 9, 1))
+try:
+    camera.takePicture(optionDisplayMessage=False)
+except Princeton_wrapper.PrincetonError as error:
+    print(error.value)
+camera.close()
+"""
+
+
+def test_record_and_replay(camera, tmp_path):
+    camera.changeLastExposureROI((0, 99, 1, 0, 9, 1))
+    camera.addExposureROI((100, 149, 1, 10, 13, 2))
+    recording = pvcam_replay.record(camera, str(tmp_path / 'recording'), 5, chunk=2)
+    assert recording.frames.shape == (5, 10 * 100 + 2 * 50)
+    environment = dict(os.environ, PVCAM_DRIVER='replay', PVCAM_REPLAY=recording.path,
+                       PVCAM_REPLAY_TIMESCALE='0', PYTHONPATH=os.pathsep.join([ROOT] + sys.path))
+    played = str(tmp_path / 'played.npy')
+    output = subprocess.check_output([sys.executable, '-c', _PLAY, played], env=environment, cwd=ROOT)
+    codes = [word for word in output.decode().split() if word.isdigit()]
+    assert codes == ['2016', '3016']  # not a kinetics recording, ROI not in the recording
+    numpy.testing.assert_array_equal(numpy.load(played), recording.frames[[0, 1, 2, 3, 4, 0, 1]])
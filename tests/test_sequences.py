@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import numpy
+import pytest
+
+import Princeton_wrapper
+from Princeton_wrapper import SEQUENCE_MAX_FRAMES, ExposureUnits, ReadoutStatus
+
+
+def _stream(array):
+    """ctypes pixel stream under a view of streamSequence."""
+    while isinstance(array, numpy.ndarray):
+        array = array.base
+    return array
+
+
+@pytest.fixture
+def small(camera):
+    """camera with two small ROIs."""
+    camera.changeLastExposureROI((0, 99, 1, 0, 9, 1))
+    camera.addExposureROI((100, 149, 1, 10, 13, 2))
+    return camera
+
+
+def test_chunks_cover_the_frames(small):
+    indices, lengths, streams = [], [], []
+    for index, images in small.streamSequence(7, chunk=3):
+        assert [image.shape[1:] for image in images] == [(10, 100), (2, 50)]
+        assert len(images[0]) == len(images[1])
+        indices.append(index)
+        lengths.append(len(images[0]))
+        streams.append(id(_stream(images[0])))
+    assert lengths == [3, 3, 1]
+    assert indices == [0, 3, 6]
+    assert streams[0] == streams[2] != streams[1]  # the two pixel streams in turn
+
+
+def test_acquire_sequence(small):
+    chunks = []
+    assert small.acquireSequence(5, lambda index, images: chunks.append((index, images[0].copy())), chunk=2) == 5
+    assert [index for index, image in chunks] == [0, 2, 4]
+    assert numpy.concatenate([image for index, image in chunks]).shape == (5, 10, 100)
+
+
+def test_chunk_size(small):
+    frameBytes = 2 * (10 * 100 + 2 * 50)
+    assert small.sequenceChunkSize(5) == 5
+    assert small.sequenceChunkSize(10 ** 6, maxMemory=2 ** 40) == SEQUENCE_MAX_FRAMES
+    assert small.sequenceChunkSize(100, maxMemory=2 * frameBytes * 3 + 1) == 3
+    with pytest.raises(ValueError):
+        small.sequenceChunkSize(100, maxMemory=2 * frameBytes - 1)
+    with pytest.raises(ValueError):
+        next(small.streamSequence(100, maxMemory=frameBytes))
+
+
+def test_closed_stream_aborts(small, monkeypatch):
+    aborted = []
+    abortExposure = small._abortExposure
+
+    def recording(pixelStream):
+        aborted.append(pixelStream)
+        return abortExposure(pixelStream)
+    monkeypatch.setattr(small, '_abortExposure', recording)
+    stream = small.streamSequence(6, chunk=2)
+    next(stream)
+    stream.close()
+    assert len(aborted) == 1
+    images, infos = small.takePicture(optionDisplayMessage=False)
+    assert images[0][0].shape == (100, 10)  # (sizei, sizej) of convertStream
+
+
+def test_kinetics_cubes(camera):
+    camera.setExposureTime(2, ExposureUnits.millisecond)
+    camera.enableKineticsMode(40, 9200)
+    try:
+        cube, offsets = camera.takeKinetics()
+        assert cube.shape == (400 // 40, 40, 1340)
+        numpy.testing.assert_allclose(offsets, numpy.arange(10) * (2e-3 + 40 * 9200e-9))
+        again, offsets = camera.takeKinetics()
+        assert not numpy.shares_memory(cube, again)
+        readouts = [(index, cube.copy()) for index, cube, offsets in camera.streamKinetics(3, chunk=2)]
+        assert [index for index, cube in readouts] == [0, 1, 2]
+        assert all(cube.shape == (10, 40, 1340) for index, cube in readouts)
+    finally:
+        camera.disableKineticsMode()
+
+
+def test_triggered_run(small, monkeypatch):
+    finished, aborted = [], []
+    monkeypatch.setattr(small, 'finishExposureSequential', finished.append)
+    monkeypatch.setattr(small, '_abortExposure', aborted.append)
+    run = small.armTriggeredRun(4)
+    frames = list(run)
+    assert [frame.index for frame in frames] == [0, 1, 2, 3]
+    assert [image.shape for image in frames[0].images] == [(10, 100), (2, 50)]
+    assert run.received == 4 and not run.timedOut
+    assert len(finished) == 1 and not aborted
+    with small.armTriggeredRun(4) as run:
+        for frame in run:
+            break
+    assert len(finished) == 1 and len(aborted) == 1
+
+
+def test_triggered_run_missed(small, monkeypatch):
+    run = small.armTriggeredRun(5, triggerPeriod=0.01)
+    dropped = small.telemetry.droppedFrames
+    now = [0.]
+    # (time, frames read out) of each status check: triggers 1 and 4 are missed
+    checks = iter([(0., 1), (0.02, 2), (0.03, 3), (0.06, 5)])
+
+    def exposureCheckStatus():
+        now[0], frames = next(checks)
+        return '', ReadoutStatus.readoutInProgress.value, frames * 2 * run._frameSize
+    monkeypatch.setattr(small, 'exposureCheckStatus', exposureCheckStatus)
+    monkeypatch.setattr(Princeton_wrapper.time, 'time', lambda: now[0])
+    triggers = [frame.trigger for frame in run]
+    assert triggers == [0, 2, 3, 5, 6]
+    assert run.missed == [1, 4]
+    assert small.telemetry.droppedFrames - dropped == 2
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import Princeton_wrapper
+from Princeton_wrapper import Princeton, pvcamSession
+
+
+def test_close_releases_session():
+    count = pvcamSession.count
+    camera = Princeton()
+    assert pvcamSession.count == count + 1
+    camera.close()
+    assert pvcamSession.count == count
+    camera.close()
+    assert pvcamSession.count == count
+
+
+def test_failed_open_releases_camera_and_session(monkeypatch):
+    count = pvcamSession.count
+
+    def failing(self):
+        raise Princeton_wrapper.PrincetonError(2)
+    monkeypatch.setattr(Princeton, 'getCameraSize', failing)
+    with pytest.raises(Princeton_wrapper.PrincetonError):
+        Princeton()
+    assert pvcamSession.count == count
+    monkeypatch.undo()
+    Princeton().close()  # the camera was closed
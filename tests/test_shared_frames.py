@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import numpy
+import pytest
+
+import shared_frames
+
+
+@pytest.fixture
+def publisher():
+    publisher = shared_frames.FramePublisher(4 * 12, slots=4, dtype=None)
+    yield publisher
+    publisher.close()
+
+
+def test_frames_keep_their_dtype(publisher):
+    subscriber = shared_frames.FrameSubscriber(publisher.name, startAtLatest=False)
+    try:
+        calibrated = numpy.linspace(0, 1, 12, dtype=numpy.float32).reshape(3, 4)
+        publisher.publish(numpy.arange(12, dtype=numpy.uint16).reshape(3, 4))
+        publisher.publish(calibrated)
+        assert subscriber.next(timeout=1).data.dtype == numpy.uint16
+        frame = subscriber.next(timeout=1)
+        assert frame.data.dtype == numpy.float32
+        numpy.testing.assert_array_equal(frame.data, calibrated)
+    finally:
+        subscriber.close()
+
+
+def test_lossy_conversion_refused():
+    publisher = shared_frames.FramePublisher(2 * 12, slots=4)
+    try:
+        with pytest.raises(ValueError):
+            publisher.publish(numpy.full((3, 4), 0.5, dtype=numpy.float32))
+    finally:
+        publisher.close()
+
+
+def test_cube_refused_by_publish_split_by_publishImages(publisher):
+    cube = numpy.zeros((2, 3, 4), dtype=numpy.uint16)
+    with pytest.raises(ValueError):
+        publisher.publish(cube)
+    assert publisher.publishImages([[cube]]) == 2
+
+
+def test_integer_frames_checked():
+    publisher = shared_frames.FramePublisher(2 * 12, slots=4)
+    try:
+        publisher.publish(numpy.arange(12, dtype=numpy.int64).reshape(3, 4))
+        with pytest.raises(ValueError):
+            publisher.publish(numpy.full((3, 4), -1, dtype=numpy.int64))
+    finally:
+        publisher.close()
+
+
+@pytest.mark.parametrize('dtype', [numpy.uint16, None])
+def test_run_on_camera(camera, dtype):
+    camera.changeLastExposureROI((0, 99, 1, 0, 9, 1))
+    publisher = shared_frames.FramePublisher.forCamera(camera, slots=4, dtype=dtype)
+    subscriber = shared_frames.FrameSubscriber(publisher.name, startAtLatest=False)
+    try:
+        camera.numberPicturesToTake = 2
+        assert publisher.run(camera, count=1) == 1
+        frames = [subscriber.next(timeout=1) for i in range(2)]
+        assert [frame.exposure for frame in frames] == [0, 1]
+        assert frames[0].data.shape == (100, 10)
+        assert frames[0].data.dtype == (numpy.uint16 if dtype else numpy.asarray([0]).dtype)
+        assert frames[0].data.min() > 0
+        del frames
+    finally:
+        subscriber.close()
+        publisher.close()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import numpy
+import pytest
+
+import pvcam_statistics
+from pvcam_statistics import PixelStatistics
+
+
+def _frames(number, seed=0):
+    random = numpy.random.RandomState(seed)
+    return (600 + 30 * random.standard_normal((number, 4, 5))).astype(numpy.uint16)
+
+
+def _check(statistics, frames):
+    assert statistics.count == len(frames)
+    numpy.testing.assert_allclose(statistics.mean, frames.mean(axis=0), rtol=1e-12)
+    numpy.testing.assert_allclose(statistics.variance, frames.var(axis=0, ddof=1), rtol=1e-9)
+    numpy.testing.assert_array_equal(statistics.min, frames.min(axis=0))
+    numpy.testing.assert_array_equal(statistics.max, frames.max(axis=0))
+    assert statistics.min.dtype == frames.dtype
+
+
+def test_update_by_blocks():
+    frames = _frames(3 * pvcam_statistics.BLOCK_FRAMES + 5)
+    statistics = PixelStatistics((4, 5))
+    statistics.update(frames[0])  # one frame
+    statistics.update(frames[1:8])
+    statistics.update(frames[8:])  # several blocks
+    _check(statistics, frames)
+    with pytest.raises(ValueError):
+        statistics.update(numpy.zeros((2, 5, 4), numpy.uint16))
+
+
+def test_merge():
+    frames = _frames(45)
+    parts = [PixelStatistics(), PixelStatistics(), PixelStatistics()]
+    for statistics, (start, stop) in zip(parts, [(0, 1), (1, 20), (20, 45)]):
+        statistics.update(frames[start:stop])
+    _check(PixelStatistics.combine(parts), frames)
+    assert PixelStatistics().merge(parts[0]).merge(PixelStatistics()).count == 1
+    with pytest.raises(ValueError):
+        parts[0].merge(_zeros((2, 5, 4)))
+
+
+def _zeros(shape):
+    statistics = PixelStatistics()
+    statistics.update(numpy.zeros(shape, numpy.uint16))
+    return statistics
+
+
+def test_reset():
+    statistics = PixelStatistics()
+    statistics.update(_frames(20, seed=1) + 1000)  # extremes out of the range of the next frames
+    statistics.reset()
+    assert statistics.count == 0
+    frames = _frames(20)
+    statistics.update(frames)
+    _check(statistics, frames)
+
+
+def test_acquire_statistics(camera, monkeypatch):
+    camera.changeLastExposureROI((0, 99, 1, 0, 9, 1))
+    camera.addExposureROI((100, 149, 1, 10, 13, 2))
+    acquired = [[], []]
+    streamSequence = camera.streamSequence
+
+    def recording(*args, **kwargs):
+        for index, images in streamSequence(*args, **kwargs):
+            for frames, image in zip(acquired, images):
+                frames.append(image.copy())
+            yield index, images
+    monkeypatch.setattr(camera, 'streamSequence', recording)
+    statistics = camera.acquireStatistics(20, chunk=6)
+    assert [s.shape for s in statistics] == [(10, 100), (2, 50)]
+    for s, frames in zip(statistics, acquired):
+        _check(s, numpy.concatenate(frames))
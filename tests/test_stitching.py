@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import numpy
+import pytest
+
+import pvcam_stitching
+
+
+def _window(low, high, factor=1., rows=None):
+    """(wavelengths, spectrum) of a linear spectrum measured from low to high, step 0.5."""
+    wavelengths = numpy.arange(low, high + 0.25, 0.5)
+    spectrum = factor * (1 + 0.01 * wavelengths)
+    return wavelengths, spectrum if rows is None else numpy.tile(spectrum, (rows, 1))
+
+
+def test_grid_grows_both_ways():
+    stitcher = pvcam_stitching.SpectralStitcher()
+    stitcher.add(*_window(500, 510))
+    stitcher.add(*_window(490, 502))
+    wavelengths, spectrum = _window(505, 520)
+    stitcher.add(wavelengths[::-1], spectrum[::-1])  # decreasing axis
+    wavelengths, spectrum = stitcher.merged()
+    numpy.testing.assert_allclose(wavelengths, numpy.arange(490, 520.25, 0.5))
+    numpy.testing.assert_allclose(spectrum, 1 + 0.01 * wavelengths)
+    assert [window[:2] for window in stitcher.windows] == [(500, 510), (490, 502), (505, 520)]
+
+
+def test_gaps_are_nan():
+    wavelengths, spectrum = pvcam_stitching.stitch([_window(0, 10, rows=3), _window(20, 30, rows=3)])
+    assert spectrum.shape == (3, wavelengths.size)
+    gap = (wavelengths > 10) & (wavelengths < 20)
+    assert numpy.count_nonzero(gap) == 19 and numpy.isnan(spectrum[:, gap]).all()
+    numpy.testing.assert_allclose(spectrum[:, ~gap], numpy.tile(1 + 0.01 * wavelengths[~gap], (3, 1)))
+    with pytest.raises(ValueError):
+        pvcam_stitching.stitch([_window(0, 10, rows=3), _window(20, 30, rows=2)])
+
+
+def test_overlap_scaling():
+    stitcher = pvcam_stitching.SpectralStitcher(scale=True)
+    assert stitcher.add(*_window(500, 510)) == 1.
+    assert stitcher.add(*_window(505, 520, factor=2.)) == pytest.approx(0.5)
+    assert stitcher.add(*_window(530, 540, factor=3.)) == 1.  # no overlap
+    wavelengths, spectrum = stitcher.merged()
+    covered = ~numpy.isnan(spectrum)
+    numpy.testing.assert_allclose(spectrum[covered], (1 + 0.01 * wavelengths[covered]) *
+                                  numpy.where(wavelengths[covered] >= 530, 3., 1.))
+
+
+class _Camera(object):
+    """measure() of the spectrum at the current position of the spectrometer."""
+
+    def __init__(self):
+        self.position = None
+        self.measured = []
+
+    def measure(self, **options):
+        self.measured.append((self.position, options))
+        return _window(self.position - 10, self.position + 10)[1], 'metadata'
+
+
+def _axis(position):
+    return _window(position - 10, position + 10)[0]
+
+
+def test_step_and_glue():
+    camera = _Camera()
+    threads = []
+
+    def move(position):
+        threads.append(threading.current_thread().name)
+        camera.position = position
+    stitcher = pvcam_stitching.stepAndGlue(camera, [500, 515, 530], move, _axis, exposure=1.)
+    assert camera.measured == [(500, {'exposure': 1.}), (515, {'exposure': 1.}), (530, {'exposure': 1.})]
+    assert threads[0] == threading.current_thread().name and threads[1:] == ['stepAndGlue move'] * 2
+    wavelengths, spectrum = stitcher.merged()
+    numpy.testing.assert_allclose(spectrum, 1 + 0.01 * wavelengths)
+
+
+def test_step_and_glue_move_error():
+    camera = _Camera()
+
+    def move(position):
+        if position == 515:
+            raise RuntimeError('stuck grating')
+        camera.position = position
+    stitcher = pvcam_stitching.SpectralStitcher()
+    with pytest.raises(RuntimeError, match='stuck grating'):
+        pvcam_stitching.stepAndGlue(camera, [500, 515, 530], move, _axis, stitcher)
+    assert [position for position, options in camera.measured] == [500]
+    assert len(stitcher.windows) == 1  # the window measured before the error is merged
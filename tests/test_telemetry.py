@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+
+try:
+    from urllib.request import urlopen
+except ImportError:  # python 2
+    from urllib2 import urlopen
+
+import Princeton_wrapper
+import pvcam_telemetry
+
+
+class _CallRecordingAPI(object):
+    """Records the pl_* calls made by other threads than the cooling monitor."""
+
+    def __init__(self, api):
+        self._api = api
+        self.calls = []
+
+    def __getattr__(self, name):
+        value = getattr(self._api, name)
+        if not name.startswith('pl_'):
+            return value
+
+        def recorded(*args):
+            if threading.current_thread().name != 'CoolingMonitor':
+                self.calls.append(name)
+            return value(*args)
+        return recorded
+
+
+def test_label_escaped():
+    assert pvcam_telemetry._escapeLabel('a\\b "c"\nd') == 'a\\\\b \\"c\\"\\nd'
+
+
+def test_scrape_without_driver_calls(camera, monkeypatch):
+    monitor = camera.startCoolingMonitor(interval=0.01)
+    assert monitor.waitUntilStable(tolerance=0.5, holdTime=0.02, timeout=5.)
+    camera.numberPicturesToTake = 3
+    camera.takePicture(optionDisplayMessage=False)
+    setpoint = camera.getParameterCurrentValue('TEMP_SETPOINT') / 100.
+    api = _CallRecordingAPI(Princeton_wrapper.API)
+    monkeypatch.setattr(Princeton_wrapper, 'API', api)
+    server = pvcam_telemetry.TelemetryServer([camera], port=0).start()
+    try:
+        metrics = urlopen(server.url + '/metrics').read().decode('utf-8')
+        snapshot = json.loads(urlopen(server.url + '/snapshot').read().decode('utf-8'))
+    finally:
+        server.stop()
+    assert not api.calls
+    values = dict(line.rsplit(' ', 1) for line in metrics.splitlines() if not line.startswith('#'))
+    label = '{{camera="{0}"}}'.format(pvcam_telemetry._cameraName(camera))
+    assert float(values['pvcam_temperature_setpoint_celsius' + label]) == setpoint
+    assert values['pvcam_temperature_stable' + label] == '1'
+    assert values['pvcam_frames_total' + label] == '3'
+    assert values['pvcam_acquisitions_total' + label] == '1'
+    cameraSnapshot, = snapshot['cameras']
+    assert cameraSnapshot['camera'] == pvcam_telemetry._cameraName(camera)
+    assert cameraSnapshot['pvcam_temperature_celsius'] == setpoint
+    assert cameraSnapshot['pvcam_frames_total'] == 3
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import json
+
+import numpy
+import pytest
+
+import pvcam_wavelength as pw
+
+FULL = (0, 1339, 1, 0, 399, 1)
+
+
+def _grating(**options):
+    return pw.GratingCalibration(grooves=1200, focalLength=300, inclusionAngle=30, **options)
+
+
+@pytest.mark.parametrize('detectorAngle', [0., 5.])
+def test_grating_axis(detectorAngle):
+    axes = pw.WavelengthAxes(_grating(opticalCenter=500, detectorAngle=detectorAngle), 20000, 1340)
+    axis = axes.axis(FULL, center=546.1)
+    assert axis[500] == pytest.approx(546.1, abs=1e-9)
+    assert numpy.all(numpy.diff(axis) > 0)
+    reverse = pw.WavelengthAxes(_grating(opticalCenter=500, detectorAngle=detectorAngle, reverse=True), 20000, 1340)
+    numpy.testing.assert_allclose(reverse.axis(FULL, center=546.1)[500 - 100:500 + 101], axis[500 + 100:500 - 101:-1])
+    # the middle of the chip by default, at the center of the binned pixels
+    middle = pw.WavelengthAxes(_grating(detectorAngle=detectorAngle), 20000, 1340)
+    binned = middle.axis((0, 1339, 2, 0, 399, 400), center=546.1)
+    assert binned.size == 670 and numpy.mean(binned[334:336]) == pytest.approx(546.1, abs=1e-3)
+    with pytest.raises(ValueError):
+        axes.axis(FULL, center=None)
+
+
+def test_axes_cached():
+    axes = pw.WavelengthAxes(_grating(), 20000, 1340)
+    axis = axes.axis(FULL, center=546.1)
+    assert not axis.flags.writeable
+    assert axes.axis((0, 1339, 1, 10, 20, 11), center=546.1) is axis  # the rows do not change the axis
+    assert axes.axis(FULL, center=600.) is not axis
+    assert axes.axis((0, 1339, 2, 0, 399, 1), center=546.1).size == 670
+    grid = pw.uniformGrid(540, 550, 0.5)
+    assert axes.resampler(FULL, grid, 546.1) is axes.resampler(FULL, grid.copy(), 546.1)
+    axes.clear()
+    assert axes.axis(FULL, center=546.1) is not axis
+
+
+def test_easy_pvcam_axis_and_resampler(easy_camera):
+    easy_camera.wavelengthCalibration = _grating(reverse=True)
+    easy_camera.centerWavelength = 546.1
+    axis = easy_camera.wavelengths()
+    assert easy_camera.wavelengths() is axis and axis.size == easy_camera._frameShapes()[0][1]
+    assert axis[0] > axis[-1]  # descending
+    grid = pw.uniformGrid(540, 550, 0.25)
+    stage = easy_camera.wavelengthResampler(grid)
+    assert easy_camera.wavelengthResampler(grid) is stage
+    spectra = numpy.array([2 * axis - 1000, 3 * axis]).reshape(2, 1, -1).astype(numpy.float32)
+    out = numpy.empty(stage.outputShape(spectra.shape), dtype=numpy.float32)
+    stage.apply(spectra, out)
+    numpy.testing.assert_allclose(out[:, 0], [2 * grid - 1000, 3 * grid], rtol=1e-5)
+    resampled = easy_camera._axes().resample(spectra[1, 0], easy_camera.ROI[0], grid, 546.1)
+    numpy.testing.assert_allclose(resampled, 3 * grid, rtol=1e-5)
+    easy_camera.wavelengthCalibration = None
+    with pytest.raises(ValueError):
+        easy_camera.wavelengths()
+
+
+def test_table_extrapolation():
+    table = pw.TableCalibration([40, 10, 20], [530, 500, 510], center=520)
+    numpy.testing.assert_allclose(table.wavelengths([0, 10, 15, 30, 40, 50]), [490, 500, 505, 520, 530, 540])
+    numpy.testing.assert_allclose(table.wavelengths([0, 50], center=525), [495, 545])  # shifted
+    with pytest.raises(ValueError):
+        pw.TableCalibration([10], [500])
+
+
+@pytest.mark.parametrize('calibration', [_grating(opticalCenter=600, correction=[1e-6, 0.]),
+                                         pw.PolynomialCalibration([1e-5, 0.1, 480.], center=546.1),
+                                         pw.TableCalibration([10, 20, 40], [500, 510, 530])])
+def test_save_load(tmp_path, calibration):
+    path = str(tmp_path / 'calibration' / 'chip_wavelength.json')
+    pw.saveCalibration(calibration, path)
+    loaded = pw.loadCalibration(path)
+    assert type(loaded) is type(calibration) and loaded.toDict() == calibration.toDict()
+    columns = pw.roiColumns(FULL)
+    numpy.testing.assert_array_equal(loaded.wavelengths(columns, 550., 20000, 1340),
+                                     calibration.wavelengths(columns, 550., 20000, 1340))
+
+
+def test_load_errors(tmp_path):
+    assert pw.loadCalibration(str(tmp_path / 'none.json')) is None
+    path = tmp_path / 'prism.json'
+    path.write_text(json.dumps({'kind': 'prism', 'parameters': {}}))
+    with pytest.raises(ValueError):
+        pw.loadCalibration(str(path))